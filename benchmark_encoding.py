@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+#benchmark of the pattern encoders on the images in test_patterns
+
+import glob
+from time import perf_counter
+import numpy as np
+import pyDMD.DMDPattern as dp
+
+def best_time(function, *args, repeats=5):
+    times = []
+    for i in range(repeats):
+        start = perf_counter()
+        function(*args)
+        times.append(perf_counter() - start)
+    return min(times)
+
+speedups = []
+for file in sorted(glob.glob('test_patterns/*')):
+    pattern = dp.DMDPattern(compression='rle', cache=None)
+    pattern.load_png(file)
+    pattern_3d = pattern.color_pattern(pattern.pattern)
+
+    reference, reference_length = pattern.rle_compressed_image(pattern_3d)
+    fast, fast_length = pattern.fast_rle_compressed_image(pattern_3d)
+    identical = np.array_equal(np.array(reference, dtype=np.uint8), fast)
+
+    t_reference = best_time(pattern.rle_compressed_image, pattern_3d, repeats=2)
+    t_fast = best_time(pattern.fast_rle_compressed_image, pattern_3d, repeats=20)
+    speedups.append(t_reference/t_fast)
+    print("%s: rle %.1f ms, fast rle %.2f ms, speedup %.0fx, identical: %s" 
+          %(file, 1e3*t_reference, 1e3*t_fast, t_reference/t_fast, identical))
+
+    erle, erle_length = pattern.erle_compressed_image(pattern_3d)
+    round_trip = np.array_equal(pattern.erle_decompressed_image(erle), pattern_3d.astype(np.uint8))
+    t_erle = best_time(pattern.erle_compressed_image, pattern_3d)
+    print("    erle %.2f ms, %s bytes instead of %s, round trip: %s" %(1e3*t_erle, erle_length, fast_length, round_trip))
+
+print("fast rle speedup %.0fx to %.0fx, target 50x %s" 
+      %(min(speedups), max(speedups), "met on all patterns" if min(speedups) >= 50 else "NOT met on all patterns"))
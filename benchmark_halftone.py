@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+#benchmark of the halftoning methods on 1920x1080 grayscale frames
+
+from time import perf_counter
+import numpy as np
+from pyDMD.Halftone import Halftone, blue_noise_matrix
+import pyDMD.DMDPattern as dp
+
+def frames_per_second(halftone, frames, repeats=3):
+    halftone.to_bits(frames[:1]) # threshold matrices are made on the first call
+    best = np.inf
+    for i in range(repeats):
+        start = perf_counter()
+        halftone.to_bits(frames)
+        best = min(best, perf_counter() - start)
+    return len(frames)/best
+
+pattern = dp.DMDPattern(bit_depth=8, cache=None)
+pattern.load_png('test_patterns/grayscale.png')
+gray = pattern.pattern[:, :, 0]
+frames = np.stack([np.roll(gray, 37*i, axis=1) for i in range(16)])
+
+start = perf_counter()
+blue_noise_matrix()
+print("blue noise matrix: %.2f s (once per process)" %(perf_counter() - start))
+
+for method in ['threshold', 'bayer', 'blue_noise', 'error_diffusion']:
+    for batch in [1, 16]:
+        fps = frames_per_second(Halftone(method), frames[:batch], repeats=3 if method != 'error_diffusion' else 1)
+        print("%s, batches of %s frames: %.1f frames/s" %(method, batch, fps))
+
+halftoned = dp.DMDPattern(compression='erle', compact=True)
+halftoned.set_packed_pattern(Halftone('blue_noise').to_bits(gray))
+print("blue noise halftone of grayscale.png: %s bytes erle" %len(halftoned.compress_pattern()))
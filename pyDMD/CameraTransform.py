@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+import numpy as np
+import cv2
+import pyDMD.DMDPattern as dp
+from pyDMD.Halftone import Halftone
+
+
+class CameraTransform():
+    map_cache = OrderedDict() # remap tables shared by all transforms with the same calibration
+
+    def __init__(self, calibration, camera_shape, interpolation=cv2.INTER_LINEAR,
+                 resolution=(1920, 1080), max_cached_maps=4):
+        """
+
+        Warps images from camera coordinates onto the DMD grid. The cv2.remap
+        tables for the DMD grid are computed once per calibration and kept
+        in a class wide cache, so every frame only costs the remap itself.
+
+        Parameters
+        ----------
+        calibration : TYPE: numpy array
+            DESCRIPTION: 2x3 affine matrix or 3x3 homography that maps camera
+            pixel coordinates (x, y) to DMD pixel coordinates.
+
+        camera_shape : TYPE: tuple
+            DESCRIPTION: (height, width) of the camera images
+
+        interpolation : TYPE, optional: int
+            DESCRIPTION. The default is cv2.INTER_LINEAR. Interpolation of remap.
+
+        resolution : TYPE, optional: tuple
+            DESCRIPTION. The default is (1920, 1080). (width, height) of the DMD.
+
+        max_cached_maps : TYPE, optional: int
+            DESCRIPTION. The default is 4. Number of remap tables kept in the
+            cache, about 12 MB each at full resolution.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        calibration = np.asarray(calibration, dtype=np.float64)
+        if calibration.shape == (2, 3):
+            calibration = np.vstack((calibration, [0, 0, 1]))
+        if calibration.shape != (3, 3):
+            raise Exception("The calibration has to be a 2x3 affine matrix or a 3x3 homography.")
+        self.calibration = calibration
+        self.camera_shape = tuple(camera_shape[:2])
+        self.interpolation = interpolation
+        self.resolution = resolution
+        self.max_cached_maps = max_cached_maps
+        self.halftones = {} # Halftone per method, they keep their threshold matrices
+
+    def maps(self):
+        """
+        :return the two fixed point remap tables for the DMD grid, from the cache if possible
+        """
+        key = (self.calibration.tobytes(), self.camera_shape, self.resolution)
+        if key in self.map_cache:
+            self.map_cache.move_to_end(key)
+            return self.map_cache[key]
+
+        width, height = self.resolution
+        dmd_x, dmd_y = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        inverse = np.linalg.inv(self.calibration) # DMD pixel -> camera pixel
+        source = np.tensordot(inverse, np.stack((dmd_x, dmd_y, np.ones_like(dmd_x))), axes=1)
+        map_x = (source[0]/source[2]).astype(np.float32)
+        map_y = (source[1]/source[2]).astype(np.float32)
+        maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+        self.map_cache[key] = maps
+        while len(self.map_cache) > self.max_cached_maps:
+            self.map_cache.popitem(last=False)
+        return maps
+
+    def apply(self, images, out=None):
+        """
+
+        Warp one camera image or a stack of them onto the DMD grid, pixels
+        outside of the camera image are 0.
+
+        Parameters
+        ----------
+        images : TYPE: numpy array
+            DESCRIPTION: (height, width) image or (N, height, width) stack in
+            camera coordinates
+
+        out : TYPE, optional: numpy array
+            DESCRIPTION. The default is None. (N, 1080, 1920) array to write
+            into, e.g. to reuse it for every frame of a feedback loop.
+
+        Returns
+        -------
+        warped : TYPE: numpy array
+            DESCRIPTION: (N, 1080, 1920) array with the dtype of images
+
+        """
+
+        images = np.asarray(images)
+        if images.ndim == 2:
+            images = images[None]
+        if images.shape[1:3] != self.camera_shape:
+            raise Exception("Images have shape %s, the calibration is for %s." %(images.shape[1:3], self.camera_shape))
+        map_xy, map_interpolation = self.maps()
+        if self.interpolation == cv2.INTER_NEAREST:
+            map_interpolation = None # remap misreads the fractions table with nearest neighbour
+        width, height = self.resolution
+        if out is None:
+            out = np.empty((len(images), height, width), dtype=images.dtype)
+        for image, warped in zip(images, out):
+            cv2.remap(image, map_xy, map_interpolation, self.interpolation, dst=warped,
+                      borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        return out
+
+    def to_bits(self, images, threshold=128, dither=False):
+        """
+
+        Warp images and reduce them to 1 bit.
+
+        Parameters
+        ----------
+        images : TYPE: numpy array
+            DESCRIPTION: (height, width) image or (N, height, width) stack
+
+        threshold : TYPE, optional: float
+            DESCRIPTION. The default is 128. Pixels >= threshold are on.
+
+        dither : TYPE, optional: Bool or string
+            DESCRIPTION. The default is False. If True, ordered dithering with
+            a Bayer matrix instead of the threshold, or the name of a Halftone
+            method, e.g. 'blue_noise' or 'error_diffusion'.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (N, 1080, 240) array of uint8's, rows packed like np.packbits
+
+        """
+
+        warped = self.apply(images)
+        method = 'bayer' if dither is True else (dither or 'threshold')
+        if method not in self.halftones:
+            self.halftones[method] = Halftone(method)
+        return self.halftones[method].to_bits(warped, threshold)
+
+    def dmd_patterns(self, images, threshold=128, dither=False, **settings):
+        """
+        :param stack of camera images, threshold and dither as in to_bits, settings for the DMDPatterns, e.g. compression
+        :return list of compact DMDPatterns with bit_depth 1, one per image
+        """
+        settings.update({'compact': True, 'bit_depth': 1})
+        dmd_patterns = []
+        for packed in self.to_bits(images, threshold, dither):
+            dmd_pattern = dp.DMDPattern(**settings)
+            dmd_pattern.set_packed_pattern(packed, self.resolution[0])
+            dmd_patterns.append(dmd_pattern)
+        return dmd_patterns
+
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+import time
+import queue
+import threading
+from collections import Counter
+import numpy as np
+from pyDMD.USBdevice import USBdevice
+from pyDMD.Transport import Transport, continuation_count
+from pyDMD.DMDPattern import DMDPattern
+from pyDMD.MemoryPlanner import DLPC900_MEMORY_BYTES
+
+
+class DLPC900Emulator(Transport):
+    def __init__(self, latency=1e-3, bandwidth=1e6, realtime=False, decode=True,
+                 max_images=None, memory_bytes=DLPC900_MEMORY_BYTES, resolution=(1920, 1080)):
+        """
+
+        Software model of the DLPC900 behind the USB transport. It collects
+        the reports of every command, executes the commands used by
+        LightCrafter6500 (display mode, LUT definition and configuration,
+        start/stop, trigger, image uploads with 0x1A2A/0x1A2B) and answers
+        like the controller, with sequence byte and error bit. Uploaded
+        images are written byte by byte into an image memory, starting a
+        sequence decodes the images of its LUT from there.
+
+        Parameters
+        ----------
+        latency : TYPE, optional: float
+            DESCRIPTION. The default is 1e-3. Seconds from the last report of a
+            command to its answer. Commands are answered independently, so
+            commands in flight (see CommandWindow) share the latency.
+
+        bandwidth : TYPE, optional: float
+            DESCRIPTION. The default is 1e6. Bytes per second of the USB link,
+            None for no transfer time.
+
+        realtime : TYPE, optional: Bool
+            DESCRIPTION. The default is False. If True, write waits for the
+            transfer time and the answers arrive latency later from a thread,
+            so the time the host spends waiting counts. If False, answers are
+            given at once and elapsed is the time of a host that never waits.
+
+        decode : TYPE, optional: Bool
+            DESCRIPTION. The default is True. Decode the images of a sequence
+            into images when it starts, False only checks their headers.
+
+        max_images : TYPE, optional: int
+            DESCRIPTION. The default is None. Number of image indexes, higher
+            indexes give error 17. None for no limit.
+
+        memory_bytes : TYPE, optional: int
+            DESCRIPTION. The default is DLPC900_MEMORY_BYTES. Size of the image
+            memory, uploads that do not fit give error 8. None for no limit.
+            Images are loaded from the highest index down, the controller puts
+            an image right after the image of the next higher index that the
+            configured LUT uses, at 0 if there is none. An upload overwrites
+            whatever was in its bytes, other images are not touched. Starting
+            a sequence whose images are not in the memory gives error 7.
+
+        resolution : TYPE, optional: tuple
+            DESCRIPTION. The default is (1920, 1080).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.realtime = realtime
+        self.decode = decode
+        self.max_images = max_images
+        self.memory_bytes = memory_bytes
+        self.resolution = resolution
+        self.reply_handler = None
+
+        self.mode = 0 # 0 video, 1 pre-stored pattern, 2 video pattern, 3 pattern on the fly
+        self.sequence_state = 'stop'
+        self.registers = {} # data of the last write per usb code without own handling
+        self.lut = {} # pattern index -> LUT entry
+        self.lut_configuration = None # (number of patterns, number of repeats)
+        self.trigger_in_1 = (105, True) # (delay, rising edge)
+        self.memory = np.zeros(memory_bytes if memory_bytes is not None else 0, dtype=np.uint8)
+        self.image_table = {} # image index -> (address, length) given by the last 0x1A2A for it
+        self.images = {} # image index -> decoded (M, N, 3) image of the running sequence
+        self.upload = None # start address of the running upload, address of its next byte, bytes still missing
+        self.last_error = 0
+
+        self.partial_command, self.missing_reports = b'', 0
+        self.command_counts = Counter() # commands per usb code
+        self.reports_received = 0
+        self.elapsed = 0.0 # modeled seconds until the last answer
+        self.link_time = 0.0 # modeled seconds until the last report was transferred
+        self.start_time = time.perf_counter()
+        self.deliveries = None # queue of (due time, answer) in realtime mode
+
+        self.handler_dict = {0x1a1b: self.display_mode, 0x1a24: self.start_stop,
+                             0x1a34: self.lut_definition, 0x1a31: self.lut_configure,
+                             0x1a35: self.trigger, 0x1a2a: self.init_image_load,
+                             0x1a2b: self.image_data, 0x0100: self.error_code}
+        self.register_codes = {0x1008, 0x1009, 0x069, 0x0200, 0x0201, 0x1203, 0x1a00}
+
+    def write(self, report):
+        report = bytes(report)
+        if len(report) != 65:
+            raise Exception("Reports are 65 bytes, got %s." %len(report))
+        self.reports_received += 1
+        if self.realtime: # the link was idle while the host waited
+            self.link_time = max(self.link_time, time.perf_counter() - self.start_time)
+        if self.bandwidth is not None:
+            self.transfer(65/self.bandwidth)
+
+        if self.missing_reports == 0:
+            self.partial_command = report[1:]
+            self.missing_reports = continuation_count(self.partial_command)
+        else:
+            self.partial_command += report[1:]
+            self.missing_reports -= 1
+        if self.missing_reports == 0:
+            reply = self.execute(self.partial_command)
+            if reply is not None:
+                self.answer(self.link_time + self.latency, [0x00] + reply)
+
+    def transfer(self, seconds):
+        """
+        Advance the modeled link time, in realtime mode also wait for it.
+        """
+        self.link_time += seconds
+        self.elapsed = max(self.elapsed, self.link_time)
+        if self.realtime:
+            ahead = self.start_time + self.link_time - time.perf_counter()
+            if ahead > 1e-3: # sleep in steps of at least a millisecond, not once per report
+                time.sleep(ahead)
+
+    def answer(self, due, answer):
+        """
+        Hand an answer to the reply handler, in realtime mode at the modeled time due.
+        """
+        self.elapsed = max(self.elapsed, due)
+        if not self.realtime:
+            if self.reply_handler is not None:
+                self.reply_handler(answer)
+            return
+        if self.deliveries is None:
+            self.deliveries = queue.Queue()
+            threading.Thread(target=self.deliver_answers, daemon=True).start()
+        self.deliveries.put((due, answer))
+
+    def deliver_answers(self):
+        while True:
+            due, answer = self.deliveries.get() # answers are due in the order of the commands
+            delay = self.start_time + due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if self.reply_handler is not None:
+                self.reply_handler(answer)
+
+    def execute(self, command):
+        """
+
+        Execute one command as the controller would.
+
+        Parameters
+        ----------
+        command : TYPE: bytes
+            DESCRIPTION: the command without report id, continuation reports
+            appended, like the commands of Transport.PseudoDevice.
+
+        Returns
+        -------
+        reply : TYPE: list
+            DESCRIPTION: 64 byte answer (flags, sequence byte, length, data),
+            None if the command did not ask for one.
+
+        """
+
+        flags, sequence_byte = command[0], command[1]
+        length = command[2] + (command[3] << 8)
+        usb_code = command[4] + (command[5] << 8)
+        data = command[6:4 + length]
+        is_read = bool(flags & 0x80)
+        self.command_counts[usb_code] += 1
+
+        if usb_code in self.handler_dict:
+            error, reply_data = self.handler_dict[usb_code](data, is_read)
+        elif usb_code in self.register_codes:
+            error, reply_data = self.register(usb_code, data, is_read)
+        else:
+            error, reply_data = 3, [] # invalid command number
+        self.last_error = error # like the controller, 0x0100 reports the last command, successful ones too
+
+        if not flags & 0x40:
+            return None
+        reply = [(flags & 0xc0) | (0x20 if error else 0x00), sequence_byte,
+                 len(reply_data) & 0xff, len(reply_data) >> 8] + list(reply_data)
+        return (reply + [0x00]*64)[:64]
+
+    def register(self, usb_code, data, is_read):
+        if is_read:
+            return 0, self.registers.get(usb_code, [0x00])
+        self.registers[usb_code] = list(data)
+        return 0, []
+
+    def display_mode(self, data, is_read):
+        if is_read:
+            return 0, [self.mode]
+        if len(data) < 1 or data[0] > 3:
+            return 6, []
+        self.mode = data[0]
+        self.sequence_state = 'stop' # a mode change stops the sequence
+        return 0, []
+
+    def start_stop(self, data, is_read):
+        if self.mode not in (1, 3):
+            return 5, []
+        if len(data) < 1 or data[0] > 2:
+            return 6, []
+        if data[0] == 2:
+            if self.lut_configuration is None:
+                return 16, []
+            for pattern_index in range(self.lut_configuration[0]):
+                if pattern_index not in self.lut:
+                    return 16, [] # invalid pattern definition
+            error = self.read_images()
+            if error:
+                return error, []
+        self.sequence_state = ['stop', 'pause', 'start'][data[0]]
+        return 0, []
+
+    def lut_definition(self, data, is_read):
+        if len(data) < 12:
+            return 6, []
+        if self.mode not in (1, 3):
+            return 5, []
+        pattern_index = data[0] + (data[1] << 8)
+        settings = data[5]
+        image = data[10] + (data[11] << 8)
+        entry = {'exposure_time': data[2] + (data[3] << 8) + (data[4] << 16),
+                 'wait_for_trigger': bool(settings & 0x80),
+                 'bit_depth': ((settings >> 1) & 0x07) + 1,
+                 'flicker_active': bool(settings & 0x01),
+                 'dark_time': data[6] + (data[7] << 8) + (data[8] << 16),
+                 'image_index': image & 0x7ff,
+                 'bit_position': image >> 11}
+        if pattern_index > 255:
+            return 15, []
+        if entry['exposure_time'] < 105:
+            return 14, []
+        if entry['bit_position'] > 23:
+            return 10, []
+        self.lut[pattern_index] = entry
+        return 0, []
+
+    def lut_configure(self, data, is_read):
+        if len(data) < 6:
+            return 6, []
+        number_of_patterns = data[0] + (data[1] << 8)
+        number_of_repeats = data[2] + (data[3] << 8) + (data[4] << 16) + (data[5] << 24)
+        if number_of_patterns == 0 or number_of_patterns > 256:
+            return 15, []
+        self.lut_configuration = (number_of_patterns, number_of_repeats)
+        return 0, []
+
+    def trigger(self, data, is_read):
+        if is_read:
+            delay, rising_edge = self.trigger_in_1
+            return 0, [delay & 0xff, delay >> 8, 0x00 if rising_edge else 0x01]
+        if len(data) < 3:
+            return 6, []
+        delay = data[0] + (data[1] << 8)
+        if delay < 105:
+            return 13, []
+        self.trigger_in_1 = (delay, data[2] == 0x00)
+        return 0, []
+
+    def init_image_load(self, data, is_read):
+        if len(data) < 6:
+            return 6, []
+        if self.mode != 3:
+            return 5, []
+        index = data[0] + (data[1] << 8)
+        length = data[2] + (data[3] << 8) + (data[4] << 16) + (data[5] << 24)
+        if self.max_images is not None and index >= self.max_images:
+            return 17, []
+        # images are loaded from the last index down, each one right after the one above it
+        address = sum(self.image_table[index + 1]) if index + 1 in self.lut_images() & set(self.image_table) else 0
+        if self.memory_bytes is not None and address + length > self.memory_bytes:
+            return 8, []
+        if address + length > len(self.memory):
+            self.memory = np.concatenate((self.memory, np.zeros(address + length - len(self.memory), dtype=np.uint8)))
+        self.image_table[index] = (address, length)
+        self.upload = (address, address, length)
+        return 0, []
+
+    def lut_images(self):
+        """
+        :return image indexes of the configured LUT, all table entries if there is none
+        """
+        if self.lut_configuration is None:
+            return set(self.image_table)
+        return {self.lut[pattern_index]['image_index'] for pattern_index in range(self.lut_configuration[0])
+                if pattern_index in self.lut}
+
+    @property
+    def image_bits(self):
+        """
+        Image index -> bytes that are in the memory where the image was loaded, they may have been overwritten since.
+        """
+        return {index: self.memory[address:address + length].tobytes()
+                for index, (address, length) in self.image_table.items()}
+
+    def image_data(self, data, is_read):
+        payload_length = data[0] + (data[1] << 8) if len(data) >= 2 else 0
+        if payload_length == 0: # the empty group that ends an upload
+            return 0, []
+        if self.upload is None:
+            return 5, []
+        start, address, missing = self.upload
+        payload = np.frombuffer(data[2:2 + min(payload_length, missing)], dtype=np.uint8)
+        self.memory[address:address + len(payload)] = payload
+        if missing > len(payload):
+            self.upload = (start, address + len(payload), missing - len(payload))
+            return 0, []
+        self.upload = None
+        if self.memory[start:start + 4].tobytes() != b'Spld' or self.memory[start + 25] > 2:
+            return 9, [] # invalid bmp compression type
+        return 0, []
+
+    def read_images(self):
+        """
+        Read the images of the configured LUT from the memory, as the controller does when a sequence starts.
+        :return error code
+        """
+        images = {}
+        for index in sorted(self.lut_images()):
+            if index not in self.image_table:
+                return 7 # item referred by the parameter is not present
+            address, length = self.image_table[index]
+            image_bits = self.memory[address:address + length]
+            if (length < 48 or image_bits[:4].tobytes() != b'Spld' or image_bits[25] > 2
+                    or int(image_bits[8:12].view('<u4')[0]) != length - 48):
+                return 9 # invalid bmp compression type
+            if self.decode:
+                try:
+                    images[index] = DMDPattern().decompress_pattern(image_bits)
+                except Exception:
+                    return 9
+        self.images = images
+        return 0
+
+    def error_code(self, data, is_read):
+        return 0, [self.last_error]
+
+
+class DMDEmulator(USBdevice):
+    def __init__(self, vid=0x0451, pid=0xc900, **settings):
+        """
+        USBdevice on an emulated DLPC900, e.g. LightCrafter6500(device=DMDEmulator()).
+        :param settings of DLPC900Emulator, the emulator is the attribute controller
+        """
+        self.controller = DLPC900Emulator(**settings)
+        super().__init__(vid, pid, transport=self.controller)
+
+
+if __name__ == '__main__':
+    from pyDMD.LightCrafter6500 import LightCrafter6500
+    emulator = DMDEmulator()
+    dmd = LightCrafter6500(device=emulator)
+    print("Mode: %s, modeled time %.3f s" %(dmd.display_mode_get(), emulator.controller.elapsed))
@@ -3,6 +3,12 @@
 import numpy as np 
 import matplotlib.pyplot as plt
 from PIL import Image
+from pyDMD.PatternCache import PatternCache
+from pyDMD.Halftone import Halftone
+
+# bump the version of an encoder whenever its output changes, cached patterns of older versions are dropped
+ENCODER_VERSIONS = {'none': 1, 'rle': 2, 'erle': 1}
+ENCODER_TAGS = ['%s-v%s' %(compression, version) for compression, version in ENCODER_VERSIONS.items()]
 
 class DMDPattern():
     def __init__(self, **kwargs):
@@ -18,43 +24,482 @@ class DMDPattern():
         self.bit_depth = kwargs.pop('bit_depth', 1)
         self.flicker_active = kwargs.pop('flicker_acitve', True)
         self.wait_for_trigger = kwargs.pop('wait_for_trigger', False)
+        self.cache = kwargs.pop('cache', default_cache) # None disables caching
+        self.compact = kwargs.pop('compact', False)
         
-        self.pattern = np.zeros(self.resolution)
+        self.storage = 'dense' # 'dense', or in compact mode 'bits' (bit-packed) or 'planes' (uint8 colors)
+        self.stored_pattern = None
+        self.pattern_width = None # width of a bit-packed pattern
+        self.pattern = np.zeros(self.resolution, dtype=bool) if self.compact else np.zeros(self.resolution)
         self.compressed_pattern = None
         self.compressed_pattern_length = None
+        self.row_encoding = None # encoded rows of the last compress_pattern call
+        self.dirty_rows = None # rows changed since then, None if unknown
+
+    @property
+    def pattern(self):
+        """
+        The pattern as 2D or (M, N, 3) matrix. A bit-packed pattern is unpacked to a new 
+        boolean matrix on every access, so change it with set_rows or by assigning a new pattern.
+        """
+        if self.storage == 'bits':
+            return np.unpackbits(self.stored_pattern, axis=1, count=self.pattern_width).view(bool)
+        return self.stored_pattern
+
+    @pattern.setter
+    def pattern(self, pattern):
+        self.store_pattern(pattern)
+
+    def store_pattern(self, pattern, storage=None):
+        """
+        Keep the pattern in the storage of this instance. In compact mode patterns with bit_depth 1 
+        are bit-packed (on where non zero), all others are kept as uint8 colors.
+        :param 2D or (M, N, 3) matrix, storage to use instead of the one given by compact and bit_depth
+        """
+        if storage is None:
+            storage = 'dense' if not self.compact else ('bits' if self.bit_depth == 1 else 'planes')
+        if storage == 'bits':
+            self.set_stored_pattern(np.packbits(self.nonzero(pattern), axis=1), 'bits', np.shape(pattern)[1])
+        elif storage == 'planes':
+            self.set_stored_pattern(np.asarray(self.color_pattern(pattern), dtype=np.uint8), 'planes')
+        else:
+            self.set_stored_pattern(pattern, 'dense')
 
-    def compress_pattern(self):
+    def set_stored_pattern(self, stored_pattern, storage, pattern_width=None):
+        self.stored_pattern = stored_pattern
+        self.storage = storage
+        self.pattern_width = pattern_width
+
+    def nonzero(self, pattern):
+        """
+        :return (M, N) boolean matrix, True where the pattern is non zero in any color
         """
+        if len(np.shape(pattern)) == 2:
+            return pattern != 0
+        return np.any(pattern != 0, axis=2)
+
+    def compress_pattern(self, cache=None):
+        """
+        If rows were marked with set_rows or mark_rows_dirty since the last call, only 
+        those rows are re-encoded (rle and erle). All other rows must be unchanged then.
+        :param PatternCache to use instead of self.cache
         :return the pattern as a 1d array of uint8's, including the appropriate image header
         """
+        if self.dirty_rows is not None and self.row_encoding_valid():
+            return self.update_compressed_rows()
+
+        if cache is None:
+            cache = self.cache
+        if cache is not None:
+            key = cache.make_key(self.stored_pattern, self.encoder_tag(), (self.storage,))
+            cs_uint = cache.get(key)
+            if cs_uint is not None:
+                self.forget_row_encoding()
+                print ("Compressed to %s bytes (cached)" %len(cs_uint))
+                return cs_uint
+
         #make 1d, apply compression
-        compression_function_dict = {'none': self.non_compressed_image, 'rle': self.rle_compressed_image}
-        if len(self.pattern.shape) == 2:
-            self.pattern_3d = 0xff*np.dstack((self.pattern,self.pattern,self.pattern))
+        compression_function_dict = {'none': self.non_compressed_image, 'rle': self.fast_rle_compressed_image,
+                                     'erle': self.erle_compressed_image}
+        if self.compression in self.row_compression_function_dict():
+            compressed_rows, row_offsets = self.encode_rows()
+            self.row_encoding = {'pattern': self.stored_pattern, 'compression': self.compression, 
+                                 'rows': compressed_rows, 'row_offsets': row_offsets}
+            self.dirty_rows = None
+            compressed_pattern, pattern_length = self.end_image(compressed_rows)
         else:
-            self.pattern_3d = self.pattern
-        compressed_pattern, pattern_length = compression_function_dict[self.compression](self.pattern_3d)
+            compressed_pattern, pattern_length = compression_function_dict[self.compression](self.color_pattern(self.pattern))
 
         #get the header
         header = self.make_header(pattern_length, self.compression)
-        command_sequence = [*header,*compressed_pattern]
+        cs_uint = np.empty(len(header) + pattern_length, dtype=np.uint8)
+        cs_uint[:len(header)] = header
+        cs_uint[len(header):] = compressed_pattern
         
-        print ("Compressed to %s bytes" %len(command_sequence))
-        cs_uint = np.array(command_sequence,dtype=np.uint8)
+        print ("Compressed to %s bytes" %len(cs_uint))
+        if cache is not None:
+            cache.put(key, cs_uint)
+        return cs_uint
+
+    def color_pattern(self, pattern):
+        """
+        :return the pattern as (M, N, 3) matrix, 2D patterns are stacked to white
+        """
+        if len(pattern.shape) == 2:
+            plane = pattern.astype(np.uint8)*np.uint8(0xff)
+            return np.dstack((plane, plane, plane))
+        return pattern
+
+    def unique_color_rows(self):
+        """
+        Rows are compared in the stored form, only the rows that differ from the row above 
+        are converted to colors. A bit-packed pattern is never unpacked as a whole.
+        :return boolean array, True where a row differs from the row above, (K, N, 3) colors of these rows
+        """
+        if self.storage == 'dense':
+            pattern_3d = self.color_pattern(self.stored_pattern)
+            new_row = self.new_rows(pattern_3d)
+            return new_row, pattern_3d[new_row]
+        new_row = self.new_rows(self.stored_pattern)
+        return new_row, self.color_rows(np.flatnonzero(new_row))
+
+    def color_rows(self, rows):
+        """
+        :param indexes of rows
+        :return (K, N, 3) colors of these rows
+        """
+        if self.storage == 'bits':
+            bits = np.unpackbits(self.stored_pattern[rows], axis=1, count=self.pattern_width)
+            bits *= 0xff
+            return np.dstack((bits, bits, bits))
+        return self.color_pattern(self.stored_pattern[rows])
+
+    def encode_rows(self):
+        """
+        :return the (e)rle commands of all rows without end of image, M+1 byte offsets of the rows in it
+        """
+        new_row, unique_rows = self.unique_color_rows()
+        return self.row_compression_function_dict()[self.compression](unique_rows, new_row)
+
+    def row_compression_function_dict(self):
+        return {'rle': self.fast_rle_compressed_rows, 'erle': self.erle_compressed_rows}
+
+    def set_rows(self, first_row, rows):
+        """
+        Overwrite rows of the pattern and mark them for re-encoding.
+        :param index of the first row, array with the new rows
+        """
+        if self.storage == 'bits':
+            self.stored_pattern[first_row:first_row + len(rows)] = np.packbits(self.nonzero(rows), axis=1)
+        elif self.storage == 'planes':
+            self.stored_pattern[first_row:first_row + len(rows)] = self.color_pattern(np.asarray(rows))
+        else:
+            self.stored_pattern[first_row:first_row + len(rows)] = rows
+        self.mark_rows_dirty(slice(first_row, first_row + len(rows)))
+
+    def mark_rows_dirty(self, rows):
+        """
+        Mark rows that were changed in place, the next compress_pattern only re-encodes them.
+        :param row index, list of row indexes or slice
+        """
+        if self.dirty_rows is None:
+            self.dirty_rows = np.zeros(self.row_count(), dtype=bool)
+        self.dirty_rows[rows] = True
+
+    def row_count(self):
+        return np.shape(self.stored_pattern)[0]
+
+    def row_encoding_valid(self):
+        """
+        :return True if the stored encoded rows belong to the current pattern and compression
+        """
+        return (self.row_encoding is not None and self.row_encoding['pattern'] is self.stored_pattern 
+                and self.row_encoding['compression'] == self.compression)
+
+    def forget_row_encoding(self):
+        """
+        Drop the stored encoded rows, e.g. when the pattern was encoded without building them
+        (cache hit, worker process). The next set_rows is followed by a full encode.
+        """
+        self.row_encoding = None
+        self.dirty_rows = None
+
+    def update_compressed_rows(self):
+        """
+        Re-encode the dirty rows and splice them into the stored encoded rows.
+        In erle the row below a changed row is re-encoded as well, it might have been a copy of it.
+        :return the pattern as a 1d array of uint8's, including the appropriate image header
+        """
+        n_rows = self.row_count()
+        changed = self.dirty_rows.copy()
+        if self.compression == 'erle':
+            changed[1:] |= self.dirty_rows[:-1]
+        rows = np.flatnonzero(changed)
+
+        # erle needs the row above each changed row to decide about copy commands
+        context = changed.copy()
+        if self.compression == 'erle':
+            context[:-1] |= changed[1:]
+        context_rows = np.flatnonzero(context)
+        new_rows, new_offsets = self.row_compression_function_dict()[self.compression](self.color_rows(context_rows))
+        new_lengths = np.diff(new_offsets)[np.searchsorted(context_rows, rows)]
+        new_starts = new_offsets[np.searchsorted(context_rows, rows)]
+
+        old_rows, old_offsets = self.row_encoding['rows'], self.row_encoding['row_offsets']
+        row_lengths = np.diff(old_offsets)
+        row_lengths[rows] = new_lengths
+        row_offsets = np.concatenate(([0], np.cumsum(row_lengths)))
+
+        compressed_rows = np.empty(row_offsets[-1], dtype=np.uint8)
+        # copy blocks of consecutive unchanged rows and of consecutive changed rows
+        block_edges = np.flatnonzero(np.diff(changed.astype(np.int8))) + 1
+        block_first = np.concatenate(([0], block_edges))
+        block_last = np.append(block_edges, n_rows)
+        for first, last in zip(block_first, block_last):
+            target = compressed_rows[row_offsets[first]:row_offsets[last]]
+            if changed[first]:
+                first_new = np.searchsorted(rows, first)
+                source_start = new_starts[first_new]
+                target[:] = new_rows[source_start:source_start + np.size(target)]
+            else:
+                target[:] = old_rows[old_offsets[first]:old_offsets[last]]
+
+        self.row_encoding['rows'], self.row_encoding['row_offsets'] = compressed_rows, row_offsets
+        self.dirty_rows = None
+        compressed_pattern, pattern_length = self.end_image(compressed_rows)
+
+        header = self.make_header(pattern_length, self.compression)
+        cs_uint = np.empty(len(header) + pattern_length, dtype=np.uint8)
+        cs_uint[:len(header)] = header
+        cs_uint[len(header):] = compressed_pattern
+        print ("Re-encoded %s rows, compressed to %s bytes" %(np.size(rows), len(cs_uint)))
         return cs_uint
 
+    def encoder_tag(self):
+        """
+        :return compression and encoder version, e.g. 'rle-v2'
+        """
+        return '%s-v%s' %(self.compression, ENCODER_VERSIONS[self.compression])
+
     def load_png(self,file):
-        im_frame = Image.open(file)#.convert('LA')
-        self.pattern = np.array(im_frame) 
+        self.load_pattern(file)
+
+    def load_pattern(self, file, mmap=False, halftone=None):
+        """
+        Load a pattern from an image file, a .npy file or an array, decoding it exactly once. 
+        1-bit images are read as packed bits (directly into the bit-packed storage in compact mode), 
+        other images without conversion. Patterns of another size are padded with zeros or cropped 
+        to 1920x1080 by slicing.
+        :param file name, or numpy array / np.memmap (used without copy if it is 1080x1920); 
+        .npy files are memory-mapped if mmap; halftone method (see Halftone) to turn gray levels into a 1 bit pattern
+        """
+        if isinstance(file, np.ndarray):
+            pattern = file
+        elif str(file).endswith('.npy'):
+            pattern = np.load(file, mmap_mode='c' if mmap else None) # copy on write, the file is never changed
+        else:
+            im_frame = Image.open(file)
+            if im_frame.mode == '1' and self.compact and self.bit_depth == 1:
+                self.resolution = im_frame.size
+                self.load_packed_bits(im_frame)
+                return
+            if im_frame.mode == 'P':
+                im_frame = im_frame.convert('RGB')
+            pattern = np.array(im_frame)
+
+        self.resolution = (pattern.shape[1], pattern.shape[0])
+        if len(pattern.shape) == 3 and pattern.shape[2] == 4: #if color code includes transparency-byte, ignore it
+            pattern = np.ascontiguousarray(pattern[:, :, :3])
+        if halftone is not None:
+            self.apply_halftone(halftone, self.fit_to_dmd(pattern))
+            return
+        if len(pattern.shape) == 2 and pattern.dtype != bool:
+            if self.bit_depth == 1:
+                pattern = pattern != 0
+            else:
+                pattern = np.dstack((pattern, pattern, pattern)) # gray levels in all colors
+        self.pattern = self.fit_to_dmd(pattern)
+
+    def fit_to_dmd(self, pattern, width=1920):
+        """
+        :param pattern, width of a DMD row in the pattern (240 for bit-packed rows)
+        :return the pattern padded with zeros or cropped to 1080 rows and width columns, the pattern itself if it fits
+        """
+        shape = (1080, width) + pattern.shape[2:]
+        if pattern.shape == shape:
+            return pattern
+        fitted = np.zeros(shape, dtype=pattern.dtype)
+        height, width = min(pattern.shape[0], 1080), min(pattern.shape[1], width)
+        fitted[:height, :width] = pattern[:height, :width]
+        return fitted
+
+    def load_packed_bits(self, im_frame):
+        """
+        Store a 1-bit image without unpacking it, PIL keeps its rows packed like np.packbits.
+        """
         width, height = im_frame.size
-        self.resolution = (width, height)
-        if self.resolution != (1920,1080):
-            im = Image.new("RGB", (1920,1080) , color=(0,0,0)) #create black backgorund and add image to get right resolution
-            im.paste(im_frame)
-            self.pattern = np.array(im)            
-        
-        if len(self.pattern.shape) == 3 and self.pattern.shape[2] == 4: #if color code includes transparency-byte, ignore it
-                self.pattern = np.delete(self.pattern,3,2)
+        packed = np.frombuffer(bytearray(im_frame.tobytes()), dtype=np.uint8).reshape(height, -1)
+        if width % 8 != 0: # clear the bits after the last pixel of each row
+            packed[:, -1] &= np.uint8((0xff << (8 - width % 8)) & 0xff)
+        self.set_stored_pattern(self.fit_to_dmd(packed, 240), 'bits', 1920)
+
+    def set_packed_pattern(self, packed, pattern_width=1920):
+        """
+        Set a binary pattern given as rows packed like np.packbits, kept packed in compact mode.
+        :param (M, N/8) array of uint8's, number of pixels N in a row
+        """
+        if self.compact:
+            self.set_stored_pattern(packed, 'bits', pattern_width)
+        else:
+            self.pattern = np.unpackbits(packed, axis=1, count=pattern_width).view(bool)
+
+    def apply_halftone(self, halftone='blue_noise', pattern=None):
+        """
+        Replace gray levels by a 1 bit halftone, kept bit-packed in compact mode.
+        :param Halftone or name of its method, gray level or color pattern (default: the current pattern)
+        """
+        if isinstance(halftone, str):
+            halftone = Halftone(halftone)
+        pattern = self.pattern if pattern is None else pattern
+        self.set_packed_pattern(halftone.to_bits(pattern), np.shape(pattern)[1])
+
+    def load_camera_image(self, image, transform, threshold=128, dither=False):
+        """
+        Warp an image from camera coordinates onto the DMD and reduce it to 1 bit.
+        :param camera image, CameraTransform with the calibration, threshold and dither as in CameraTransform.to_bits
+        """
+        self.set_packed_pattern(transform.to_bits(image, threshold, dither)[0], transform.resolution[0])
+
+    def binary_plane(self):
+        """
+        :return (M, N) boolean matrix, True where the pattern is non zero in any color
+        """
+        return self.nonzero(self.pattern)
+
+    def packed_bits(self):
+        """
+        :return (M, N/8) bit-packed binary plane, the stored array itself for bit-packed patterns
+        """
+        if self.storage == 'bits':
+            return self.stored_pattern
+        return np.packbits(self.binary_plane(), axis=1)
+
+    def binary_like(self, packed):
+        """
+        :return new binary DMDPattern with the settings of this one holding the packed rows
+        """
+        dmd_pattern = DMDPattern(compression=self.compression, exposure_time=self.exposure_time, 
+                                 dark_time=self.dark_time, wait_for_trigger=self.wait_for_trigger,
+                                 zero_pixel=self.zero_point, cache=self.cache, compact=self.compact)
+        dmd_pattern.flicker_active = self.flicker_active
+        dmd_pattern.set_packed_pattern(packed, self.binary_width())
+        return dmd_pattern
+
+    def binary_width(self):
+        return self.pattern_width if self.storage == 'bits' else np.shape(self.stored_pattern)[1]
+
+    def update_packed_bits(self, packed):
+        """
+        In-place result of an operator. A bit-packed pattern only overwrites the rows that changed 
+        and marks them for re-encoding, other patterns are replaced by the binary result.
+        """
+        if self.storage != 'bits':
+            self.set_packed_pattern(packed, self.binary_width())
+            return
+        changed = np.any(self.stored_pattern != packed, axis=1)
+        if np.any(changed):
+            self.stored_pattern[changed] = packed[changed]
+            self.mark_rows_dirty(changed)
+
+    def operand_bits(self, other):
+        """
+        :param DMDPattern, or a boolean matrix / packed rows of the same size
+        :return the packed rows of other
+        """
+        if isinstance(other, DMDPattern):
+            packed = other.packed_bits()
+        elif np.asarray(other).dtype == bool:
+            packed = np.packbits(other, axis=1)
+        else:
+            packed = np.asarray(other, dtype=np.uint8)
+        if packed.shape != self.packed_bits().shape:
+            raise Exception("Patterns of shape %s and %s can not be combined." %(packed.shape, self.packed_bits().shape))
+        return packed
+
+    def __or__(self, other):
+        return self.binary_like(self.packed_bits() | self.operand_bits(other))
+
+    def __and__(self, other):
+        return self.binary_like(self.packed_bits() & self.operand_bits(other))
+
+    def __xor__(self, other):
+        return self.binary_like(self.packed_bits() ^ self.operand_bits(other))
+
+    def __sub__(self, other):
+        return self.mask(other, inverted=True)
+
+    def __invert__(self):
+        return self.binary_like(self.clear_padding(~self.packed_bits()))
+
+    def __ior__(self, other):
+        self.update_packed_bits(self.packed_bits() | self.operand_bits(other))
+        return self
+
+    def __iand__(self, other):
+        self.update_packed_bits(self.packed_bits() & self.operand_bits(other))
+        return self
+
+    def __ixor__(self, other):
+        self.update_packed_bits(self.packed_bits() ^ self.operand_bits(other))
+        return self
+
+    def mask(self, other, inverted=False):
+        """
+        Binary operators (|, &, ^, -, ~ and the in-place forms) work on the bit-packed rows, 
+        every pattern counts as on where it is non zero. Results are binary DMDPatterns with 
+        the settings of the left operand, in-place operators on bit-packed patterns only 
+        re-encode the changed rows.
+        :param DMDPattern or boolean matrix, if inverted the pattern is kept where the mask is off
+        :return the pattern where the mask is on
+        """
+        mask_bits = self.operand_bits(other)
+        return self.binary_like(self.packed_bits() & (~mask_bits if inverted else mask_bits))
+
+    def shift(self, dx=0, dy=0):
+        """
+        Move the pattern by whole pixels on the packed rows, pixels shifted in are off.
+        :param shift to the right and down in pixels
+        :return the shifted binary DMDPattern
+        """
+        return self.binary_like(self.shift_packed(self.packed_bits(), dx, dy, self.binary_width()))
+
+    def shift_packed(self, packed, dx, dy, width):
+        height, n_bytes = packed.shape
+        shifted = np.zeros_like(packed)
+        if abs(dy) >= height or abs(dx) >= width:
+            return shifted
+        rows = packed[max(-dy, 0):height - max(dy, 0)]
+        byte_shift, bit_shift = divmod(abs(dx), 8)
+        if dx >= 0:
+            moved = np.zeros_like(rows)
+            moved[:, byte_shift:] = rows[:, :n_bytes - byte_shift]
+            if bit_shift:
+                carry = np.zeros_like(moved)
+                carry[:, 1:] = moved[:, :-1] << (8 - bit_shift)
+                moved = (moved >> bit_shift) | carry
+        else:
+            moved = np.zeros_like(rows)
+            moved[:, :n_bytes - byte_shift] = rows[:, byte_shift:]
+            if bit_shift:
+                carry = np.zeros_like(moved)
+                carry[:, :-1] = moved[:, 1:] >> (8 - bit_shift)
+                moved = (moved << bit_shift) | carry
+        shifted[max(dy, 0):height - max(-dy, 0)] = moved
+        return self.clear_padding(shifted, width)
+
+    def clear_padding(self, packed, width=None):
+        """
+        :return packed rows with the bits after the last pixel of a row set to 0
+        """
+        width = self.binary_width() if width is None else width
+        if width % 8 != 0:
+            packed[:, -1] &= np.uint8((0xff << (8 - width % 8)) & 0xff)
+        return packed
+
+    def pack_bit_planes(self, dmd_patterns):
+        """
+        Merge up to 24 binary patterns into the bit planes of this pattern, so the DMD can 
+        show all of them from one uploaded image. Pattern i goes to bit position i, which is 
+        bit i%8 of color byte 2 - i//8 (bits 0-7 are the last byte of a pixel).
+        :param list of DMDPatterns, each is on where it is non zero
+        """
+        if len(dmd_patterns) > 24:
+            raise Exception("At most 24 binary patterns fit into one image.")
+        planes = [dmd_pattern.binary_plane() for dmd_pattern in dmd_patterns]
+        packed = np.zeros(np.shape(planes[0]) + (3,), dtype=np.uint8)
+        for bit_position, plane in enumerate(planes):
+            packed[:, :, 2 - bit_position//8] |= plane.astype(np.uint8) << (bit_position % 8)
+        self.store_pattern(packed, 'planes' if self.compact else 'dense')
 
     def show_pattern(self):
         plt.gray()
@@ -72,6 +517,8 @@ class DMDPattern():
 
     def rle_compressed_image(self, pattern):
         """
+        Row by row reference implementation of the rle encoder. 
+        compress_pattern uses fast_rle_compressed_image, which gives the same bytes.
         :param (M, N) matrix of uint8 that represents a pattern
         :return 1D 24bit compressed bitmap
         """
@@ -83,6 +530,226 @@ class DMDPattern():
         #print np.where(command_sequence == 0x01)
         return command_sequence, len(command_sequence)
 
+    def fast_rle_compressed_image(self, pattern):
+        """
+        Vectorized rle encoder. Rows that repeat the previous row are encoded only once, 
+        the runs of all other rows are found in one pass, runs longer than 255 are split 
+        in bulk and everything is written into one preallocated buffer. 
+        Output is byte-identical to rle_compressed_image.
+        :param (M, N, 3) matrix that represents a pattern
+        :return 1D uint8 array with the rle compressed bitmap, its length
+        """
+        compressed_rows, row_offsets = self.fast_rle_compressed_rows(pattern)
+        return self.end_image(compressed_rows)
+
+    def fast_rle_compressed_rows(self, pattern, new_row=None):
+        """
+        :param (M, N, 3) matrix that represents a pattern. If new_row (True where a row differs 
+        from the row above) is given, only the (K, N, 3) rows where new_row is True.
+        :return 1D uint8 array with the rle commands of all rows without end of image, 
+        M+1 byte offsets of the rows in it
+        """
+        if new_row is None:
+            new_row = self.new_rows(pattern)
+            pattern = pattern[new_row]
+        n_rows, n_cols = np.size(new_row), np.shape(pattern)[1]
+        unique_rows = np.flatnonzero(new_row)
+
+        starts, run_lengths, vals = self.frame_rle_runs(pattern)
+        counts, vals = self.split_long_runs(run_lengths, vals, 255)
+        pieces_per_row = np.bincount(np.repeat(starts//n_cols, (run_lengths - 1)//255 + 1), 
+                                     minlength=np.size(unique_rows))
+
+        # every row of the frame takes the pieces of the unique row it repeats
+        row_source = np.cumsum(new_row) - 1
+        row_pieces = pieces_per_row[row_source]
+        source_offsets = np.cumsum(pieces_per_row) - pieces_per_row
+        frame_offsets = np.cumsum(row_pieces) - row_pieces
+        piece_idx = np.arange(np.sum(row_pieces)) + np.repeat(source_offsets[row_source] - frame_offsets, row_pieces)
+
+        compressed_rows = np.empty(4*np.size(piece_idx), dtype=np.uint8)
+        runs = compressed_rows.reshape(-1, 4)
+        runs[:, 0] = counts[piece_idx]
+        runs[:, 1:] = vals[piece_idx]
+        row_offsets = 4*np.concatenate(([0], np.cumsum(row_pieces)))
+        return compressed_rows, row_offsets
+
+    def end_image(self, compressed_rows):
+        """
+        :param 1D uint8 array with the (e)rle commands of all rows
+        :return the commands followed by end of image, their length
+        """
+        compressed_pattern = np.empty(np.size(compressed_rows) + 2, dtype=np.uint8)
+        compressed_pattern[:-2] = compressed_rows
+        compressed_pattern[-2:] = [0x00, 0x01] # end of image
+        return compressed_pattern, np.size(compressed_pattern)
+
+    def new_rows(self, pattern):
+        """
+        :param matrix that represents a pattern, rows along the first axis
+        :return boolean array of length M, True where a row differs from the row above
+        """
+        n_rows = np.shape(pattern)[0]
+        flat_rows = np.ascontiguousarray(pattern).reshape(n_rows, -1).view(np.uint8)
+        if np.shape(flat_rows)[1] % 8 == 0:
+            flat_rows = flat_rows.view(np.uint64) # compare rows 8 bytes at a time
+        new_row = np.ones(n_rows, dtype=bool)
+        new_row[1:] = np.any(flat_rows[1:] != flat_rows[:-1], axis=1)
+
+        return new_row
+
+    def erle_compressed_image(self, pattern):
+        """
+        Vectorized enhanced rle encoder. A row equal to the row above is one 'copy n pixels
+        from previous line' command. All other rows are split into repeat commands for runs 
+        and uncompressed blocks for single pixels, since a count of 1 is reserved for the 
+        copy command. Counts of 128 and more take two bytes.
+        :param (M, N, 3) matrix that represents a pattern
+        :return 1D uint8 array with the erle compressed bitmap, its length
+        """
+        compressed_rows, row_offsets = self.erle_compressed_rows(pattern)
+        return self.end_image(compressed_rows)
+
+    def erle_compressed_rows(self, pattern, new_row=None):
+        """
+        :param (M, N, 3) matrix that represents a pattern. If new_row (True where a row differs 
+        from the row above) is given, only the (K, N, 3) rows where new_row is True.
+        :return 1D uint8 array with the erle commands of all rows without end of image, 
+        M+1 byte offsets of the rows in it
+        """
+        if new_row is None:
+            new_row = self.new_rows(pattern)
+            pattern = pattern[new_row]
+        n_rows, n_cols, n_channels = (np.size(new_row),) + np.shape(pattern)[1:]
+        unique_rows = np.flatnonzero(new_row)
+        n_unique = np.size(unique_rows)
+        sub_pattern = pattern
+        starts, run_lengths, vals = self.frame_rle_runs(sub_pattern)
+
+        # pixels of single pixel runs go into uncompressed blocks. An isolated one takes 
+        # the next pixel of its row with it, the previous one at the end of the row
+        run_start = np.zeros(n_unique*n_cols, dtype=bool)
+        run_start[starts] = True
+        run_start = run_start.reshape(n_unique, n_cols)
+        uncompressed = np.zeros(n_unique*n_cols, dtype=bool)
+        uncompressed[starts[run_lengths == 1]] = True
+        uncompressed = uncompressed.reshape(n_unique, n_cols)
+        isolated = uncompressed.copy()
+        isolated[:, 1:] &= ~uncompressed[:, :-1]
+        isolated[:, :-1] &= ~uncompressed[:, 1:]
+        uncompressed[:, 1:] |= isolated[:, :-1]
+        uncompressed[:, -2] |= isolated[:, -1]
+
+        # runs that lost a pixel to a block and are now single pixels join the block
+        block_start, block_lengths, block_uncompressed = self.erle_blocks(run_start, uncompressed)
+        single = np.zeros(n_unique*n_cols, dtype=bool)
+        single[block_start[(block_lengths == 1) & ~block_uncompressed]] = True
+        uncompressed |= single.reshape(n_unique, n_cols)
+        block_start, block_lengths, block_uncompressed = self.erle_blocks(run_start, uncompressed)
+
+        # merge the blocks of the unique rows with one copy command per repeated row
+        repeated_rows = np.flatnonzero(~new_row)
+        order = np.argsort(np.concatenate((unique_rows[block_start//n_cols], repeated_rows)), kind='stable')
+        n_blocks = np.size(block_start)
+        is_copy = order >= n_blocks
+        block_idx = np.where(is_copy, 0, order)
+        counts = np.where(is_copy, n_cols, block_lengths[block_idx])
+        is_uncompressed = ~is_copy & block_uncompressed[block_idx]
+        is_repeat = ~is_copy & ~is_uncompressed
+
+        count_size = np.where(counts < 0x80, 1, 2)
+        command_size = count_size + np.where(is_repeat, n_channels, 1) + np.where(is_uncompressed, n_channels*counts, 0)
+        command_size[is_copy] = 1 + count_size[is_copy]
+        command_start = np.cumsum(command_size) - command_size
+
+        compressed_pattern = np.empty(np.sum(command_size), dtype=np.uint8)
+        count_pos = command_start + ~is_repeat
+        compressed_pattern[command_start[is_copy]] = 0x01
+        compressed_pattern[command_start[is_uncompressed]] = 0x00
+        compressed_pattern[count_pos] = np.where(count_size == 1, counts, (counts & 0x7f) | 0x80)
+        two_bytes = count_size == 2
+        compressed_pattern[count_pos[two_bytes] + 1] = counts[two_bytes] >> 7
+        data_pos = count_pos + count_size
+
+        flat_pattern = np.reshape(sub_pattern, (n_unique*n_cols, n_channels))
+        repeat_pixel = block_start[block_idx[is_repeat]]
+        uncompressed_blocks = block_idx[is_uncompressed]
+        pixel_counts = block_lengths[uncompressed_blocks]
+        first_pixel = np.cumsum(pixel_counts) - pixel_counts
+        block_pixel = np.arange(np.sum(pixel_counts)) - np.repeat(first_pixel, pixel_counts)
+        uncompressed_pixel = np.repeat(block_start[uncompressed_blocks], pixel_counts) + block_pixel
+        uncompressed_pos = np.repeat(data_pos[is_uncompressed], pixel_counts) + n_channels*block_pixel
+        for channel in range(n_channels):
+            compressed_pattern[data_pos[is_repeat] + channel] = flat_pattern[repeat_pixel, channel]
+            compressed_pattern[uncompressed_pos + channel] = flat_pattern[uncompressed_pixel, channel]
+
+        row_commands = np.ones(n_rows, dtype=np.int64)
+        row_commands[unique_rows] = np.bincount(block_start//n_cols, minlength=n_unique)
+        row_offsets = np.append(command_start, np.size(compressed_pattern))[np.concatenate(([0], np.cumsum(row_commands)))]
+        return compressed_pattern, row_offsets
+
+    def erle_blocks(self, run_start, uncompressed):
+        """
+        :param (M, N) boolean matrices of run starts and of pixels that go into uncompressed blocks
+        :returns flat first indexes of the erle blocks, their lengths, True for uncompressed blocks.
+        Consecutive uncompressed pixels form one block, the other blocks are the (remaining) runs.
+        """
+        n_rows, n_cols = np.shape(run_start)
+        block_start = run_start & ~uncompressed
+        block_start[:, 1:] |= uncompressed[:, 1:] & ~uncompressed[:, :-1]
+        block_start[:, 1:] |= ~uncompressed[:, 1:] & uncompressed[:, :-1]
+        block_start[:, 0] = True
+        starts = np.flatnonzero(block_start)
+        block_lengths = np.diff(np.append(starts, n_rows*n_cols))
+
+        return starts, block_lengths, np.ravel(uncompressed)[starts]
+
+    def frame_rle_runs(self, pattern):
+        """
+        Whole frame version of standard_rle_compression. Runs never cross a row boundary.
+        :param (M, N, 3) matrix that represents a pattern
+        :returns flat first indexes of runs, lengths of runs, (n_runs, 3) vals of runs.
+        """
+        n_rows, n_cols, n_channels = np.shape(pattern)
+        new_run = np.ones((n_rows, n_cols), dtype=bool)
+        if n_channels == 3 and pattern.dtype == np.uint8 and pattern.flags['C_CONTIGUOUS'] and n_rows*n_cols > 1:
+            # every pixel as one uint32: the 4 bytes from its first byte, the byte of the next pixel masked out
+            codes = np.empty(n_rows*n_cols, dtype=np.uint32)
+            codes[:-1] = np.ndarray(n_rows*n_cols - 1, dtype='<u4', buffer=pattern, strides=(3,))
+            last = pattern[-1, -1].astype(np.uint32)
+            codes[-1] = last[0] | last[1] << 8 | last[2] << 16
+            codes &= 0xffffff
+            codes = codes.reshape(n_rows, n_cols)
+            np.not_equal(codes[:, 1:], codes[:, :-1], out=new_run[:, 1:])
+        else:
+            # compare each value with the one n_channels further along the row, then 
+            # combine the channels of a pixel. Much cheaper than np.any(..., axis=2)
+            flat_rows = np.reshape(pattern, (n_rows, n_cols*n_channels))
+            changes = np.reshape(flat_rows[:, n_channels:] != flat_rows[:, :-n_channels], 
+                                 (n_rows, n_cols - 1, n_channels))
+            new_run[:, 1:] = changes[:, :, 0]
+            for channel in range(1, n_channels):
+                new_run[:, 1:] |= changes[:, :, channel]
+
+        starts = np.flatnonzero(new_run)
+        run_lengths = np.diff(np.append(starts, n_rows*n_cols))
+        vals = np.reshape(pattern, (n_rows*n_cols, n_channels))[starts]
+
+        return starts, run_lengths, vals
+
+    def split_long_runs(self, run_lengths, vals, max_run_length=255):
+        """
+        Split runs that do not fit into one count byte, like parse_run does for a single run.
+        :param lengths of runs, (n_runs, 3) vals of runs
+        :returns counts of the split runs (max_run_length except for the last piece), their vals
+        """
+        n_pieces = (run_lengths - 1)//max_run_length + 1
+        last_pieces = np.cumsum(n_pieces) - 1
+        counts = np.full(last_pieces[-1] + 1, max_run_length, dtype=np.int64)
+        counts[last_pieces] = run_lengths - max_run_length*(n_pieces - 1)
+
+        return counts, np.repeat(vals, n_pieces, axis=0)
+
     def rle_row_comp(self,row):
         run_idxs, run_lengths, vals = self.standard_rle_compression(row, 0)
         
@@ -126,6 +793,82 @@ class DMDPattern():
             commands+=self.parse_run(run_length, run_val)
             return commands
 
+    def decompress_pattern(self, image_bits):
+        """
+        Inverse of compress_pattern, reads the header to find size and compression type.
+        :param 1D array of uint8's, header followed by the compressed bitmap
+        :return (M, N, 3) matrix of uint8 with the pattern
+        """
+        image_bits = np.asarray(image_bits, dtype=np.uint8)
+        resolution = (int(image_bits[4]) + (int(image_bits[5]) << 8), int(image_bits[6]) + (int(image_bits[7]) << 8))
+        compressed_pattern_length = sum(int(image_bits[8 + i]) << 8*i for i in range(4))
+        compressed_pattern = image_bits[48:48 + compressed_pattern_length]
+        decompression_function_dict = {0: self.non_decompressed_image, 1: self.rle_decompressed_image, 2: self.erle_decompressed_image}
+
+        return decompression_function_dict[int(image_bits[25])](compressed_pattern, resolution)
+
+    def non_decompressed_image(self, compressed_pattern, resolution=(1920, 1080)):
+        """
+        Inverse of non_compressed_image. Every value of the pattern was reduced to one bit there.
+        :return (M, N, 3) matrix of 0's and 1's
+        """
+        return np.unpackbits(compressed_pattern)[:3*resolution[0]*resolution[1]].reshape(resolution[1], resolution[0], 3)
+
+    def rle_decompressed_image(self, compressed_pattern, resolution=(1920, 1080)):
+        """
+        :param 1D array of uint8's with the rle compressed bitmap
+        :param (width, height) of the image
+        :return (M, N, 3) matrix of uint8 with the pattern
+        """
+        return self.run_length_decode(compressed_pattern, resolution, enhanced=False)
+
+    def erle_decompressed_image(self, compressed_pattern, resolution=(1920, 1080)):
+        """
+        :param 1D array of uint8's with the erle compressed bitmap
+        :param (width, height) of the image
+        :return (M, N, 3) matrix of uint8 with the pattern
+        """
+        return self.run_length_decode(compressed_pattern, resolution, enhanced=True)
+
+    def run_length_decode(self, compressed_pattern, resolution, enhanced):
+        """
+        Command by command decoder for rle and erle bitmaps. In erle, counts >= 128 take two bytes
+        and a control byte of 1 copies n pixels from the previous line.
+        """
+        n_cols, n_rows = resolution
+        image = np.zeros((n_rows*n_cols, 3), dtype=np.uint8)
+        data = np.asarray(compressed_pattern, dtype=np.uint8).tolist()
+
+        def read_count(pos):
+            if enhanced and data[pos] & 0x80:
+                return (data[pos] & 0x7f) | (data[pos + 1] << 7), pos + 2
+            return data[pos], pos + 1
+
+        pos, pixel = 0, 0
+        while True:
+            control = data[pos]
+            if control == 0x00:
+                count, pos = read_count(pos + 1)
+                if count == 0: # end of line
+                    pixel += -pixel % n_cols
+                elif count == 1: # end of image
+                    break
+                else: # uncompressed pixels
+                    image[pixel:pixel + count] = np.reshape(data[pos:pos + 3*count], (count, 3))
+                    pos += 3*count
+                    pixel += count
+            elif enhanced and control == 0x01: # copy from previous line
+                count, pos = read_count(pos + 1)
+                image[pixel:pixel + count] = image[pixel - n_cols:pixel - n_cols + count]
+                pixel += count
+            else: # repeat the next pixel
+                count, pos = read_count(pos)
+                image[pixel:pixel + count] = data[pos:pos + 3]
+                pos += 3
+                pixel += count
+
+        return image.reshape(n_rows, n_cols, 3)
+
     def make_header(self,compressed_pattern_length,compression_type):
         """
         :return header for image sequence
@@ -160,6 +903,8 @@ class DMDPattern():
             hex_array.append((number >> n*8) & 0xff)
         return hex_array
 
+default_cache = PatternCache(version_tags=ENCODER_TAGS)
+
 if __name__ == '__main__':
     pattern = DMDPattern()
     pattern.load_png('../DMD_Test/grayscale.png')
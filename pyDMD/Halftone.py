@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+class Halftone():
+    def __init__(self, method='bayer', matrix_size=8, blue_noise_size=64, seed=0):
+        """
+
+        Converts grayscale images to 1 bit patterns, whole frames or stacks
+        of frames at once. The results are bit-packed rows like np.packbits,
+        the layout of DMDPattern(compact=True).
+
+        Parameters
+        ----------
+        method : TYPE, optional: string
+            DESCRIPTION. The default is 'bayer'. 'threshold', 'bayer' or
+            'blue_noise' (ordered dithering with a tiled threshold matrix) or
+            'error_diffusion' (Floyd-Steinberg).
+
+        matrix_size : TYPE, optional: int
+            DESCRIPTION. The default is 8. Size of the Bayer matrix, a power of 2.
+
+        blue_noise_size : TYPE, optional: int
+            DESCRIPTION. The default is 64. Size of the blue noise matrix, it
+            is made once per size and seed with the void and cluster method.
+
+        seed : TYPE, optional: int
+            DESCRIPTION. The default is 0. Seed of the blue noise matrix.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if method not in ('threshold', 'bayer', 'blue_noise', 'error_diffusion'):
+            raise Exception("Unknown halftone method %s." %method)
+        self.method = method
+        self.matrix_size = matrix_size
+        self.blue_noise_size = blue_noise_size
+        self.seed = seed
+        self.thresholds = {} # tiled threshold matrix per frame shape
+
+    def to_bits(self, images, threshold=128):
+        """
+
+        Halftone one image or a stack of images.
+
+        Parameters
+        ----------
+        images : TYPE: numpy array
+            DESCRIPTION: (M, N) or (K, M, N) gray levels 0-255, or colors
+            (..., 3) which are averaged. N has to be a multiple of 8.
+
+        threshold : TYPE, optional: float
+            DESCRIPTION. The default is 128. Threshold of the 'threshold' and
+            'error_diffusion' methods.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (M, N/8) or (K, M, N/8) array of uint8's, same number
+            of dimensions as the gray images.
+
+        """
+
+        images = self.gray_levels(images)
+        if self.method == 'threshold':
+            binary = images >= threshold
+        elif self.method == 'error_diffusion':
+            binary = self.error_diffusion(images, threshold)
+        else:
+            binary = images >= self.threshold_matrix(images.shape[-2:])
+        return np.packbits(binary, axis=-1)
+
+    def gray_levels(self, images):
+        """
+        :return the images as gray levels, colors are averaged, bool images are 0 or 255
+        """
+        images = np.asarray(images)
+        if images.dtype == bool:
+            images = images*np.uint8(255)
+        if images.ndim >= 3 and images.shape[-1] == 3: # rows are multiples of 8 pixels, so this is a color axis
+            images = images.mean(axis=-1)
+        return images
+
+    def threshold_matrix(self, shape):
+        """
+        :param (M, N) frame shape
+        :return (M, N) uint8 thresholds, the Bayer or blue noise matrix tiled over the frame
+        """
+        if shape not in self.thresholds:
+            if self.method == 'bayer':
+                ranks = bayer_matrix(self.matrix_size)
+            else:
+                ranks = blue_noise_matrix(self.blue_noise_size, self.seed)
+            # rank r of n thresholds at the middle of its gray level interval
+            thresholds = (256*ranks + 128)//ranks.size
+            repeats = (shape[0]//len(ranks) + 1, shape[1]//len(ranks) + 1)
+            self.thresholds[shape] = np.tile(thresholds, repeats)[:shape[0], :shape[1]].astype(np.uint8)
+        return self.thresholds[shape]
+
+    def error_diffusion(self, images, threshold=128):
+        """
+
+        Floyd-Steinberg error diffusion. A pixel only depends on pixels with
+        a smaller x + 2*y, so all pixels on the line x + 2*y = t of all
+        frames are done in one vectorized step (N + 2M steps per stack).
+
+        Parameters
+        ----------
+        images : TYPE: numpy array
+            DESCRIPTION: (M, N) or (K, M, N) gray levels 0-255
+
+        Returns
+        -------
+        binary : TYPE: numpy array
+            DESCRIPTION: boolean array of the shape of images
+
+        """
+
+        images = np.asarray(images, dtype=np.float32)
+        frames = images.reshape((-1,) + images.shape[-2:])
+        n_frames, height, width = frames.shape
+        row_length = width + 2 # one column of padding on both sides
+        levels = np.zeros((n_frames, (height + 1)*row_length), dtype=np.float32)
+        levels.reshape(n_frames, height + 1, row_length)[:, :height, 1:width + 1] = frames
+        binary = np.zeros((n_frames, (height + 1)*row_length), dtype=bool)
+
+        rows = np.arange(height)
+        for step in range(width + 2*(height - 1)):
+            columns = step - 2*rows
+            valid = (columns >= 0) & (columns < width)
+            positions = rows[valid]*row_length + columns[valid] + 1
+            values = levels[:, positions]
+            is_on = values >= threshold
+            binary[:, positions] = is_on
+            error = values - 255*is_on
+            # one statement per neighbour, so no position is written twice in a statement
+            levels[:, positions + 1] += 7/16*error
+            levels[:, positions + row_length - 1] += 3/16*error
+            levels[:, positions + row_length] += 5/16*error
+            levels[:, positions + row_length + 1] += 1/16*error
+
+        binary = binary.reshape(n_frames, height + 1, row_length)[:, :height, 1:width + 1]
+        return binary.reshape(images.shape)
+
+
+def bayer_matrix(size):
+    """
+    :param size, a power of 2
+    :return (size, size) Bayer index matrix with the values 0 to size**2 - 1
+    """
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([[4*matrix, 4*matrix + 2], [4*matrix + 3, 4*matrix + 1]])
+    return matrix
+
+
+blue_noise_matrices = {}
+
+def blue_noise_matrix(size=64, seed=0, sigma=1.5):
+    """
+
+    Blue noise rank matrix made with the void and cluster method: pixels are
+    ranked by adding them one by one where the (toroidal, gaussian filtered)
+    pattern has its largest void. Made once per size and seed.
+
+    Returns
+    -------
+    ranks : TYPE: numpy array
+        DESCRIPTION: (size, size) matrix with the values 0 to size**2 - 1
+
+    """
+
+    if (size, seed, sigma) in blue_noise_matrices:
+        return blue_noise_matrices[(size, seed, sigma)]
+
+    distance = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(distance[:, None]**2 + distance[None, :]**2)/(2*sigma**2))
+    kernel_spectrum = np.fft.rfft2(kernel)
+    energy_of = lambda pattern: np.fft.irfft2(np.fft.rfft2(pattern)*kernel_spectrum, s=pattern.shape)
+
+    # initial pattern: random points, moved from the tightest cluster to the largest void until stable
+    pattern = np.random.default_rng(seed).random((size, size)) < 0.1
+    while True:
+        energy = energy_of(pattern)
+        cluster = np.argmax(np.where(pattern, energy, -np.inf))
+        pattern.flat[cluster] = False
+        energy = energy_of(pattern)
+        void = np.argmin(np.where(pattern, np.inf, energy))
+        pattern.flat[void] = True
+        if void == cluster:
+            break
+    initial = pattern.copy()
+    n_initial = int(initial.sum())
+
+    ranks = np.zeros(size*size, dtype=np.int64)
+    # ranks below n_initial: remove the tightest clusters of the initial pattern
+    energy = energy_of(pattern)
+    for rank in range(n_initial - 1, -1, -1):
+        cluster = np.argmax(np.where(pattern, energy, -np.inf))
+        pattern.flat[cluster] = False
+        energy -= np.roll(kernel, np.unravel_index(cluster, pattern.shape), axis=(0, 1))
+        ranks[cluster] = rank
+    # ranks from n_initial on: fill the largest voids
+    pattern = initial
+    energy = energy_of(pattern)
+    for rank in range(n_initial, size*size):
+        void = np.argmin(np.where(pattern, np.inf, energy))
+        pattern.flat[void] = True
+        energy += np.roll(kernel, np.unravel_index(void, pattern.shape), axis=(0, 1))
+        ranks[void] = rank
+
+    blue_noise_matrices[(size, seed, sigma)] = ranks.reshape(size, size)
+    return blue_noise_matrices[(size, seed, sigma)]
@@ -2,6 +2,8 @@
 
 import numpy as np 
 import math
+import hashlib
+from collections import OrderedDict
 import matplotlib.pyplot as plt
 from pyDMD.USBdevice import USBdevice
 from time import sleep
@@ -9,7 +11,11 @@ from pyDMD.DMDPattern import DMDPattern
 
 
 class LightCrafter6500():
-    def __init__(self, device=None):
+    def __init__(self, device=None, command_window=8):
+        """
+        :param device: USBdevice to use, if None the DMD is opened
+        :param command_window: number of queued commands that may wait for their answer, see CommandWindow
+        """
         if device != None:
             self.USB_dev = device
         else:
@@ -18,8 +24,39 @@ class LightCrafter6500():
         self.vid = self.USB_dev.V_id
         self.pid = self.USB_dev.P_id
         self.os = self.USB_dev.os
+        self.commands = CommandWindow(self.USB_dev, command_window)
+        # last written device settings, writes that would not change them are skipped
+        self.mode = None
+        self.shadow = {'lut': {}, 'images': {}}
+        self.display_mode_get()
         self.set_pattern_on_the_fly_mode()
-        self.mode = 'pattern_on_the_fly'
+
+    def resync(self):
+        """
+        
+        Read the display mode, flips, trigger delay and input source back from
+        the device into the shadow copy, e.g. after the device was used by 
+        another program. LUT entries and the sequence state are forgotten and
+        sent again by the next writes, and so are the images.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.barrier()
+        self.display_mode_get()
+        self.shadow = {'lut': {}, 'images': {}}
+        self.USB_dev.create_dmd_command('r',True,0x22,0x1008)
+        self.shadow['long_axis_flip'] = bool(self.read_error_code(0x22)[1][5] & 0x80)
+        self.USB_dev.create_dmd_command('r',True,0x23,0x1009)
+        self.shadow['short_axis_flip'] = bool(self.read_error_code(0x23)[1][5] & 0x80)
+        self.USB_dev.create_dmd_command('r',True,0x43,0x1a35)
+        answer = self.read_error_code(0x43)[1]
+        self.shadow['trigger_in_1'] = (answer[5] + (answer[6] << 8), answer[7] == 0x00)
+        self.USB_dev.create_dmd_command('r',True,0x21,0x1a00)
+        self.shadow['input_source'] = self.read_error_code(0x21)[1][5]
 
     def pattern_display_start_stop(self,start_stop):
         """
@@ -50,20 +87,26 @@ class LightCrafter6500():
 
         """
         
-        self.display_mode_get()
+        self.barrier()
+        if self.mode is None:
+            self.display_mode_get()
         if self.mode != 'pattern_on_the_fly':
             print("Cant do '%s' in current mode." %start_stop)
         else:
             command_list = {'start': 0x02,'stop':0x00,'pause':0x01}
             if not start_stop in command_list.keys():
                 raise Exception('Allowed arguments are start, stop and pause')
+            if start_stop == 'stop' and self.shadow.get('sequence') == 'stop':
+                return
             self.USB_dev.create_dmd_command('w',True,0x12,0x1a24, data=[command_list[start_stop]])
             self.read_error_code(0x12)
+            self.shadow['sequence'] = start_stop
             print("Programmed pattern sequence %s"%start_stop) 
     
     def display_mode_selection(self,mode):
         """
-        Selects in which mode the DMD should operate
+        Selects in which mode the DMD should operate. Nothing is sent if the
+        DMD is known to be in this mode already.
 
         Parameters
         ----------
@@ -85,8 +128,14 @@ class LightCrafter6500():
         
         mode_list = {'video':0x00,'pre-stored_pattern':0x01,'video_pattern':0x02,'pattern_on_the_fly':0x03}
         assert mode in mode_list.keys()
+        if self.mode == mode:
+            return
+        self.barrier()
         self.USB_dev.create_dmd_command('w',True,0x13,0x1a1b,data=[mode_list[mode]])
         self.read_error_code(0x13)
+        self.mode = mode
+        self.shadow['sequence'] = 'stop' # a mode change stops the sequence
+        self.forget_images() # and the uploaded images may be gone
         print('DMD set in %s mode' %mode)
     
     def set_pattern_on_the_fly_mode(self):
@@ -134,7 +183,8 @@ class LightCrafter6500():
         """
         
 
-        Flip a displayed image along its long axis.
+        Flip a displayed image along its long axis. The command is queued,
+        errors are raised by the next barrier.
 
         Parameters
         ----------
@@ -154,15 +204,18 @@ class LightCrafter6500():
             data = 0x00
         else:
             raise Exception('on_off has to be True or False')
-        self.USB_dev.create_dmd_command('w',True,0x22,0x1008,[data])
-        self.read_error_code(0x22)
+        if self.shadow.get('long_axis_flip') == on_off:
+            return
+        self.queue_command(0x1008, [data])
+        self.shadow['long_axis_flip'] = on_off
         print("Long axis flip %s"%on_off)
         
 
     def short_axis_image_flip(self,on_off):
         """
         
-        Up-down image flip.
+        Up-down image flip. The command is queued, errors are raised by the
+        next barrier.
 
         Parameters
         ----------
@@ -182,8 +235,10 @@ class LightCrafter6500():
             data1 = 0x00
         else:
             raise Exception('on_off has to be True or False')
-        self.USB_dev.create_dmd_command('w',True,0x23,0x1009,data=[data1])
-        self.read_error_code(0x23)
+        if self.shadow.get('short_axis_flip') == on_off:
+            return
+        self.queue_command(0x1009, [data1])
+        self.shadow['short_axis_flip'] = on_off
         print("Short axis flip %s"%on_off)
         
     def park_unpark(self, mode):
@@ -296,12 +351,15 @@ class LightCrafter6500():
         assert mode in mode_dict.keys()
         bit_depth_dict={'30_bits':'00','24_bits':'01','20_bits':'10','16_bits':'11'}
         assert bit_depth in bit_depth_dict.keys()
-        self.mode = 'video'
 
         data_string = '000' + bit_depth_dict[bit_depth] + mode_dict[mode]
         data[0] = int(data_string,2)
+        if self.shadow.get('input_source') == data[0]:
+            return
         self.USB_dev.create_dmd_command('w',True,0x21,0x1a00,data=data)
         self.read_error_code(0x21)
+        self.mode = 'video'
+        self.shadow['input_source'] = data[0]
         print("Input source is now %s" %mode)
 
     def trigger_in_1(self, trigger_delay, is_trigger_rising_edge = True):
@@ -309,7 +367,8 @@ class LightCrafter6500():
 
         The Trigger In 1 command sets the rising edge delay of the TRIG_IN1
         signal compared to when the pattern is displayed on the DMD. Before
-        executing this command, stop the current pattern sequence.
+        executing this command, stop the current pattern sequence. The command
+        is queued, errors are raised by the next barrier.
 
         Parameters
         ----------
@@ -334,22 +393,26 @@ class LightCrafter6500():
 
         if trigger_delay < 105:
             raise Exception("Minimum 105 µs trigger_delay")
-        else:
+        elif self.shadow.get('trigger_in_1') != (trigger_delay, is_trigger_rising_edge):
             print("configuring trigger")
             trigger_delay_bytes = self.int_to_hex_array(trigger_delay, 2)
             rising_edge_bit = [0x00] if is_trigger_rising_edge else [0x01]
             data = trigger_delay_bytes + rising_edge_bit
-            self.USB_dev.create_dmd_command('w', True, 0x43, 0x1a35, data)
-            self.read_error_code(0x43)
+            self.queue_command(0x1a35, data)
+            self.shadow['trigger_in_1'] = (trigger_delay, is_trigger_rising_edge)
             print('Set the rising edge delay of the TRIG_IN1 signal:')
 
     def pattern_display_LUT_definition(self, pattern_index, wait_for_trigger, 
                                        exposure_time = 105, dark_time = 105, 
-                                       bit_depth = 1, flicker_active = True):
+                                       bit_depth = 1, flicker_active = True,
+                                       image_index = None, bit_position = 0):
         """
         The Pattern Display LUT Definition contains the definition of each pattern 
         to be displayed during the pattern sequence. Display Mode must be set
-        before sending any pattern LUT definition data. LEDs are always disabled
+        before sending any pattern LUT definition data. LEDs are always disabled.
+        The command is queued without error check (checking it caused problems
+        for short exposure times), if the DMD rejects it the next barrier only
+        forgets the programmed LUT, so it is sent in full next time.
 
         Parameters
         ----------
@@ -374,6 +437,14 @@ class LightCrafter6500():
             DESCRIPTION. The default is True. True if one wants to activate 
             flickering, False otherwise.
 
+        image_index : TYPE, optional: int
+            DESCRIPTION. The default is None. Index of the uploaded image that 
+            holds the pattern. If None, the image index is the pattern_index.
+            
+        bit_position : TYPE, optional: int
+            DESCRIPTION. The default is 0. Position of the (first) bit of the 
+            pattern in the 24 bit image. Must be between 0 and 23.
+
         
         Raises
         ------
@@ -386,6 +457,21 @@ class LightCrafter6500():
         None.
 
 
+        """
+        data = self.LUT_definition_data(pattern_index, wait_for_trigger, exposure_time, dark_time,
+                                        bit_depth, flicker_active, image_index, bit_position)
+        if self.shadow['lut'].get(pattern_index) == data:
+            return
+        self.queue_command(0x1a34, data, check=False)
+        self.shadow['lut'][pattern_index] = data
+        print('Defined LUT index=', pattern_index)
+
+    def LUT_definition_data(self, pattern_index, wait_for_trigger, exposure_time = 105, 
+                            dark_time = 105, bit_depth = 1, flicker_active = True,
+                            image_index = None, bit_position = 0):
+        """
+        :param the arguments of pattern_display_LUT_definition
+        :return the 12 data bytes of the LUT definition command
         """
         if pattern_index > 256 and pattern_index < 0:
             raise Exception("Wrong pattern_index") 
@@ -415,13 +501,112 @@ class LightCrafter6500():
 
             dark_time_bytes = self.int_to_hex_array(dark_time, 3)
             trig2_output_bytes = [0x00]
+
+            if image_index is None:
+                image_index = pattern_index
+            if bit_position < 0 or bit_position > 23:
+                raise Exception("Wrong bit_position")
+            # bits 10:0 image index, bits 15:11 bit position in the image
+            image_bytes = self.int_to_hex_array(image_index | (bit_position << 11), 2)
             
             data = pattern_index_bytes + exposure_bytes + trigger_settings_bytes + \
-                dark_time_bytes + trig2_output_bytes + pattern_index_bytes
-            self.USB_dev.create_dmd_command('w', True, 0x65, 0x1a34, data)
-            #self.read_error_code(0x65)
-            #somehow this command caused problems for shor exposure times. Dont understand why
-            print('Defined LUT index=', pattern_index)
+                dark_time_bytes + trig2_output_bytes + image_bytes
+            return data
+
+    def program_LUT(self, entries, number_of_repeats = 0):
+        """
+        
+        Program the whole pattern display LUT of a sequence. All entries are
+        built first and compared with the last programmed LUT, only the 
+        changed ones are sent, all of them queued in the command window. 
+        Then the LUT is configured once.
+
+        Parameters
+        ----------
+        entries : TYPE: list
+            DESCRIPTION: one dict per pattern of the sequence with the keyword
+            arguments of pattern_display_LUT_definition, e.g. 
+            {'wait_for_trigger': False, 'exposure_time': 1000}. The pattern 
+            index is the position in the list.
+            
+        number_of_repeats : TYPE, optional: int
+            DESCRIPTION. The default is 0. Number of repeats of the sequence,
+            see pattern_display_LUT_configuration.
+
+        Returns
+        -------
+        changed : TYPE: list
+            DESCRIPTION: indexes of the entries that were sent.
+
+        """
+        
+        lut_data = [self.LUT_definition_data(pattern_index, **entry) for pattern_index, entry in enumerate(entries)]
+        changed = [pattern_index for pattern_index, data in enumerate(lut_data) 
+                   if self.shadow['lut'].get(pattern_index) != data]
+        for pattern_index in changed:
+            self.queue_command(0x1a34, lut_data[pattern_index], check=False) # see pattern_display_LUT_definition
+            self.shadow['lut'][pattern_index] = lut_data[pattern_index]
+        print('Defined %s of %s LUT entries' %(len(changed), len(entries)))
+        self.pattern_display_LUT_configuration(len(entries), number_of_repeats)
+        return changed
+
+    def forget_images(self):
+        """
+        Forget which images are on the device, the next load_image calls send every image.
+        """
+        self.shadow['images'] = {}
+        self.shadow.pop('image_end', None)
+
+    def load_image(self, index, image_bits, digest = None):
+        """
+        
+        Upload an image to an image index unless the same image is there
+        already. Upload the images of a sequence in reverse order, like 
+        initialize_pattern_BMP_load: the controller stores them one after 
+        the other from the highest index down, so an image is placed right 
+        after the image of the next higher index. The shadow copy keeps the
+        sha256, address and length of the image in every index. An image is
+        only skipped if it is also at the address it would be loaded to, so
+        when an image changes its length all lower indexes are sent again.
+        Images whose memory an upload overwrites are forgotten.
+
+        Parameters
+        ----------
+        index : TYPE: int
+            DESCRIPTION: image index on the device.
+            
+        image_bits : TYPE: numpy array
+            DESCRIPTION: compressed image including the header, 1d array of uint8's.
+            
+        digest : TYPE, optional: bytes
+            DESCRIPTION. The default is None. sha256 of image_bits if known, 
+            e.g. from a PatternLibrary.
+
+        Returns
+        -------
+        sent : TYPE: Bool
+            DESCRIPTION: False if the image was on the device already.
+
+        """
+        
+        if digest is None:
+            digest = hashlib.sha256(np.ascontiguousarray(image_bits, dtype=np.uint8)).digest()
+        length = np.size(image_bits)
+        # (index, end address) of the last image of this pass, a pass starts at address 0
+        previous_index, address = self.shadow.get('image_end', (None, 0))
+        if previous_index != index + 1:
+            address = 0
+        self.shadow['image_end'] = (index, address + length)
+        if self.shadow['images'].get(index) == (digest, address, length):
+            return False
+        self.shadow['images'].pop(index, None) # unknown until the upload is complete
+        for other_index, (_, other_address, other_length) in list(self.shadow['images'].items()):
+            if other_address < address + length and address < other_address + other_length:
+                del self.shadow['images'][other_index] # overwritten
+        self.initialize_pattern_BMP_load(length, index=index)
+        self.send_image(image_bits)
+        self.shadow['images'][index] = (digest, address, length)
+        return True
 
     def initialize_pattern_BMP_load(self, length, index = 0):
         """
@@ -448,6 +633,7 @@ class LightCrafter6500():
         
         data = self.int_to_hex_array(index, n_bytes=2)
         data+= self.int_to_hex_array(length,n_bytes=4)
+        self.barrier()
         self.USB_dev.create_dmd_command('w',True,0x11,0x1a2a, data=data)
         self.read_error_code(0x11)
 
@@ -484,6 +670,7 @@ class LightCrafter6500():
             patterns_bytes = self.int_to_hex_array(number_of_patterns, n_bytes=2)
             repeats_bytes = self.int_to_hex_array(number_of_repeats, n_bytes=4)
             data = patterns_bytes + repeats_bytes
+            self.barrier()
             self.USB_dev.create_dmd_command('w', True, 0x0d, 0x1a31, data)
             self.read_error_code(0x0d)
 
@@ -491,10 +678,14 @@ class LightCrafter6500():
     def send_image(self,image_bits):
         """
         
+        Send a compressed image to the DMD. The image is framed into HID
+        reports once (see image_reports) and the reports are sent straight
+        from that buffer.
+
         Parameters
         ----------
-        image_bits : TYPE
-            DESCRIPTION.
+        image_bits : TYPE: numpy array
+            DESCRIPTION: compressed image including the header, 1d array of uint8's.
 
         Returns
         -------
@@ -502,24 +693,105 @@ class LightCrafter6500():
 
         """
         
-        max_cmd_payload = 504
+        n_groups = math.ceil(np.size(image_bits)/504)
+        print("Full_cmd_groups: " + str(n_groups))
+        send_reports = getattr(self.USB_dev, 'send_reports', None)
+        if send_reports is not None:
+            send_reports(self.image_reports(image_bits))
+            return
+        send_report = getattr(self.USB_dev, 'send_report', None)
+        for report in self.stream_image_reports(image_bits):
+            if send_report is not None:
+                send_report(report)
+            else:
+                self.USB_dev.raw_command(report[1:].tolist())
+
+    def image_reports(self, image_bits):
+        """
+        
+        Frame a compressed image into the 65 byte HID reports of the upload.
+        The image is cut into command groups of 504 bytes, each with the 
+        8 byte header of command 0x1A2B, the first report of a group carries 
+        56 bytes of payload and the following ones 64. Every report starts 
+        with the report id 0x00, the last group is zero padded and an empty
+        group with sequence byte 0xab ends the image.
+        The reports are written into a buffer that is reused for the next image.
+
+        Parameters
+        ----------
+        image_bits : TYPE: numpy array
+            DESCRIPTION: compressed image including the header, 1d array of uint8's.
+
+        Returns
+        -------
+        reports : TYPE: numpy array
+            DESCRIPTION: (n_reports, 65) array of uint8's, valid until the 
+            next call.
+
+        """
+        
+        image_bits = np.asarray(image_bits, dtype=np.uint8).ravel()
         im_size = np.size(image_bits)
+        n_full = im_size // 504
+        last_length = im_size % 504
+        last_reports = self.group_report_count(last_length) if last_length else 0
+        n_reports = 8*n_full + last_reports + 1
+
+        buffer = getattr(self, 'report_buffer', None)
+        if buffer is None or buffer.shape[0] < n_reports:
+            buffer = np.empty((n_reports, 65), dtype=np.uint8)
+            self.report_buffer = buffer
+        reports = buffer[:n_reports]
+
+        # full groups fill their 8 reports completely, one vectorized copy
+        full_groups = reports[:8*n_full].reshape(n_full, 8*65)
+        full_groups[:, 0::65] = 0
+        full_groups[:, self.group_payload_positions(504)] = image_bits[:504*n_full].reshape(n_full, 504)
+        full_groups[:, 1:9] = self.image_command_header(np.arange(n_full), 504)
+
+        if last_length:
+            last_group = reports[8*n_full:8*n_full + last_reports].reshape(-1)
+            last_group[:] = 0
+            last_group[self.group_payload_positions(last_length)] = image_bits[504*n_full:]
+            last_group[1:9] = self.image_command_header(n_full, last_length)
+
+        reports[-1] = 0
+        reports[-1, 1:9] = self.image_command_header(0xab, 0)
+        return reports
+
+    def stream_image_reports(self, image_bits):
+        """
+        Generator over the HID reports of an image upload.
+        :param image_bits compressed image including the header
+        :return memoryview of each 65 byte report, a slice of the buffer of image_reports without copy
+        """
+        reports = memoryview(self.image_reports(image_bits).reshape(-1))
+        for start in range(0, len(reports), 65):
+            yield reports[start:start + 65]
 
-        num_full_cmd_groups = im_size/max_cmd_payload
-        num_full_cmd_groups = math.ceil(num_full_cmd_groups)
-        remainder_group_length = im_size % max_cmd_payload
-        print("Full_cmd_groups: " + str(num_full_cmd_groups))
-
-        # Send full command groups
-        if num_full_cmd_groups > 1:
-            for cmd_group_index in range(num_full_cmd_groups):  
-                if cmd_group_index % 50 == 0:
-                    print("sending packet group %s" % cmd_group_index)
-                self.send_image_command(image_bits[0+cmd_group_index*max_cmd_payload:max_cmd_payload+cmd_group_index*max_cmd_payload],
-                                                    cmd_group_index)
-        # Send remainder
-        self.send_image_command(image_bits[num_full_cmd_groups*max_cmd_payload:num_full_cmd_groups*max_cmd_payload+remainder_group_length],
-                                            0xab)
+    def image_command_header(self, sequence_byte, payload_length):
+        """
+        :param sequence byte(s) of the command group, payload length in bytes
+        :return the 8 byte header of command 0x1A2B, one row per sequence byte
+        """
+        header = np.zeros(np.shape(sequence_byte) + (8,), dtype=np.uint8)
+        header[..., 1] = np.asarray(sequence_byte) % 256
+        header[..., 2:4] = self.int_to_hex_array(2+2+payload_length)
+        header[..., 4] = 0x2B
+        header[..., 5] = 0x1A
+        header[..., 6:8] = self.int_to_hex_array(payload_length)
+        return header
+
+    def group_report_count(self, payload_length):
+        return 1 + math.ceil(max(payload_length - 56, 0)/64)
+
+    def group_payload_positions(self, payload_length):
+        """
+        :return positions of the payload bytes in the flattened reports of one command group
+        """
+        n_slaves = self.group_report_count(payload_length) - 1
+        slave_positions = 65*np.arange(1, n_slaves + 1)[:, None] + np.arange(1, 65)
+        return np.concatenate((np.arange(9, 65), slave_positions.ravel()))[:payload_length]
 
     def send_image_command(self,image_bits,sequence_byte):
         """
@@ -574,10 +846,12 @@ class LightCrafter6500():
 
     """BASIC COMMANDS"""
 
-    def read_error_code(self,sequence_byte, return_data = False):
+    def read_error_code(self,sequence_byte, return_data = False, timeout = None):
         """
         
-        Check if there is any error when executing a command.
+        Check if there is any error when executing a command. Waits for the 
+        answer with this sequence byte, it wakes up as soon as the answer
+        arrives.
 
         Parameters
         ----------
@@ -585,11 +859,16 @@ class LightCrafter6500():
             DESCRIPTION: Identity of a command, to check if there are any errors
         return_data : TYPE, optional
             DESCRIPTION. The default is False. True if one wants to return data.
+        timeout : TYPE, optional: float
+            DESCRIPTION. The default is None. Seconds to wait for each answer,
+            None for the reply_timeout of the USB device.
 
         Raises
         ------
         DmdError
-            DESCRIPTION.
+            DESCRIPTION: If the device reports an error.
+        Exception
+            DESCRIPTION: If the device does not answer in time.
 
         Returns
         -------
@@ -600,40 +879,22 @@ class LightCrafter6500():
 
         """
         
-        timeout = 0
-        error_bit = 0
-        while True:
-            if self.USB_dev.answer[2] == sequence_byte: #check sequencebyte to identify correct answer
-                flagstring = format(self.USB_dev.answer[1], '08b') #converts the second byte into an 8 character string, third is the error bit
-                if self.USB_dev.answer[1] > 255:
-                    print("Answer by device can not be interpreted!")
-                    break
-                else:
-                    error_bit = int(flagstring[2])
-                    data = self.USB_dev.answer
-                    break
-            else:
-                sleep(0.01)
-                if timeout >= 100:
-                    print("Timeout: Could not finde right device answer!")
-                    break
-                else:
-                    timeout +=1 
+        data = self.USB_dev.wait_for_reply(sequence_byte, timeout)
+        if data is None:
+            raise Exception("Timeout: Could not finde right device answer!")
+        if data[1] > 255:
+            print("Answer by device can not be interpreted!")
+            return 0, data
+        error_bit = int(format(data[1], '08b')[2]) #converts the second byte into an 8 character string, third is the error bit
 
         if error_bit == 1:
             self.USB_dev.create_dmd_command('r',True,0xAB,0x0100)
-            timeout_error = 0
-            error_code = 0
-            while True:
-                if timeout_error >= 100:
-                    print('Timeout: Could not reveive eroor code!')
-                    break
-                else:
-                    if self.USB_dev.answer[2] == 171: #check sequencebyte to identify correct answer
-                        error_code = self.USB_dev.answer[5] #sixth byte transports error code
-                    else:
-                        sleep(0.01)
-                        timeout_error += 1
+            error_answer = self.USB_dev.wait_for_reply(0xAB, timeout)
+            if error_answer is None:
+                print('Timeout: Could not reveive eroor code!')
+                error_code = 0
+            else:
+                error_code = error_answer[5] #sixth byte transports error code
     
             if error_code != 0:
                 raise DmdError(error_code)
@@ -641,6 +902,31 @@ class LightCrafter6500():
         else:
             return 0, data
 
+    def queue_command(self, usb_code, data=[], mode='w', check=True):
+        """
+        Send a command through the command window without waiting for its answer.
+        :param usb_code, data, mode 'r' or 'w', if not check a failure of the command is not raised
+        :return the queued command, see CommandWindow.submit
+        """
+        return self.commands.submit(mode, usb_code, data, check)
+
+    def barrier(self):
+        """
+        Wait for the answers to all queued commands, raises the DmdError of the first failed one.
+        """
+        try:
+            self.commands.barrier()
+        except DmdError:
+            # some queued write did not happen, send the queued settings again next time
+            for key in ('long_axis_flip', 'short_axis_flip', 'trigger_in_1'):
+                self.shadow.pop(key, None)
+            self.shadow['lut'] = {}
+            raise
+        finally:
+            if self.commands.ignored: # unchecked LUT definitions that failed
+                self.commands.ignored = []
+                self.shadow['lut'] = {}
+
     def int_to_hex_array(self, number, n_bytes = 2):
         """
         :param positive integer
@@ -663,6 +949,7 @@ class LightCrafter6500():
         
 
     def releaseUSB(self):
+        self.barrier()
         self.USB_dev.releaseUSB()
 
     def dec_to_bin(self, number):
@@ -670,8 +957,146 @@ class LightCrafter6500():
     
 
 
+class CommandWindow():
+    def __init__(self, usb_dev, depth=8, timeout=None):
+        """
+
+        Keeps up to depth commands in flight. Every queued command gets its
+        own sequence byte from 0x80 to 0xff (the fixed ones of the
+        LightCrafter6500 methods are below), answers are matched by sequence
+        byte in any order. Failed commands are collected and raised as
+        DmdError by barrier.
+
+        Parameters
+        ----------
+        usb_dev : TYPE: USBdevice
+            DESCRIPTION: device the commands are sent to.
+
+        depth : TYPE, optional: int
+            DESCRIPTION. The default is 8. Number of commands without answer,
+            submit waits for an answer when the window is full.
+
+        timeout : TYPE, optional: float
+            DESCRIPTION. The default is None. Seconds to wait for an answer,
+            None for the reply_timeout of usb_dev.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.usb_dev = usb_dev
+        self.depth = depth
+        self.timeout = timeout
+        self.outstanding = OrderedDict() # sequence byte -> command, oldest first
+        self.sequence_bytes = [byte for byte in range(0x80, 0x100) if byte != 0xAB] # 0xAB reads error codes
+        self.next_sequence = 0
+        self.errors = [] # DmdErrors not yet raised by barrier
+        self.ignored = [] # failed commands that were submitted without check
+        self.last_submitted = None # the error code of the controller belongs to this command
+
+    def submit(self, mode, usb_code, data=[], check=True):
+        """
+
+        Send a command and return without waiting for its answer.
+
+        Parameters
+        ----------
+        mode : TYPE: string
+            DESCRIPTION: 'r' or 'w' as in USBdevice.create_dmd_command.
+
+        usb_code : TYPE: hex int
+            DESCRIPTION: USB code of the command.
+
+        data : TYPE, optional: list
+            DESCRIPTION. The default is []. Data of the command.
+
+        check : TYPE, optional: Bool
+            DESCRIPTION. The default is True. If False, a failure of the
+            command is not raised by barrier, the command goes to ignored.
+
+        Returns
+        -------
+        command : TYPE: dict
+            DESCRIPTION: usb_code, data and sequence_byte of the command,
+            answer and error_code are filled in when the answer arrives.
+
+        """
+
+        self.collect()
+        while len(self.outstanding) >= self.depth:
+            self.complete(next(iter(self.outstanding)))
+        sequence_byte = self.free_sequence_byte()
+        command = {'usb_code': usb_code, 'data': list(data), 'sequence_byte': sequence_byte,
+                   'answer': None, 'error_code': None, 'check': check}
+        self.outstanding[sequence_byte] = command
+        self.last_submitted = command
+        self.usb_dev.create_dmd_command(mode, True, sequence_byte, usb_code, data)
+        return command
+
+    def free_sequence_byte(self):
+        while True:
+            sequence_byte = self.sequence_bytes[self.next_sequence]
+            self.next_sequence = (self.next_sequence + 1) % len(self.sequence_bytes)
+            if sequence_byte not in self.outstanding:
+                return sequence_byte
+
+    def collect(self):
+        """
+        Complete every command whose answer has already arrived, in the order of the answers.
+        """
+        for sequence_byte in list(self.outstanding):
+            answer = self.usb_dev.wait_for_reply(sequence_byte, 0)
+            if answer is not None:
+                self.finish(self.outstanding.pop(sequence_byte), answer)
+
+    def complete(self, sequence_byte):
+        """
+        Wait for the answer of one command.
+        """
+        command = self.outstanding.pop(sequence_byte)
+        answer = self.usb_dev.wait_for_reply(sequence_byte, self.timeout)
+        if answer is None:
+            raise Exception("Timeout: no answer to command 0x%04x." %command['usb_code'])
+        self.finish(command, answer)
+
+    def finish(self, command, answer):
+        """
+        Store the answer of a command. If it has the error bit, the error code is read
+        only if no command was sent after it, 0x0100 reports the last command the
+        controller ran. Otherwise the DmdError has no code (value None). Failed commands
+        without check only go to ignored.
+        """
+        command['answer'] = answer
+        command['error_code'] = 0
+        if answer[1] & 0x20 and not command['check']:
+            command['error_code'] = None
+            self.ignored.append(command)
+        elif answer[1] & 0x20: # error bit
+            command['error_code'] = None
+            if command is self.last_submitted:
+                self.usb_dev.create_dmd_command('r', True, 0xAB, 0x0100)
+                error_answer = self.usb_dev.wait_for_reply(0xAB, self.timeout)
+                if error_answer is not None and error_answer[5] != 0:
+                    command['error_code'] = error_answer[5]
+            self.errors.append(DmdError(command['error_code'], command))
+
+    def barrier(self):
+        """
+        Wait for the answers of all commands in flight. Raises the DmdError of
+        the first failed command since the last barrier.
+        """
+        while self.outstanding:
+            self.complete(next(iter(self.outstanding)))
+        if self.errors:
+            error = self.errors[0]
+            self.errors = []
+            raise error
+
+
 class DmdError(Exception):
-    def __init__(self, value):
+    def __init__(self, value, command=None):
         self.error_code_dict = {0:"no error",
                            1:"batch file checksum error",
                            2:"device failure",
@@ -694,8 +1119,13 @@ class DmdError(Exception):
         for i in range(18,255):
             self.error_code_dict[i] = "undefined error"
 
-        self.value = value
+        self.value = value # None if the error code is not known, see CommandWindow.finish
+        self.command = command # the queued command that failed, see CommandWindow
     def __str__(self):
+        if self.value is None: # the error code was overwritten by later commands
+            return repr("unknown error (command 0x%04x)"%self.command['usb_code'])
+        if self.command is not None:
+            return repr("%s: %s (command 0x%04x)"%(self.value, self.error_code_dict[self.value], self.command['usb_code']))
         return repr("%s: %s"%(self.value, self.error_code_dict[self.value]))
 
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import math
+
+# The size of the image memory is not documented. The DLPC900 datasheet gives
+# 400 binary 1920x1080 patterns in pattern on-the-fly mode, the default is the
+# memory these take unpacked: 400*1920*1080/8 bytes. Set memory_bytes for
+# other firmware or DMDs.
+DLPC900_MEMORY_BYTES = 400*1920*1080//8
+
+
+class MemoryPlanner():
+    def __init__(self, memory_bytes=DLPC900_MEMORY_BYTES, max_images=None, max_patterns=255, alignment=1):
+        """
+
+        Predicts whether a sequence fits into the image memory of the DLPC900
+        before anything is sent, and splits sequences that do not fit into
+        batches that do. The footprint of an image is its encoded size
+        (header included) rounded up to the alignment.
+
+        Parameters
+        ----------
+        memory_bytes : TYPE, optional: int
+            DESCRIPTION. The default is DLPC900_MEMORY_BYTES (103,680,000).
+            Image memory of the device for encoded images, None for no limit.
+
+        max_images : TYPE, optional: int
+            DESCRIPTION. The default is None. Number of image indexes if the
+            firmware limits them, None for no limit.
+
+        max_patterns : TYPE, optional: int
+            DESCRIPTION. The default is 255. Number of LUT entries of a
+            sequence, see pattern_display_LUT_configuration.
+
+        alignment : TYPE, optional: int
+            DESCRIPTION. The default is 1. Allocation unit of the image memory
+            in bytes.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.memory_bytes = memory_bytes
+        self.max_images = max_images
+        self.max_patterns = max_patterns
+        self.alignment = alignment
+
+    def always_fits(self, n_images, resolution=(1920, 1080)):
+        """
+        :param number of images, (width, height) of the images
+        :return True if the images fit into memory_bytes whatever they contain, so their encoded sizes are not needed
+        """
+        if self.memory_bytes is None:
+            return True
+        width, height = resolution
+        # the longest encoding is rle with a run per pixel: 4 bytes per pixel, end of line and image, the header
+        max_length = 4*width*height + 2*height + 2 + 48
+        return n_images*self.footprint(max_length) <= self.memory_bytes
+
+    def footprint(self, encoded_length):
+        """
+        :param length of an encoded image including its header
+        :return bytes the image takes in the device memory
+        """
+        return math.ceil(encoded_length/self.alignment)*self.alignment
+
+    def plan(self, encoded_lengths, lut_positions):
+        """
+
+        Pack the patterns of a sequence into batches in LUT order. A batch
+        is closed when the next pattern would need one image, one byte or
+        one LUT entry more than the device has. An image used by patterns
+        of several batches is uploaded with each of them.
+
+        Parameters
+        ----------
+        encoded_lengths : TYPE: list
+            DESCRIPTION: encoded length of every image, 0 if unknown (then
+            only numbers of images and patterns are checked).
+
+        lut_positions : TYPE: list
+            DESCRIPTION: (image_index, bit_position) of every pattern, as
+            given by Pattern_on_the_fly.pack_bit_planes.
+
+        Returns
+        -------
+        report : TYPE: dict
+            DESCRIPTION: 'fits' (the whole sequence fits at once), 'batches'
+            (list of dicts with the 'patterns' and 'images' of a batch and
+            its 'bytes'), 'footprints' of the images, 'total_bytes',
+            'memory_bytes', 'max_images' and 'problems', a list of
+            (image index, reason) for images that never fit.
+
+        """
+
+        footprints = [self.footprint(length) for length in encoded_lengths]
+        memory_bytes = self.memory_bytes if self.memory_bytes is not None else math.inf
+        max_images = self.max_images if self.max_images is not None else math.inf
+        problems = [(image_index, "needs %s bytes, the memory has %s" %(footprint, self.memory_bytes))
+                    for image_index, footprint in enumerate(footprints) if footprint > memory_bytes]
+
+        batches = []
+        batch = None
+        for pattern_index, (image_index, bit_position) in enumerate(lut_positions):
+            new_image = batch is None or image_index not in batch['images']
+            if batch is None or len(batch['patterns']) >= self.max_patterns or (new_image and (
+                    len(batch['images']) >= max_images or batch['bytes'] + footprints[image_index] > memory_bytes)):
+                batch = {'patterns': [], 'images': [], 'bytes': 0}
+                batches.append(batch)
+            batch['patterns'].append(pattern_index)
+            if image_index not in batch['images']:
+                batch['images'].append(image_index)
+                batch['bytes'] += footprints[image_index]
+
+        return {'fits': len(batches) <= 1 and not problems, 'batches': batches, 'footprints': footprints,
+                'total_bytes': sum(footprints), 'memory_bytes': self.memory_bytes,
+                'max_images': self.max_images, 'problems': problems}
+
+    def summary(self, report):
+        """
+        :return the report as readable text
+        """
+        limits = ["memory %s bytes" %report['memory_bytes'] if report['memory_bytes'] is not None else "no memory limit"]
+        if report['max_images'] is not None:
+            limits.append("%s images" %report['max_images'])
+        lines = ["%s images, %s bytes, %s: %s" %(len(report['footprints']), report['total_bytes'], ' and '.join(limits),
+                                                 'fits' if report['fits'] else '%s batches' %len(report['batches']))]
+        for batch_index, batch in enumerate(report['batches']):
+            lines.append("batch %s: patterns %s-%s, %s images, %s bytes" %(batch_index, batch['patterns'][0],
+                         batch['patterns'][-1], len(batch['images']), batch['bytes']))
+        for image_index, reason in report['problems']:
+            lines.append("image %s %s" %(image_index, reason))
+        return '\n'.join(lines)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+import os
+import queue
+import threading
+from time import perf_counter
+from collections import deque
+from itertools import islice, count
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+import numpy as np
+import pyDMD.DMDPattern as dp
+from pyDMD.PatternCache import PatternCache
+
+
+def encode_shared_pattern(memory_name, shape, dtype, compression, storage, pattern_width):
+    """
+    Worker function: encode a pattern that the main process put into shared memory, 
+    in the storage form of the DMDPattern (dense, bit-packed or uint8 planes).
+    :return the pattern as a 1d array of uint8's, including the image header
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        dmd_pattern = dp.DMDPattern(compression=compression, cache=None)
+        dmd_pattern.set_stored_pattern(np.ndarray(shape, dtype=dtype, buffer=memory.buf), storage, pattern_width)
+        image_bits = dmd_pattern.compress_pattern()
+        del dmd_pattern # drop all views of the buffer before closing it
+    finally:
+        memory.close()
+    return image_bits
+
+
+class ParallelEncoder():
+    def __init__(self, workers=None, cache=None):
+        """
+
+        Compresses the patterns of a sequence in a pool of worker processes.
+        The pattern arrays are handed to the workers through shared memory.
+
+        Parameters
+        ----------
+        workers : TYPE, optional: int
+            DESCRIPTION. The default is None. Number of worker processes, None
+            for one per CPU. With 1, patterns are compressed in this process.
+
+        cache : TYPE, optional: PatternCache
+            DESCRIPTION. The default is None. Cache to look up and store the
+            encoded patterns. If None, the cache of each pattern is used.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.cache = cache
+        self.executor = None
+
+    def encode(self, dmd_patterns):
+        """
+
+        Compress all patterns. Cached patterns and patterns that only need a
+        few rows re-encoded are done in this process, identical patterns are
+        encoded once.
+
+        Parameters
+        ----------
+        dmd_patterns : TYPE: list
+            DESCRIPTION: list of DMDPatterns
+
+        Returns
+        -------
+        encoded_patterns : TYPE: list
+            DESCRIPTION: the compressed patterns including header, in the
+            order of dmd_patterns
+
+        """
+
+        if self.workers <= 1:
+            return [dmd_pattern.compress_pattern(cache=self.cache) for dmd_pattern in dmd_patterns]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        encoded_patterns = [None]*len(dmd_patterns)
+        pending = deque()
+        first_index = {} # key -> index of the pattern that gets encoded
+        duplicates = []
+        try:
+            for index, dmd_pattern in enumerate(dmd_patterns):
+                cache = self.cache if self.cache is not None else dmd_pattern.cache
+                # sparse patterns encode faster than a round trip to a worker
+                if (dmd_pattern.storage == 'spans' 
+                        or (dmd_pattern.dirty_rows is not None and dmd_pattern.row_encoding_valid())):
+                    encoded_patterns[index] = dmd_pattern.compress_pattern(cache=cache)
+                    continue
+
+                dmd_pattern.forget_row_encoding() # the encoded rows stay in the worker or the cache
+                key = PatternCache.make_key(dmd_pattern.stored_pattern, dmd_pattern.encoder_tag(), (dmd_pattern.storage,))
+                if key in first_index:
+                    duplicates.append((index, first_index[key]))
+                    continue
+                image_bits = cache.get(key) if cache is not None else None
+                if image_bits is not None:
+                    encoded_patterns[index] = image_bits
+                    continue
+
+                first_index[key] = index
+                pattern = np.ascontiguousarray(dmd_pattern.stored_pattern)
+                memory = shared_memory.SharedMemory(create=True, size=max(pattern.nbytes, 1))
+                try:
+                    np.ndarray(pattern.shape, dtype=pattern.dtype, buffer=memory.buf)[...] = pattern
+                    future = self.executor.submit(encode_shared_pattern, memory.name, pattern.shape,
+                                                  pattern.dtype.str, dmd_pattern.compression,
+                                                  dmd_pattern.storage, dmd_pattern.pattern_width)
+                except BaseException:
+                    memory.close()
+                    memory.unlink()
+                    raise
+                pending.append((index, key, cache, memory, future))
+                if len(pending) >= 2*self.workers: # bound the shared memory in use
+                    self.collect(pending.popleft(), encoded_patterns)
+
+            while pending:
+                self.collect(pending.popleft(), encoded_patterns)
+        finally:
+            self.discard(pending) # left over if a worker failed
+        for index, source_index in duplicates:
+            encoded_patterns[index] = encoded_patterns[source_index]
+        return encoded_patterns
+
+    def collect(self, job, encoded_patterns):
+        index, key, cache, memory, future = job
+        try:
+            encoded_patterns[index] = future.result()
+        finally:
+            memory.close()
+            memory.unlink()
+        if cache is not None:
+            cache.put(key, encoded_patterns[index])
+
+    def discard(self, pending):
+        """
+        Cancel jobs that were not collected, wait for those already running and free their shared memory.
+        """
+        for index, key, cache, memory, future in pending:
+            future.cancel()
+        wait([future for index, key, cache, memory, future in pending])
+        while pending:
+            index, key, cache, memory, future = pending.popleft()
+            memory.close()
+            memory.unlink()
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class BackgroundEncoder():
+    def __init__(self, encoder, dmd_patterns, order, queue_size=4):
+        """
+
+        Encodes patterns in a thread while the consumer sends the previous
+        ones. Iterating gives (index, image_bits) in the requested order, at
+        most queue_size encoded images wait in the queue.
+
+        Parameters
+        ----------
+        encoder : TYPE: ParallelEncoder
+            DESCRIPTION: encoder used by the thread. With more than one worker
+            the thread encodes chunks of one pattern per worker.
+
+        dmd_patterns : TYPE: list
+            DESCRIPTION: list of DMDPatterns
+
+        order : TYPE: iterable
+            DESCRIPTION: indexes of dmd_patterns in the order they are needed,
+            e.g. reversed for the upload.
+
+        queue_size : TYPE, optional: int
+            DESCRIPTION. The default is 4. Number of encoded images the thread
+            may be ahead of the consumer.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.encoder = encoder
+        self.dmd_patterns = dmd_patterns
+        self.order = list(order)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.encode_time = 0.0 # seconds the thread spent encoding
+        self.wait_time = 0.0 # seconds the consumer waited for the thread
+
+    def produce(self):
+        try:
+            chunk_size = max(self.encoder.workers, 1)
+            for first in range(0, len(self.order), chunk_size):
+                chunk = self.order[first:first + chunk_size]
+                start = perf_counter()
+                chunk_bits = self.encoder.encode([self.dmd_patterns[index] for index in chunk])
+                self.encode_time += perf_counter() - start
+                for index, image_bits in zip(chunk, chunk_bits):
+                    if not self.put((index, image_bits)):
+                        return
+        except Exception as error:
+            self.put((None, error))
+        else:
+            self.put((None, None))
+
+    def put(self, item):
+        """
+        Wait for space in the queue unless the consumer stopped.
+        :return True if the item was queued
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        thread = threading.Thread(target=self.produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = perf_counter()
+                index, item = self.queue.get()
+                self.wait_time += perf_counter() - start
+                if index is None:
+                    if item is not None:
+                        raise item
+                    break
+                yield index, item
+        finally:
+            self.stop_event.set()
+
+
+class ChunkEncoder(BackgroundEncoder):
+    def __init__(self, encoder, dmd_patterns, chunk_size, prepare=None, queue_size=2):
+        """
+
+        BackgroundEncoder for an iterable of patterns of any length: the
+        thread reads the patterns in chunks and encodes a whole chunk while
+        the consumer plays the previous ones. Only queue_size encoded chunks
+        (and the one being read) are in memory, so the iterable may be a
+        generator. Iterating gives (chunk, lut_positions, encoded_images).
+
+        Parameters
+        ----------
+        encoder : TYPE: ParallelEncoder
+            DESCRIPTION: encoder used by the thread.
+
+        dmd_patterns : TYPE: iterable
+            DESCRIPTION: DMDPatterns in display order, read lazily.
+
+        chunk_size : TYPE: int
+            DESCRIPTION: number of patterns per chunk, the last one may be
+            shorter.
+
+        prepare : TYPE, optional: function
+            DESCRIPTION. The default is None, one image per pattern. Called
+            with the patterns of a chunk, returns the images to encode and
+            (image index, bit position) of every pattern, like
+            Pattern_on_the_fly.sequence_images.
+
+        queue_size : TYPE, optional: int
+            DESCRIPTION. The default is 2. Number of encoded chunks the thread
+            may be ahead of the consumer.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        super().__init__(encoder, dmd_patterns, [], queue_size)
+        self.chunk_size = chunk_size
+        self.prepare = prepare if prepare is not None else (
+            lambda chunk: (chunk, [(indx, 0) for indx in range(len(chunk))]))
+
+    def produce(self):
+        try:
+            dmd_patterns = iter(self.dmd_patterns)
+            for chunk_index in count():
+                chunk = list(islice(dmd_patterns, self.chunk_size))
+                if not chunk:
+                    break
+                start = perf_counter()
+                images, lut_positions = self.prepare(chunk)
+                encoded_images = self.encoder.encode(images)
+                self.encode_time += perf_counter() - start
+                if not self.put((chunk_index, (chunk, lut_positions, encoded_images))):
+                    return
+        except Exception as error:
+            self.put((None, error))
+        else:
+            self.put((None, None))
+
+    def __iter__(self):
+        for _, item in super().__iter__():
+            yield item
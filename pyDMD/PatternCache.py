@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+class PatternCache():
+    def __init__(self, max_bytes=256*2**20, directory=None, version_tags=()):
+        """
+
+        Content addressed store of encoded patterns. Keeps a bounded in-memory
+        LRU and optionally a directory with one file per encoded pattern.
+
+        Parameters
+        ----------
+        max_bytes : TYPE, optional: int
+            DESCRIPTION. The default is 256 MB. Size limit of the in-memory
+            part. The least recently used entries are evicted first.
+
+        directory : TYPE, optional: string
+            DESCRIPTION. The default is None. Directory for the on-disk store.
+            If None, the cache only lives in memory.
+
+        version_tags : TYPE, optional: list
+            DESCRIPTION. The default is (). Key prefixes of the current encoder
+            versions, e.g. 'rle-v2'. Files in directory that do not start with
+            one of them were written by an older encoder and are deleted.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.version_tags = tuple(version_tags)
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.purge_stale()
+
+    @staticmethod
+    def make_key(pattern, version_tag, header_parameters=()):
+        """
+        :param array with the pattern, version tag of the encoder, other parameters that change the header
+        :return key string, version tag followed by the sha256 of the pattern and parameters
+        """
+        pattern = np.ascontiguousarray(pattern)
+        digest = hashlib.sha256()
+        digest.update(repr((pattern.dtype.str, pattern.shape, tuple(header_parameters))).encode())
+        digest.update(memoryview(pattern).cast('B'))
+        return "%s-%s" %(version_tag, digest.hexdigest())
+
+    def get(self, key):
+        """
+        :return the cached encoded pattern (read only) or None
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self.file_name(key)):
+            image_bits = np.fromfile(self.file_name(key), dtype=np.uint8)
+            self.disk_hits += 1
+            self.store(key, image_bits)
+            return self.entries.get(key, image_bits)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, image_bits):
+        """
+        Add an encoded pattern to memory and, if there is a directory, to disk.
+        """
+        image_bits = np.array(image_bits, dtype=np.uint8)
+        if self.directory is not None:
+            temp_file = self.file_name(key) + '.tmp'
+            image_bits.tofile(temp_file)
+            os.replace(temp_file, self.file_name(key))
+        self.store(key, image_bits)
+
+    def store(self, key, image_bits):
+        image_bits.flags.writeable = False
+        if image_bits.nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key).nbytes
+        self.entries[key] = image_bits
+        self.size += image_bits.nbytes
+        while self.size > self.max_bytes:
+            old_key, old_bits = self.entries.popitem(last=False)
+            self.size -= old_bits.nbytes
+            self.evictions += 1
+
+    def purge_stale(self):
+        """
+        Delete entries whose key does not start with a current version tag.
+        Does nothing if no version tags are known.
+        """
+        if len(self.version_tags) == 0:
+            return
+        is_stale = lambda key: not key.startswith(tuple(tag + '-' for tag in self.version_tags))
+        for key in [key for key in self.entries if is_stale(key)]:
+            self.size -= self.entries.pop(key).nbytes
+            self.invalidations += 1
+        if self.directory is not None:
+            for file in os.listdir(self.directory):
+                if file.endswith('.bin') and is_stale(file[:-4]):
+                    os.remove(os.path.join(self.directory, file))
+                    self.invalidations += 1
+
+    def clear(self):
+        """
+        Empty the in-memory part. The on-disk store is kept.
+        """
+        self.entries.clear()
+        self.size = 0
+
+    def file_name(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def statistics(self):
+        """
+        :return dictionary with the hit, miss and eviction counters and the memory in use
+        """
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations,
+                'entries': len(self.entries), 'bytes': self.size}
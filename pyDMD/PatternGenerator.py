@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pyDMD.DMDPattern as dp
+from pyDMD.PatternCache import PatternCache
+
+
+class PatternGenerator():
+    def __init__(self, zero_point=(960, 540), resolution=(1920, 1080), cache_bytes=64*2**20):
+        """
+
+        Draws gratings, spot arrays, circles, boxes and checkerboards around
+        zero_point directly as bit-packed rows (the layout of np.packbits and
+        of DMDPattern(compact=True)). Shapes are built from one row, one band
+        of rows or from spans per row, a full frame is only rasterized for
+        tilted gratings. Generated patterns are cached by their parameters.
+
+        Parameters
+        ----------
+        zero_point : TYPE, optional: tuple
+            DESCRIPTION. The default is (960, 540). (x, y) pixel all shapes
+            are placed around, like DMDPattern.zero_point.
+
+        resolution : TYPE, optional: tuple
+            DESCRIPTION. The default is (1920, 1080). (width, height), the
+            width has to be a multiple of 8.
+
+        cache_bytes : TYPE, optional: int
+            DESCRIPTION. The default is 64 MB. Size of the cache of generated
+            patterns, 260 kB per pattern at full resolution.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.zero_point = zero_point
+        self.width, self.height = resolution
+        if self.width % 8 != 0:
+            raise Exception("The width has to be a multiple of 8.")
+        self.cache = PatternCache(max_bytes=cache_bytes)
+
+    def generate(self, shape, **parameters):
+        """
+        :param shape name ('grating', 'spots', 'circle', 'box' or 'checkerboard'), parameters of its method
+        :return (height, width/8) read only array with the packed pattern, from the cache if it was generated before
+        """
+        key = "%s-%s" %(shape, repr((self.zero_point, self.width, self.height, sorted(parameters.items()))))
+        packed = self.cache.get(key)
+        if packed is None:
+            generator_dict = {'grating': self.grating, 'spots': self.spots, 'circle': self.circle,
+                              'box': self.box, 'checkerboard': self.checkerboard}
+            if shape not in generator_dict:
+                raise Exception("Unknown shape %s, allowed are %s." %(shape, ', '.join(generator_dict)))
+            self.cache.put(key, generator_dict[shape](**parameters))
+            packed = self.cache.get(key)
+        return packed
+
+    def dmd_pattern(self, shape, **parameters):
+        """
+        :param shape name and its parameters, other keyword arguments are passed to DMDPattern, e.g. compression
+        :return compact DMDPattern with bit_depth 1 holding the generated pattern
+        """
+        settings = {key: parameters.pop(key) for key in list(parameters) if key not in self.shape_parameters(shape)}
+        settings.update({'compact': True, 'bit_depth': 1, 'zero_pixel': self.zero_point})
+        dmd_pattern = dp.DMDPattern(**settings)
+        dmd_pattern.set_stored_pattern(self.generate(shape, **parameters).copy(), 'bits', self.width)
+        return dmd_pattern
+
+    def shape_parameters(self, shape):
+        parameters = {'grating': ('period', 'phase', 'duty_cycle', 'angle'),
+                      'spots': ('pitch', 'radius', 'offset'),
+                      'circle': ('radius', 'offset', 'inverted'),
+                      'box': ('size', 'offset', 'inverted'),
+                      'checkerboard': ('square_size', 'offset')}
+        return parameters.get(shape, ())
+
+    def grating(self, period, phase=0, duty_cycle=0.5, angle=0):
+        """
+
+        Binary grating, on where (u - phase) mod period < duty_cycle*period,
+        u being the distance from zero_point along the grating vector.
+
+        Parameters
+        ----------
+        period : TYPE: float
+            DESCRIPTION: period in pixels
+
+        phase : TYPE, optional: float
+            DESCRIPTION. The default is 0. Shift of the grating in pixels.
+
+        duty_cycle : TYPE, optional: float
+            DESCRIPTION. The default is 0.5. Fraction of a period that is on.
+
+        angle : TYPE, optional: float
+            DESCRIPTION. The default is 0. Angle of the grating vector in
+            degrees, 0 gives vertical lines, 90 horizontal lines.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        x = np.arange(self.width) - self.zero_point[0]
+        y = np.arange(self.height) - self.zero_point[1]
+        is_on = lambda u: np.mod(u - phase, period) < duty_cycle*period
+        if angle % 180 == 0:
+            row = np.packbits(is_on(x if angle % 360 == 0 else -x))
+            return np.repeat(row[None, :], self.height, axis=0)
+        if angle % 180 == 90:
+            column = is_on(y if angle % 360 == 90 else -y)
+            return np.where(column[:, None], np.uint8(0xff), np.uint8(0)).repeat(self.width//8, axis=1)
+        angle = np.deg2rad(angle)
+        return np.packbits(is_on(np.cos(angle)*x[None, :] + np.sin(angle)*y[:, None]), axis=1)
+
+    def spots(self, pitch, radius, offset=(0, 0)):
+        """
+
+        Rectangular array of disks. A pixel is on if its distance to a spot
+        center is at most radius.
+
+        Parameters
+        ----------
+        pitch : TYPE: float or tuple
+            DESCRIPTION: distance between spot centers in pixels, (x, y) or
+            the same for both.
+
+        radius : TYPE: float
+            DESCRIPTION: spot radius in pixels
+
+        offset : TYPE, optional: tuple
+            DESCRIPTION. The default is (0, 0). (x, y) shift of the spot at
+            zero_point.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        pitch_x, pitch_y = np.broadcast_to(pitch, (2,))
+        center_x, center_y = self.zero_point[0] + offset[0], self.zero_point[1] + offset[1]
+        rows = np.arange(self.height)
+        dy = np.mod(rows - center_y + pitch_y/2, pitch_y) - pitch_y/2 # distance to the closest spot row
+        first = np.floor((-radius - center_x)/pitch_x)
+        last = np.ceil((self.width - 1 + radius - center_x)/pitch_x)
+        centers = center_x + pitch_x*np.arange(first, last + 1)
+        return self.disk_spans(rows, dy, centers, radius)
+
+    def circle(self, radius, offset=(0, 0), inverted=False):
+        """
+
+        Disk of the given radius around zero_point + offset, off outside.
+
+        Parameters
+        ----------
+        radius : TYPE: float
+            DESCRIPTION: radius in pixels
+
+        offset : TYPE, optional: tuple
+            DESCRIPTION. The default is (0, 0). (x, y) shift of the center.
+
+        inverted : TYPE, optional: Bool
+            DESCRIPTION. The default is False. If True, on outside the disk.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        rows = np.arange(self.height)
+        dy = rows - (self.zero_point[1] + offset[1])
+        packed = self.disk_spans(rows, dy, np.array([self.zero_point[0] + offset[0]]), radius)
+        return ~packed if inverted else packed
+
+    def box(self, size, offset=(0, 0), inverted=False):
+        """
+
+        Rectangle centered on zero_point + offset.
+
+        Parameters
+        ----------
+        size : TYPE: int or tuple
+            DESCRIPTION: (width, height) in pixels, or the side of a square
+
+        offset : TYPE, optional: tuple
+            DESCRIPTION. The default is (0, 0). (x, y) shift of the center.
+
+        inverted : TYPE, optional: Bool
+            DESCRIPTION. The default is False. If True, on outside the box.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        width, height = np.broadcast_to(size, (2,))
+        start_x = int(self.zero_point[0] + offset[0] - width//2)
+        start_y = int(self.zero_point[1] + offset[1] - height//2)
+        rows = np.arange(max(start_y, 0), min(start_y + height, self.height))
+        packed = self.spans_to_packed(rows, np.full(len(rows), start_x), np.full(len(rows), start_x + width))
+        return ~packed if inverted else packed
+
+    def checkerboard(self, square_size, offset=(0, 0)):
+        """
+
+        Checkerboard of squares with side square_size, a corner of an on
+        square lies at zero_point + offset.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        x = np.arange(self.width) - self.zero_point[0] - offset[0]
+        y = np.arange(self.height) - self.zero_point[1] - offset[1]
+        row = np.packbits(np.floor_divide(x, square_size) % 2 == 0)
+        row_parity = np.floor_divide(y, square_size) % 2
+        return np.where(row_parity[:, None] == 0, row, ~row)
+
+    def disk_spans(self, rows, dy, centers, radius):
+        """
+        :param rows, their distance to the disk centers in y, x of the disk centers, radius
+        :return packed pattern with all disks, one span per row and disk
+        """
+        in_disk = np.abs(dy) <= radius
+        rows, half_width = rows[in_disk], np.sqrt(radius**2 - dy[in_disk]**2)
+        starts = np.ceil(centers[None, :] - half_width[:, None])
+        stops = np.floor(centers[None, :] + half_width[:, None]) + 1
+        return self.spans_to_packed(np.repeat(rows, len(centers)), starts.ravel(), stops.ravel())
+
+    def spans_to_packed(self, rows, starts, stops):
+        """
+
+        Set the pixels [start, stop) of the given rows in a packed pattern.
+        The bytes inside a span are filled from a running sum over the bytes,
+        the partial bytes at both ends get a mask, no pixel array is made.
+
+        Parameters
+        ----------
+        rows, starts, stops : TYPE: numpy arrays
+            DESCRIPTION: row and first and last (exclusive) column of every
+            span, spans may overlap.
+
+        Returns
+        -------
+        packed : TYPE: numpy array
+            DESCRIPTION: (height, width/8) array of uint8's
+
+        """
+
+        n_bytes = self.width//8
+        starts = np.clip(np.asarray(starts, dtype=np.int64), 0, self.width)
+        stops = np.clip(np.asarray(stops, dtype=np.int64), 0, self.width)
+        keep = stops > starts
+        rows, starts, stops = np.asarray(rows, dtype=np.int64)[keep], starts[keep], stops[keep]
+
+        first_byte, last_byte = starts//8, (stops - 1)//8
+        first_mask = (0xff >> (starts % 8)).astype(np.uint8)
+        last_mask = ((0xff << (7 - (stops - 1) % 8)) & 0xff).astype(np.uint8)
+        one_byte = first_byte == last_byte
+
+        packed = np.zeros((self.height, n_bytes), dtype=np.uint8)
+        np.bitwise_or.at(packed, (rows[one_byte], first_byte[one_byte]), first_mask[one_byte] & last_mask[one_byte])
+        rows, first_byte, last_byte = rows[~one_byte], first_byte[~one_byte], last_byte[~one_byte]
+        np.bitwise_or.at(packed, (rows, first_byte), first_mask[~one_byte])
+        np.bitwise_or.at(packed, (rows, last_byte), last_mask[~one_byte])
+
+        inner = np.zeros((self.height, n_bytes + 1), dtype=np.int32) # +1 from the byte after the first, -1 at the last
+        np.add.at(inner, (rows, first_byte + 1), 1)
+        np.add.at(inner, (rows, last_byte), -1)
+        packed[np.cumsum(inner[:, :n_bytes], axis=1) > 0] = 0xff
+        return packed
+
+
+if __name__ == '__main__':
+    generator = PatternGenerator()
+    pattern = generator.dmd_pattern('spots', pitch=40, radius=8, compression='erle')
+    pattern.compress_pattern()
+    pattern.show_pattern()
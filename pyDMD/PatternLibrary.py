@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import hashlib
+import argparse
+import numpy as np
+import pyDMD.DMDPattern as dp
+from pyDMD.ParallelEncoder import ParallelEncoder
+
+# File layout: MAGIC, the encoded images one after the other, the index table
+# (one INDEX_DTYPE record per pattern) and the footer (offset of the index
+# table, number of patterns, INDEX_MAGIC).
+MAGIC = b'DMDLIB01'
+INDEX_MAGIC = b'DMDINDEX'
+FOOTER_DTYPE = np.dtype([('index_offset', '<u8'), ('count', '<u8'), ('magic', 'S8')])
+INDEX_DTYPE = np.dtype([('name', 'S64'), ('offset', '<u8'), ('length', '<u8'), ('sha256', 'u1', (32,)),
+                        ('compression', 'S4'), ('exposure_time', '<u4'), ('dark_time', '<u4'),
+                        ('bit_depth', 'u1'), ('flicker_active', '?'), ('wait_for_trigger', '?')])
+COMPRESSION_CODES = {'none': 0, 'rle': 1, 'erle': 2}
+
+
+class PatternLibrary():
+    def __init__(self, file, load=True):
+        """
+
+        Single file store of encoded patterns. Every entry holds the image as
+        it is sent to the DMD (header and payload), the settings of its LUT
+        entry and the sha256 of the encoded bytes. The file is memory-mapped,
+        image_bits returns a view into it that can go straight to send_image.
+
+        Parameters
+        ----------
+        file : TYPE: string
+            DESCRIPTION: path of the library. If it does not exist, the
+            library is empty until build or append writes it.
+
+        load : TYPE, optional: Bool
+            DESCRIPTION. The default is True. If False, an existing file is
+            not read, the library starts empty and append replaces the file.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.file = file
+        self.data = None
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.names = {}
+        if load and os.path.exists(self.file):
+            self.open()
+
+    def open(self):
+        """
+        Map the file and read its index table.
+        """
+        data = np.memmap(self.file, dtype=np.uint8, mode='r')
+        if len(data) < len(MAGIC) + FOOTER_DTYPE.itemsize or bytes(data[:len(MAGIC)]) != MAGIC:
+            raise Exception("%s is not a pattern library." %self.file)
+        footer = data[-FOOTER_DTYPE.itemsize:].view(FOOTER_DTYPE)[0]
+        if footer['magic'] != INDEX_MAGIC:
+            raise Exception("%s has no valid index table." %self.file)
+        index_offset, count = int(footer['index_offset']), int(footer['count'])
+        self.data = data
+        self.index = data[index_offset:index_offset + count*INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        self.names = {name.decode(): indx for indx, name in enumerate(self.index['name'])}
+
+    def close(self):
+        """
+        Release the memory map, views from image_bits become invalid.
+        """
+        self.data = None
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.names = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def entry(self, name):
+        """
+        :param name or position of the pattern in the library
+        :return index record of the pattern
+        """
+        return self.index[self.names[name] if isinstance(name, str) else name]
+
+    def image_bits(self, name):
+        """
+        :param name or position of the pattern in the library
+        :return the encoded image including its header, read only view into the file
+        """
+        entry = self.entry(name)
+        return self.data[int(entry['offset']):int(entry['offset']) + int(entry['length'])]
+
+    def settings(self, name):
+        """
+        :return dictionary with the LUT settings of the pattern, named like the DMDPattern attributes
+        """
+        entry = self.entry(name)
+        return {'compression': entry['compression'].decode(), 'exposure_time': int(entry['exposure_time']),
+                'dark_time': int(entry['dark_time']), 'bit_depth': int(entry['bit_depth']),
+                'flicker_active': bool(entry['flicker_active']), 'wait_for_trigger': bool(entry['wait_for_trigger'])}
+
+    def append(self, dmd_patterns, names, encoder=None):
+        """
+
+        Encode patterns and add them to the library. Patterns whose encoded
+        bytes are already in the library share these bytes.
+
+        Parameters
+        ----------
+        dmd_patterns : TYPE: list
+            DESCRIPTION: list of DMDPatterns, with the settings for their LUT entries
+
+        names : TYPE: list
+            DESCRIPTION: unique name of every pattern, at most 64 bytes
+
+        encoder : TYPE, optional: ParallelEncoder
+            DESCRIPTION. The default is None. Encoder for the patterns, if
+            None they are compressed in this process.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if len(dmd_patterns) != len(names):
+            raise Exception("Every pattern needs a name.")
+        if len(set(names)) != len(names):
+            raise Exception("Pattern names are not unique.")
+        for name in names:
+            if name in self.names:
+                raise Exception("Pattern name %s is already in the library." %name)
+            if len(name.encode()) > INDEX_DTYPE['name'].itemsize:
+                raise Exception("Pattern name %s is too long." %name)
+
+        encoder = encoder if encoder is not None else ParallelEncoder(1)
+        encoded_patterns = encoder.encode(dmd_patterns)
+
+        n_old = len(self.index)
+        index = np.zeros(n_old + len(names), dtype=INDEX_DTYPE)
+        index[:n_old] = self.index
+        offsets = {entry['sha256'].tobytes(): (int(entry['offset']), int(entry['length'])) for entry in self.index}
+        # the data section is copied to a new file, the old one stays valid until the new one replaces it
+        end = int(self.data[-FOOTER_DTYPE.itemsize:].view(FOOTER_DTYPE)[0]['index_offset']) if self.data is not None else len(MAGIC)
+
+        temp_file = self.file + '.tmp'
+        try:
+            with open(temp_file, 'wb') as file:
+                file.write(MAGIC)
+                if self.data is not None:
+                    file.write(memoryview(self.data[len(MAGIC):end]))
+                for position, (dmd_pattern, name, image_bits) in enumerate(zip(dmd_patterns, names, encoded_patterns)):
+                    image_bits = np.ascontiguousarray(image_bits, dtype=np.uint8)
+                    digest = hashlib.sha256(image_bits).digest()
+                    if digest not in offsets:
+                        offsets[digest] = (end, len(image_bits))
+                        file.write(image_bits.tobytes())
+                        end += len(image_bits)
+                    entry = index[n_old + position]
+                    entry['name'] = name.encode()
+                    entry['offset'], entry['length'] = offsets[digest]
+                    entry['sha256'] = np.frombuffer(digest, dtype=np.uint8)
+                    entry['compression'] = dmd_pattern.compression.encode()
+                    entry['exposure_time'] = dmd_pattern.exposure_time
+                    entry['dark_time'] = dmd_pattern.dark_time
+                    entry['bit_depth'] = dmd_pattern.bit_depth
+                    entry['flicker_active'] = dmd_pattern.flicker_active
+                    entry['wait_for_trigger'] = dmd_pattern.wait_for_trigger
+                file.write(index.tobytes())
+                file.write(np.array([(end, len(index), INDEX_MAGIC)], dtype=FOOTER_DTYPE).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        self.close() # the map has to be released before the file is replaced
+        os.replace(temp_file, self.file)
+        self.open()
+        print("Added %s patterns, %s patterns in %s" %(len(names), len(self), self.file))
+
+    @classmethod
+    def build(cls, file, dmd_patterns, names, encoder=None):
+        """
+        Write a new library with the given patterns. An existing file is only replaced once 
+        the new one is complete, it stays as it is if the patterns can not be added.
+        :return the PatternLibrary
+        """
+        library = cls(file, load=False)
+        library.append(dmd_patterns, names, encoder)
+        return library
+
+    def verify(self, decode=False):
+        """
+
+        Check every entry against its sha256 and its image header.
+
+        Parameters
+        ----------
+        decode : TYPE, optional: Bool
+            DESCRIPTION. The default is False. If True, every image is also
+            decompressed to check the encoded stream.
+
+        Returns
+        -------
+        problems : TYPE: list
+            DESCRIPTION: (name, description) of all broken entries, empty if
+            the library is fine.
+
+        """
+
+        problems = []
+        data_end = len(self.data) - FOOTER_DTYPE.itemsize - len(self)*INDEX_DTYPE.itemsize if self.data is not None else 0
+        decoder = dp.DMDPattern(cache=None)
+        for entry in self.index:
+            name = entry['name'].decode()
+            offset, length = int(entry['offset']), int(entry['length'])
+            if offset < len(MAGIC) or offset + length > data_end or length < 48:
+                problems.append((name, 'outside of the data section'))
+                continue
+            image_bits = self.data[offset:offset + length]
+            if hashlib.sha256(image_bits).digest() != entry['sha256'].tobytes():
+                problems.append((name, 'sha256 does not match'))
+            elif bytes(image_bits[:4]) != b'Spld':
+                problems.append((name, 'no image header'))
+            elif int(image_bits[8:12].view('<u4')[0]) != length - 48:
+                problems.append((name, 'header length does not match'))
+            elif int(image_bits[25]) != COMPRESSION_CODES.get(entry['compression'].decode()):
+                problems.append((name, 'header compression does not match'))
+            elif decode:
+                try:
+                    decoder.decompress_pattern(image_bits)
+                except Exception as error:
+                    problems.append((name, 'decoding failed: %s' %error))
+        return problems
+
+
+def main(arguments=None):
+    """
+    Command line tool: build or append to a library from image/.npy files, or verify it.
+    """
+    parser = argparse.ArgumentParser(description="Build, extend or verify a pattern library.")
+    parser.add_argument('action', choices=['build', 'append', 'verify'])
+    parser.add_argument('library')
+    parser.add_argument('files', nargs='*', help="images or .npy files, the name is the file name without extension")
+    parser.add_argument('--compression', default='erle', choices=list(COMPRESSION_CODES))
+    parser.add_argument('--exposure_time', type=int, default=105)
+    parser.add_argument('--dark_time', type=int, default=0)
+    parser.add_argument('--bit_depth', type=int, default=1)
+    parser.add_argument('--wait_for_trigger', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--decode', action='store_true', help="verify: also decompress every image")
+    arguments = parser.parse_args(arguments)
+
+    # build does not map the old file, it is replaced while the library is written
+    library = PatternLibrary(arguments.library, load=arguments.action != 'build')
+    if arguments.action == 'verify':
+        problems = library.verify(arguments.decode)
+        for name, problem in problems:
+            print("%s: %s" %(name, problem))
+        print("%s patterns, %s broken" %(len(library), len(problems)))
+        return 1 if problems else 0
+
+    settings = {'compression': arguments.compression, 'exposure_time': arguments.exposure_time,
+                'dark_time': arguments.dark_time, 'bit_depth': arguments.bit_depth,
+                'wait_for_trigger': arguments.wait_for_trigger, 'compact': True, 'cache': None}
+    dmd_patterns, names = [], []
+    for file in arguments.files:
+        dmd_pattern = dp.DMDPattern(**settings)
+        dmd_pattern.load_pattern(file)
+        dmd_patterns.append(dmd_pattern)
+        names.append(os.path.splitext(os.path.basename(file))[0])
+    encoder = ParallelEncoder(arguments.workers)
+    try:
+        library.append(dmd_patterns, names, encoder)
+    finally:
+        encoder.close()
+        library.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,16 +3,37 @@
 
 import pyDMD.LightCrafter6500 as lc
 import pyDMD.DMDPattern as dp
+from pyDMD.PatternCache import PatternCache
+from pyDMD.ParallelEncoder import ParallelEncoder, BackgroundEncoder, ChunkEncoder
+from pyDMD.MemoryPlanner import MemoryPlanner
 import numpy as np 
-from time import sleep 
+from time import sleep, perf_counter
 import glob
-import cv2
 
 class Pattern_on_the_fly():
-    def __init__(self):
-        self.lc_dmd = lc.LightCrafter6500()
+    def __init__(self, cache_directory=None, encode_workers=1, encode_ahead=4, device=None, planner=None):
+        """
+        :param cache_directory: directory to keep encoded patterns between sessions. 
+        If None, the in-memory default cache of DMDPattern is used.
+        :param encode_workers: number of processes that compress the patterns of a sequence, 
+        None for one per CPU. Scripts using more than 1 need an if __name__ == '__main__' guard on Windows.
+        :param encode_ahead: number of encoded images that may wait for the USB upload
+        :param device: USBdevice to use, e.g. a DMDEmulator. If None, the DMD is opened.
+        :param planner: MemoryPlanner with the image memory of the device, None for MemoryPlanner()
+        """
+        self.lc_dmd = lc.LightCrafter6500(device)
+        if cache_directory is not None:
+            self.cache = PatternCache(directory=cache_directory, version_tags=dp.ENCODER_TAGS)
+        else:
+            self.cache = dp.default_cache
+        self.encoder = ParallelEncoder(encode_workers, self.cache)
+        self.encode_ahead = encode_ahead
+        self.upload_timing = None
+        self.planner = planner if planner is not None else MemoryPlanner()
+        self.plan = None # report of the last planned sequence
+        self.stream_report = None
     
-    def upload_image_sequence(self, dmd_pattern_sequence):
+    def upload_image_sequence(self, dmd_pattern_sequence, pack_bit_planes=False, pipeline=True, incremental=True):
         """
         
         Send an image or a sequence of image to the device.
@@ -23,33 +44,409 @@ class Pattern_on_the_fly():
             DESCRIPTION: dic with the following structure:
             {'patterns': [dmd_pattern], 'number_of_repeats': number_of_repeats}
             
+        pack_bit_planes : TYPE, optional: Bool
+            DESCRIPTION. The default is False. If True, up to 24 patterns 
+            with bit_depth 1 share one uploaded image, one bit plane each.
+            
+        pipeline : TYPE, optional: Bool
+            DESCRIPTION. The default is True. If True, the next images are 
+            encoded in a background thread while the current one is sent. 
+            If False, all images are encoded before the upload starts. The 
+            times are printed and kept in self.upload_timing.
+            
+        incremental : TYPE, optional: Bool
+            DESCRIPTION. The default is True. If True, images that are on the
+            device already in the same image index (same sha256 of the encoded
+            image) are not sent again. If False, all images are sent.
+            
+        Raises
+        ------
+        Exception
+            DESCRIPTION: If the sequence does not fit into the device memory
+            (see self.planner), before anything is sent. Such sequences can be
+            uploaded in batches with upload_batches.
+
         Returns
         -------
         None.
 
         """
         
+        images, lut_positions = self.sequence_images(dmd_pattern_sequence['patterns'], pack_bit_planes)
+        encoded_images = None
+        if not self.planner.always_fits(len(images)): # the footprints need the encoded sizes
+            encoded_images = self.encoder.encode(images)
+            pipeline = False
+        self.plan = self.planner.plan([np.size(image_bits) for image_bits in encoded_images] 
+                                      if encoded_images is not None else [0]*len(images), lut_positions)
+        if not self.plan['fits']:
+            print(self.planner.summary(self.plan))
+            raise Exception("The sequence does not fit into the device memory, upload it with upload_batches.")
+
         self.lc_dmd.pattern_display_start_stop('stop')
         self.lc_dmd.set_pattern_on_the_fly_mode()
+        if not incremental:
+            self.lc_dmd.forget_images()
 
-        for indx, dmd_pattern in enumerate(dmd_pattern_sequence['patterns']):
-            self.lc_dmd.pattern_display_LUT_definition(
-                indx, dmd_pattern.wait_for_trigger, dmd_pattern.exposure_time,
-                dmd_pattern.dark_time, dmd_pattern.bit_depth, dmd_pattern.flicker_active)
-        
-        sequence_length = len(dmd_pattern_sequence['patterns'])
         number_of_repeats = dmd_pattern_sequence.pop('number_of_repeats', 0)
-        for indx, dmd_pattern in reversed(list(enumerate(dmd_pattern_sequence['patterns']))): #load last image first
-            image_bits = dmd_pattern.compress_pattern()
-            self.lc_dmd.initialize_pattern_BMP_load(np.size(image_bits),index=indx)
-            self.lc_dmd.send_image(image_bits)
-            print('Sent pattern %s' %indx)
-            self.lc_dmd.pattern_display_LUT_configuration(sequence_length, number_of_repeats)
+        self.lc_dmd.program_LUT(self.lut_entries(dmd_pattern_sequence['patterns'], lut_positions), number_of_repeats)
+
+        start = perf_counter()
+        upload_time = 0
+        images_sent = 0
+        if pipeline:
+            encoded_images = BackgroundEncoder(self.encoder, images, reversed(range(len(images))), self.encode_ahead)
+        else:
+            if encoded_images is None:
+                encoded_images = self.encoder.encode(images)
+            encoded_images = reversed(list(enumerate(encoded_images)))
+        for indx, image_bits in encoded_images: #load last image first
+            upload_start = perf_counter()
+            if self.lc_dmd.load_image(indx, image_bits):
+                print('Sent pattern %s' %indx)
+                images_sent += 1
+            upload_time += perf_counter() - upload_start
+
+        wall_time = perf_counter() - start
+        encode_time = encoded_images.encode_time if pipeline else wall_time - upload_time
+        self.upload_timing = {'encode': encode_time, 'upload': upload_time, 'wall': wall_time, 
+                              'saved': encode_time + upload_time - wall_time, 'images_sent': images_sent}
+        print('Encoding %.2f s, upload %.2f s, total %.2f s, overlap saved %.2f s, sent %s of %s images' 
+              %(encode_time, upload_time, wall_time, self.upload_timing['saved'], images_sent, len(images)))
             
         self.lc_dmd.trigger_in_1(105)
         self.lc_dmd.pattern_display_start_stop('start')
         print('All images uploaded!')
 
+    def upload_library_sequence(self, library, names, number_of_repeats=0, incremental=True):
+        """
+        
+        Send a sequence of pre-encoded patterns from a PatternLibrary. The 
+        images go from the memory-mapped library file straight to the 
+        device, nothing is decoded or encoded.
+
+        Parameters
+        ----------
+        library : TYPE: PatternLibrary
+            DESCRIPTION: library holding the patterns
+            
+        names : TYPE: list
+            DESCRIPTION: names (or positions) of the patterns in the library,
+            in the order of the sequence
+            
+        number_of_repeats : TYPE, optional: int
+            DESCRIPTION. The default is 0, the sequence repeats forever.
+            
+        incremental : TYPE, optional: Bool
+            DESCRIPTION. The default is True. If True, images that are on the
+            device already in the same image index are not sent again, the 
+            sha256 of the library index is used.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        self.plan = self.planner.plan([int(library.entry(name)['length']) for name in names], 
+                                      [(indx, 0) for indx in range(len(names))])
+        if not self.plan['fits']:
+            print(self.planner.summary(self.plan))
+            raise Exception("The sequence does not fit into the device memory.")
+
+        self.lc_dmd.pattern_display_start_stop('stop')
+        self.lc_dmd.set_pattern_on_the_fly_mode()
+        if not incremental:
+            self.lc_dmd.forget_images()
+
+        entries = []
+        for name in names:
+            settings = library.settings(name)
+            entries.append({key: settings[key] for key in 
+                            ('wait_for_trigger', 'exposure_time', 'dark_time', 'bit_depth', 'flicker_active')})
+        self.lc_dmd.program_LUT(entries, number_of_repeats)
+
+        for indx in reversed(range(len(names))): #load last image first
+            image_bits = library.image_bits(names[indx])
+            if self.lc_dmd.load_image(indx, image_bits, library.entry(names[indx])['sha256'].tobytes()):
+                print('Sent pattern %s' %indx)
+
+        self.lc_dmd.trigger_in_1(105)
+        self.lc_dmd.pattern_display_start_stop('start')
+        print('All images uploaded!')
+
+    def plan_sequence(self, dmd_pattern_sequence, pack_bit_planes=False):
+        """
+        
+        Check whether a sequence fits into the device memory without sending
+        anything. The images are encoded (and cached) to know their sizes.
+
+        Parameters
+        ----------
+        dmd_pattern_sequence : TYPE: dictionnary
+            DESCRIPTION: {'patterns': [dmd_pattern], ...} as for upload_image_sequence
+            
+        pack_bit_planes : TYPE, optional: Bool
+            DESCRIPTION. The default is False. As for upload_image_sequence.
+
+        Returns
+        -------
+        report : TYPE: dict
+            DESCRIPTION: feasibility report of MemoryPlanner.plan, also kept 
+            in self.plan.
+
+        """
+        
+        images, lut_positions = self.sequence_images(dmd_pattern_sequence['patterns'], pack_bit_planes)
+        encoded_images = self.encoder.encode(images)
+        self.plan = self.planner.plan([np.size(image_bits) for image_bits in encoded_images], lut_positions)
+        print(self.planner.summary(self.plan))
+        return self.plan
+
+    def upload_batches(self, dmd_pattern_sequence, pack_bit_planes=False, incremental=True):
+        """
+        
+        Upload a sequence that may be too large for the device memory in 
+        batches planned by self.planner. Generator: every batch is uploaded 
+        and started when the next item is requested, the caller decides how 
+        long each batch plays, e.g. 
+            for batch in pof.upload_batches(sequence): wait_for_experiment()
+
+        Parameters
+        ----------
+        dmd_pattern_sequence : TYPE: dictionnary
+            DESCRIPTION: {'patterns': [dmd_pattern], 'number_of_repeats': n},
+            number_of_repeats applies to every batch.
+            
+        pack_bit_planes, incremental : TYPE, optional: Bool
+            DESCRIPTION. As for upload_image_sequence.
+
+        Raises
+        ------
+        Exception
+            DESCRIPTION: If an image alone is larger than the device memory,
+            before anything is sent.
+
+        Yields
+        ------
+        batch : TYPE: dict
+            DESCRIPTION: 'patterns' (indexes in the sequence), 'images' and 
+            'bytes' of the batch that was started.
+
+        """
+        
+        patterns = dmd_pattern_sequence['patterns']
+        number_of_repeats = dmd_pattern_sequence.get('number_of_repeats', 0)
+        images, lut_positions = self.sequence_images(patterns, pack_bit_planes)
+        encoded_images = self.encoder.encode(images)
+        self.plan = self.planner.plan([np.size(image_bits) for image_bits in encoded_images], lut_positions)
+        print(self.planner.summary(self.plan))
+        if self.plan['problems']:
+            raise Exception("Some images do not fit into the device memory at all.")
+
+        for batch in self.plan['batches']:
+            if not incremental:
+                self.lc_dmd.forget_images()
+            self.start_batch(patterns, lut_positions, encoded_images, batch, number_of_repeats)
+            yield batch
+
+    def start_batch(self, patterns, lut_positions, encoded_images, batch, number_of_repeats):
+        """
+        Stop the device, program the LUT of one batch of a MemoryPlanner plan, load its images
+        into the image indexes 0, 1, ... of the batch (last first) and start it.
+        :param patterns, (image index, bit position) of every pattern and encoded images of the planned sequence
+        :return number of images sent
+        """
+        batch_image_index = {image_index: indx for indx, image_index in enumerate(batch['images'])}
+        batch_positions = [(batch_image_index[lut_positions[pattern_index][0]], lut_positions[pattern_index][1])
+                           for pattern_index in batch['patterns']]
+        self.lc_dmd.pattern_display_start_stop('stop')
+        self.lc_dmd.set_pattern_on_the_fly_mode()
+        self.lc_dmd.program_LUT(self.lut_entries([patterns[pattern_index] for pattern_index in batch['patterns']],
+                                                 batch_positions), number_of_repeats)
+        images_sent = 0
+        for indx in reversed(range(len(batch['images']))): #load last image first
+            if self.lc_dmd.load_image(indx, encoded_images[batch['images'][indx]]):
+                print('Sent pattern %s' %indx)
+                images_sent += 1
+        self.lc_dmd.trigger_in_1(105)
+        self.lc_dmd.pattern_display_start_stop('start')
+        return images_sent
+
+    def stream_sequence(self, dmd_patterns, chunk_size=None, pack_bit_planes=False, wait=None, encode_ahead=2):
+        """
+        
+        Play a sequence of any length, e.g. thousands of frames from a 
+        generator, in chunks that fit into the device. The patterns are read
+        lazily and encoded in a background thread (ChunkEncoder) while the 
+        previous chunk plays. Every chunk is played once (number_of_repeats 
+        counts pattern displays, as in play_pattern_sequence, so it is the 
+        number of patterns of the chunk), then the next one is loaded. The 
+        DLPC900 only takes new images and LUT entries while the sequence is
+        stopped, so the mirrors are dark between two chunks for the time of 
+        the reload: stop, the LUT entries that differ, the images that 
+        differ and start, with the chunk already encoded. The measured gaps
+        are printed and kept in self.stream_report.
+
+        Parameters
+        ----------
+        dmd_patterns : TYPE: iterable
+            DESCRIPTION: DMDPatterns in display order, a list or a generator.
+            
+        chunk_size : TYPE, optional: int
+            DESCRIPTION. The default is None: as many patterns as the planner
+            allows LUT entries (max_patterns), and images (max_images) if it
+            limits them and the patterns are not packed. Chunks that do not
+            fit into memory_bytes of the planner are split further.
+            
+        pack_bit_planes : TYPE, optional: Bool
+            DESCRIPTION. The default is False. As for upload_image_sequence, 
+            within each chunk.
+            
+        wait : TYPE, optional: function
+            DESCRIPTION. The default is None: wait for the exposure and dark 
+            times of the chunk, counted from its start. Otherwise called with 
+            the patterns of a chunk after it was started, returns when the 
+            chunk has been played, e.g. when the camera got all frames. 
+            Needed for patterns with wait_for_trigger. The patterns of a list
+            or tuple are checked for this before anything is sent, those of 
+            a generator only when their chunk is reached, so the chunks 
+            before it have already been played.
+            
+        encode_ahead : TYPE, optional: int
+            DESCRIPTION. The default is 2. Number of encoded chunks that may
+            wait for the upload.
+
+        Raises
+        ------
+        Exception
+            DESCRIPTION: If an image alone does not fit into the device memory,
+            or if wait is None and a pattern waits for a trigger.
+
+        Returns
+        -------
+        report : TYPE: dict
+            DESCRIPTION: 'chunks' and 'patterns' played, 'gaps' (seconds from 
+            the end of a chunk to the start of the next one), 'max_gap', 
+            'mean_gap', 'images_sent' and 'encode_wait' (seconds the uploads 
+            waited for the encoder, the first chunk included).
+
+        """
+        
+        if wait is None and isinstance(dmd_patterns, (list, tuple)):
+            self.sequence_duration(dmd_patterns) # a generator is checked chunk by chunk
+        if chunk_size is None:
+            chunk_size = self.planner.max_patterns
+            if self.planner.max_images is not None and not pack_bit_planes:
+                chunk_size = min(self.planner.max_images, chunk_size)
+        chunks = ChunkEncoder(self.encoder, dmd_patterns, chunk_size,
+                              lambda chunk: self.sequence_images(chunk, pack_bit_planes), encode_ahead)
+        gaps, chunk_count, pattern_count, images_sent = [], 0, 0, 0
+        chunk_end = None
+        for patterns, lut_positions, encoded_images in chunks:
+            plan = self.planner.plan([np.size(image_bits) for image_bits in encoded_images], lut_positions)
+            if plan['problems']:
+                print(self.planner.summary(plan))
+                raise Exception("Some images do not fit into the device memory at all.")
+            for batch in plan['batches']:
+                batch_patterns = [patterns[pattern_index] for pattern_index in batch['patterns']]
+                if wait is None:
+                    duration = self.sequence_duration(batch_patterns)
+                images_sent += self.start_batch(patterns, lut_positions, encoded_images, batch,
+                                                len(batch['patterns']))
+                chunk_start = perf_counter()
+                if chunk_end is not None:
+                    gaps.append(chunk_start - chunk_end)
+                chunk_count += 1
+                pattern_count += len(batch_patterns)
+                if wait is None:
+                    sleep(max(0, chunk_start + duration - perf_counter()))
+                    chunk_end = chunk_start + duration
+                else:
+                    wait(batch_patterns)
+                    chunk_end = perf_counter()
+
+        self.stream_report = {'chunks': chunk_count, 'patterns': pattern_count, 'gaps': gaps,
+                              'max_gap': max(gaps, default=0.0), 'mean_gap': sum(gaps)/len(gaps) if gaps else 0.0,
+                              'images_sent': images_sent, 'encode_wait': chunks.wait_time}
+        print('Streamed %s patterns in %s chunks, gaps mean %.2f ms, max %.2f ms, waited %.2f s for the encoder'
+              %(pattern_count, chunk_count, 1e3*self.stream_report['mean_gap'], 1e3*self.stream_report['max_gap'],
+                chunks.wait_time))
+        return self.stream_report
+
+    def sequence_duration(self, dmd_patterns):
+        """
+        :param patterns displayed once each, without triggers
+        :return seconds the patterns take, from their exposure and dark times
+        """
+        if any(dmd_pattern.wait_for_trigger for dmd_pattern in dmd_patterns):
+            raise Exception("Patterns wait for a trigger, give stream_sequence a wait function.")
+        return sum(dmd_pattern.exposure_time + dmd_pattern.dark_time for dmd_pattern in dmd_patterns)/1e6
+
+    def sequence_images(self, dmd_patterns, pack_bit_planes=False):
+        """
+        :param patterns of a sequence, pack bit planes or not
+        :return images to upload and (image index, bit position) of every pattern, see pack_bit_planes
+        """
+        if pack_bit_planes:
+            return self.pack_bit_planes(dmd_patterns)
+        return dmd_patterns, [(indx, 0) for indx in range(len(dmd_patterns))]
+
+    def lut_entries(self, dmd_patterns, lut_positions):
+        """
+        :param patterns of a sequence, (image index, bit position) of each pattern
+        :return LUT entries of the sequence for LightCrafter6500.program_LUT
+        """
+        return [{'wait_for_trigger': dmd_pattern.wait_for_trigger, 'exposure_time': dmd_pattern.exposure_time,
+                 'dark_time': dmd_pattern.dark_time, 'bit_depth': dmd_pattern.bit_depth,
+                 'flicker_active': dmd_pattern.flicker_active, 'image_index': image_index, 
+                 'bit_position': bit_position}
+                for dmd_pattern, (image_index, bit_position) in zip(dmd_patterns, lut_positions)]
+
+    def pack_bit_planes(self, dmd_patterns):
+        """
+        
+        Distribute the patterns over as few images as possible. Patterns with 
+        bit_depth 1 are merged into the 24 bit planes of shared images, all 
+        other patterns keep an image of their own.
+
+        Parameters
+        ----------
+        dmd_patterns : TYPE: list
+            DESCRIPTION: list of DMDPatterns in LUT order
+
+        Returns
+        -------
+        images : TYPE: list
+            DESCRIPTION: DMDPatterns to upload, list index is the image index
+        lut_positions : TYPE: list
+            DESCRIPTION: (image_index, bit_position) of every pattern
+
+        """
+        
+        image_patterns, lut_positions = [], []
+        open_image = None # image with free bit planes
+        for dmd_pattern in dmd_patterns:
+            if dmd_pattern.bit_depth == 1 and open_image is not None and len(image_patterns[open_image]) < 24:
+                lut_positions.append((open_image, len(image_patterns[open_image])))
+                image_patterns[open_image].append(dmd_pattern)
+            else:
+                image_patterns.append([dmd_pattern])
+                lut_positions.append((len(image_patterns) - 1, 0))
+                if dmd_pattern.bit_depth == 1:
+                    open_image = len(image_patterns) - 1
+
+        images = []
+        for patterns in image_patterns:
+            if len(patterns) > 1:
+                packed_pattern = dp.DMDPattern(compression=patterns[0].compression)
+                packed_pattern.pack_bit_planes(patterns)
+                images.append(packed_pattern)
+            else:
+                images.append(patterns[0])
+        print("Packed %s patterns into %s images." %(len(dmd_patterns), len(images)))
+        return images, lut_positions
+
     def upload_one_image(self,  dmd_pattern_file, exposure_time, 
                          dark_time, number_of_repeats, short_axis_flip=False, 
                          long_axis_flip=False, bit_depth=1, wait_for_trigger=False):
@@ -107,7 +504,7 @@ class Pattern_on_the_fly():
         settings = {'compression':'rle', 'bit_depth': bit_depth}
         #dmd_pattern = dp.DMDPattern(**settings)
         dmd_pattern = dp.DMDPattern(**settings)
-        dmd_pattern.load_png(dmd_pattern_file)
+        dmd_pattern.load_pattern(dmd_pattern_file)
         dmd_pattern.exposure_time, dmd_pattern.dark_time = exposure_time, dark_time
         one_pattern = {'patterns': [dmd_pattern], 'number_of_repeats': number_of_repeats}
         self.upload_image_sequence(one_pattern)
@@ -153,8 +550,7 @@ class Pattern_on_the_fly():
 
         """
     
-        images = [cv2.imread(file) for file in glob.glob("{}/*.png".format(dmd_pattern_file))]
-        nb_patterns=len(images)
+        nb_patterns=len(glob.glob("{}/*.png".format(dmd_pattern_file)))
         number_of_repeats=nb_patterns*nb_repeat_sequence
         settings = {'compression': compression_type, 'bit_depth': bit_depth}
         
@@ -166,7 +562,7 @@ class Pattern_on_the_fly():
             dict_patterns["pattern{}".format(i)] = dp.DMDPattern(**settings)
         list_pattern=[]
         for i in range(nb_patterns):
-            dict_patterns["pattern{}".format(i)].load_png("{}/sequence_{}.png".format(dmd_pattern_file,i))
+            dict_patterns["pattern{}".format(i)].load_pattern("{}/sequence_{}.png".format(dmd_pattern_file,i))
             
             dict_patterns["pattern{}".format(i)].exposure_time=exposure_time
             dict_patterns["pattern{}".format(i)].dark_time=dark_time
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+import numpy as np
+from pyDMD.DMDPattern import DMDPattern
+
+
+class SparsePattern(DMDPattern):
+    def __init__(self, **kwargs):
+        """
+
+        Binary pattern stored as spans of on pixels per row, for patterns
+        that are mostly off. Memory and rle encoding time scale with the
+        number of spans: the rle commands are written straight from the
+        spans, erle only rasterizes the rows that differ from the row above.
+        The output is byte-identical to DMDPattern with the same pixels.
+        Takes the keyword arguments of DMDPattern, bit_depth is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        kwargs['bit_depth'] = 1
+        kwargs.pop('compact', None)
+        self.width, self.height = kwargs.get('resolution', (1920, 1080))
+        super().__init__(**kwargs)
+
+    @property
+    def pattern(self):
+        """
+        The pattern as (M, N) boolean matrix, rasterized from the spans on every access.
+        """
+        return self.color_rows(np.arange(self.height), colors=False)
+
+    @pattern.setter
+    def pattern(self, pattern):
+        self.set_dense(pattern)
+
+    def set_spans(self, rows, starts, stops):
+        """
+        Replace the pattern by the given spans. Overlapping and touching spans are merged.
+        :param row, first column and last column (exclusive) of every span
+        """
+        spans = np.stack(np.broadcast_arrays(np.asarray(rows, dtype=np.int64).ravel(),
+                                             np.asarray(starts, dtype=np.int64).ravel(),
+                                             np.asarray(stops, dtype=np.int64).ravel()), axis=1)
+        spans[:, 1:] = np.clip(spans[:, 1:], 0, self.width)
+        spans = spans[(spans[:, 2] > spans[:, 1]) & (spans[:, 0] >= 0) & (spans[:, 0] < self.height)]
+        spans = spans[np.lexsort((spans[:, 1], spans[:, 0]))]
+
+        # running maximum of the stops within a row, rows are sorted so row*(width + 2) + stop keeps them apart
+        reach = np.maximum.accumulate(spans[:, 0]*(self.width + 2) + spans[:, 2]) - spans[:, 0]*(self.width + 2)
+        new_span = np.ones(len(spans), dtype=bool)
+        new_span[1:] = (spans[1:, 0] != spans[:-1, 0]) | (spans[1:, 1] > reach[:-1])
+        first = np.flatnonzero(new_span)
+        last = np.append(first[1:], len(spans))[:len(first)] - 1
+        merged = np.stack((spans[first, 0], spans[first, 1], reach[last]), axis=1).astype(np.int32)
+        self.set_stored_pattern(merged, 'spans')
+        self.row_spans = np.bincount(merged[:, 0], minlength=self.height)
+
+    def add_spans(self, rows, starts, stops):
+        """
+        Switch on the given spans in addition to the current ones.
+        """
+        spans = self.stored_pattern
+        self.set_spans(np.append(spans[:, 0], rows), np.append(spans[:, 1], starts), np.append(spans[:, 2], stops))
+
+    def add_box(self, x0, y0, x1, y1):
+        """
+        Switch on the pixels x0 <= x < x1, y0 <= y < y1.
+        """
+        rows = np.arange(max(y0, 0), min(y1, self.height))
+        self.add_spans(rows, np.full(len(rows), x0), np.full(len(rows), x1))
+
+    def add_disk(self, center, radius):
+        """
+        Switch on the pixels with distance at most radius to the (x, y) center.
+        """
+        rows = np.arange(max(int(np.ceil(center[1] - radius)), 0), min(int(np.floor(center[1] + radius)) + 1, self.height))
+        half_width = np.sqrt(np.maximum(radius**2 - (rows - center[1])**2, 0))
+        self.add_spans(rows, np.ceil(center[0] - half_width), np.floor(center[0] + half_width) + 1)
+
+    def set_dense(self, pattern):
+        """
+        Convert a dense pattern (on where non zero) to spans.
+        """
+        plane = self.nonzero(np.asarray(pattern))
+        padded = np.zeros((np.shape(plane)[0], np.shape(plane)[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = plane
+        edges = np.diff(padded, axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        stops = np.nonzero(edges == -1)[1]
+        self.set_spans(rows, starts, stops)
+
+    def set_packed_pattern(self, packed, pattern_width=1920):
+        self.set_dense(np.unpackbits(packed, axis=1, count=pattern_width).view(bool))
+
+    def set_rows(self, first_row, rows):
+        """
+        Overwrite rows of the pattern and mark them for re-encoding.
+        :param index of the first row, array with the new rows
+        """
+        row_pattern = SparsePattern(resolution=(self.width, len(rows)))
+        row_pattern.set_dense(rows)
+        spans = self.stored_pattern
+        keep = (spans[:, 0] < first_row) | (spans[:, 0] >= first_row + len(rows))
+        new_spans = row_pattern.stored_pattern
+        self.set_spans(np.append(spans[keep, 0], new_spans[:, 0] + first_row),
+                       np.append(spans[keep, 1], new_spans[:, 1]), np.append(spans[keep, 2], new_spans[:, 2]))
+        if self.row_encoding is not None: # the spans array is new, keep the encoded rows valid
+            self.row_encoding['pattern'] = self.stored_pattern
+        self.mark_rows_dirty(slice(first_row, first_row + len(rows)))
+
+    def binary_plane(self):
+        return self.pattern
+
+    def binary_width(self):
+        return self.width
+
+    def row_count(self):
+        return self.height
+
+    def nbytes(self):
+        """
+        :return memory used by the spans
+        """
+        return self.stored_pattern.nbytes + self.row_spans.nbytes
+
+    def row_first_span(self):
+        return np.cumsum(self.row_spans) - self.row_spans
+
+    def new_span_rows(self):
+        """
+        :return boolean array of length M, True where the spans of a row differ from the row above
+        """
+        spans, row_spans = self.stored_pattern, self.row_spans
+        new_row = np.ones(self.height, dtype=bool)
+        new_row[1:] = row_spans[1:] != row_spans[:-1]
+        # rows with as many spans as the row above: compare span by span
+        span_row = spans[:, 0]
+        same_count = np.zeros(len(spans), dtype=bool)
+        same_count[span_row > 0] = ~new_row[span_row[span_row > 0]]
+        candidates = np.flatnonzero(same_count)
+        above = candidates - row_spans[span_row[candidates] - 1]
+        differs = np.any(spans[candidates, 1:] != spans[above, 1:], axis=1)
+        new_row[span_row[candidates[differs]]] = True
+        return new_row
+
+    def unique_color_rows(self):
+        new_row = self.new_span_rows()
+        return new_row, self.color_rows(np.flatnonzero(new_row))
+
+    def color_rows(self, rows, colors=True):
+        """
+        :param indexes of rows
+        :return (K, N, 3) colors of these rows, or (K, N) booleans if not colors
+        """
+        rows = np.atleast_1d(np.arange(self.height)[rows])
+        spans_per_row = self.row_spans[rows]
+        span_index = np.repeat(self.row_first_span()[rows] - np.cumsum(spans_per_row) + spans_per_row, spans_per_row)
+        span_index += np.arange(len(span_index))
+        edges = np.zeros((len(rows), self.width + 1), dtype=np.int8)
+        out_row = np.repeat(np.arange(len(rows)), spans_per_row)
+        np.add.at(edges, (out_row, self.stored_pattern[span_index, 1]), 1)
+        np.add.at(edges, (out_row, self.stored_pattern[span_index, 2]), -1)
+        plane = np.cumsum(edges[:, :-1], axis=1, dtype=np.int8) > 0
+        if not colors:
+            return plane
+        plane = plane.view(np.uint8)*np.uint8(0xff)
+        return np.dstack((plane, plane, plane))
+
+    def encode_rows(self):
+        if self.compression == 'rle':
+            return self.span_rle_rows()
+        return super().encode_rows()
+
+    def span_rle_rows(self):
+        """
+
+        Rle commands written from the spans: every row is the off run before
+        its first span, then span and gap alternately, then the off run to
+        the end of the row. Runs longer than 255 are split like in
+        fast_rle_compressed_rows.
+
+        Returns
+        -------
+        compressed_rows : TYPE: numpy array
+            DESCRIPTION: 1D uint8 array with the rle commands of all rows
+            without end of image
+        row_offsets : TYPE: numpy array
+            DESCRIPTION: M+1 byte offsets of the rows
+
+        """
+
+        spans, row_spans = self.stored_pattern, self.row_spans
+        # boundaries of a row: 0, start, stop, start, stop, ..., width
+        n_bounds = 2*row_spans + 2
+        first_bound = np.cumsum(n_bounds) - n_bounds
+        bounds = np.empty(np.sum(n_bounds), dtype=np.int64)
+        bounds[first_bound] = 0
+        bounds[first_bound + n_bounds - 1] = self.width
+        span_bound = first_bound[spans[:, 0]] + 1 + 2*(np.arange(len(spans)) - self.row_first_span()[spans[:, 0]])
+        bounds[span_bound] = spans[:, 1]
+        bounds[span_bound + 1] = spans[:, 2]
+
+        # run i of a row goes from bound i to bound i+1, odd runs are on
+        is_run = np.ones(len(bounds), dtype=bool)
+        is_run[first_bound + n_bounds - 1] = False
+        run_index = np.flatnonzero(is_run)
+        run_lengths = bounds[run_index + 1] - bounds[run_index]
+        run_row = np.repeat(np.arange(self.height), n_bounds - 1)
+        is_on = (run_index - first_bound[run_row]) % 2 == 1
+        keep = run_lengths > 0
+        run_lengths, is_on, run_row = run_lengths[keep], is_on[keep], run_row[keep]
+
+        vals = np.where(is_on, np.uint8(0xff), np.uint8(0))[:, None].repeat(3, axis=1)
+        counts, vals = self.split_long_runs(run_lengths, vals, 255)
+        pieces_per_row = np.bincount(np.repeat(run_row, (run_lengths - 1)//255 + 1), minlength=self.height)
+
+        compressed_rows = np.empty(4*len(counts), dtype=np.uint8)
+        runs = compressed_rows.reshape(-1, 4)
+        runs[:, 0] = counts
+        runs[:, 1:] = vals
+        row_offsets = 4*np.concatenate(([0], np.cumsum(pieces_per_row)))
+        return compressed_rows, row_offsets
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import select
+import socket
+import threading
+from abc import ABC, abstractmethod
+
+
+def open_transport(vid=0x0451, pid=0xc900):
+    """
+    :return the transport for this system, connected to the first HID device with vid and pid
+    """
+    if os.name == 'nt':
+        return WindowsHidTransport(vid, pid)
+    if os.path.isdir('/sys/class/hidraw'):
+        return HidrawTransport(vid, pid)
+    raise Exception("No USB transport for this system.")
+
+
+class Transport(ABC):
+    """
+    Interface of the USB transports of USBdevice. Reports are 65 bytes, the report id 0x00
+    first. Replies are handed to the reply handler in the same layout, report id first.
+    """
+
+    def set_reply_handler(self, handler):
+        self.reply_handler = handler
+
+    @abstractmethod
+    def write(self, report):
+        """
+        Send one report, a list or a buffer of 65 bytes.
+        """
+
+    def write_reports(self, reports):
+        """
+        Send the rows of a (n_reports, 65) uint8 array, e.g. from LightCrafter6500.image_reports.
+        """
+        for report in reports:
+            self.write(report)
+
+    def close(self):
+        pass
+
+
+class WindowsHidTransport(Transport):
+    def __init__(self, vid=0x0451, pid=0xc900):
+        """
+        pywinusb backend. Replies arrive on the pywinusb reader thread.
+        """
+        import pywinusb.hid as pyhid
+        from ctypes import c_ubyte
+        self.report_type = c_ubyte * 65
+        self.reply_handler = None
+
+        devices = pyhid.HidDeviceFilter(vendor_id = vid, product_id = pid).get_devices()
+        if not devices:
+            print("Did not finde right USB device.")
+            raise Exception()
+        self.device = devices[0]
+        self.device.open()
+        self.device.set_raw_data_handler(self.on_reply)
+
+    def on_reply(self, data):
+        if self.reply_handler is not None:
+            self.reply_handler(data)
+
+    def write(self, report):
+        if not isinstance(report, list):
+            # hand the buffer itself to the driver instead of copying it into a list
+            report = self.report_type.from_buffer(report)
+        self.device.send_output_report(report)
+
+    def close(self):
+        self.device.close()
+
+
+class HidrawTransport(Transport):
+    def __init__(self, vid=0x0451, pid=0xc900, path=None, fd=None):
+        """
+
+        Linux backend on a /dev/hidraw device. Every report is one write
+        call, a thread waits for replies and hands them to the reply handler.
+
+        Parameters
+        ----------
+        vid, pid : TYPE, optional: int
+            DESCRIPTION. Vendor and product id to look for in /sys/class/hidraw.
+
+        path : TYPE, optional: string
+            DESCRIPTION. The default is None. hidraw device to open instead of
+            looking it up by vid and pid.
+
+        fd : TYPE, optional: int
+            DESCRIPTION. The default is None. Already open file descriptor,
+            e.g. one end of the socket pair of a PseudoDevice.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if fd is None:
+            path = path if path is not None else find_hidraw(vid, pid)
+            if path is None:
+                print("Did not finde right USB device.")
+                raise Exception()
+            fd = os.open(path, os.O_RDWR)
+        self.fd = fd
+        self.reply_handler = None
+        self.running = True
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+
+    def write(self, report):
+        if isinstance(report, list):
+            report = bytes(report)
+        if os.write(self.fd, report) != 65:
+            raise Exception("Incomplete write to the USB device.")
+
+    def write_reports(self, reports):
+        write, fd = os.write, self.fd
+        reports = memoryview(reports.reshape(-1))
+        for start in range(0, len(reports), 65):
+            if write(fd, reports[start:start + 65]) != 65:
+                raise Exception("Incomplete write to the USB device.")
+
+    def read_replies(self):
+        while self.running:
+            try:
+                readable, _, _ = select.select([self.fd], [], [], 0.1)
+                if not readable:
+                    continue
+                data = os.read(self.fd, 65)
+            except OSError:
+                break
+            if not data:
+                break
+            if len(data) == 64: # hidraw leaves out the report id of unnumbered reports
+                data = b'\x00' + data
+            if self.reply_handler is not None:
+                self.reply_handler(list(data))
+
+    def close(self):
+        self.running = False
+        self.reader.join()
+        os.close(self.fd)
+
+
+def find_hidraw(vid, pid, sysfs='/sys/class/hidraw'):
+    """
+    :param vid, pid, directory with the hidraw devices in sysfs
+    :return path of the first /dev/hidraw device with vid and pid, None if there is none
+    """
+    hid_id = "HID_ID=%04X:%08X:%08X" %(0x0003, vid, pid) # bus 3 is USB
+    for device in sorted(glob.glob(os.path.join(sysfs, 'hidraw*'))):
+        try:
+            with open(os.path.join(device, 'device', 'uevent')) as file:
+                if hid_id in file.read().upper().split():
+                    return os.path.join('/dev', os.path.basename(device))
+        except OSError:
+            continue
+    return None
+
+
+def continuation_count(command):
+    """
+    :param first report of a command, without report id
+    :return number of 64 byte reports that follow it
+    """
+    # bytes 2-3 count what follows the 4 byte header, 60 of them fit into the first report
+    length = command[2] + (command[3] << 8)
+    return max(0, length - 60 + 63)//64
+
+
+class PseudoDevice():
+    def __init__(self, respond=None):
+        """
+
+        Stands in for a DLPC900 behind /dev/hidraw: the host end of a socket
+        pair (which keeps report boundaries like hidraw) goes into a
+        HidrawTransport, a thread on the device end collects the commands.
+
+        Parameters
+        ----------
+        respond : TYPE, optional: function
+            DESCRIPTION. The default is None. Called with every command
+            (first report without report id, continuation reports appended),
+            returns the reply payload or None. By default every command that
+            asks for a reply is acknowledged without error.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.host_socket, self.device_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.respond = respond if respond is not None else self.acknowledge
+        self.reports = []
+        self.commands = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def transport(self):
+        return HidrawTransport(fd=self.host_socket.fileno())
+
+    def serve(self):
+        command, missing = b'', 0
+        while True:
+            try:
+                report = self.device_socket.recv(65)
+            except OSError:
+                break
+            if not report:
+                break
+            self.reports.append(report)
+            if missing == 0:
+                command = report[1:]
+                missing = continuation_count(command)
+            else:
+                command += report[1:]
+                missing -= 1
+            if missing == 0:
+                self.commands.append(command)
+                reply = self.respond(command)
+                if reply is not None:
+                    self.device_socket.send(bytes(reply[:64]).ljust(64, b'\x00'))
+
+    def acknowledge(self, command):
+        """
+        :return reply without error and data for commands with the reply flag set
+        """
+        if command[0] & 0x40:
+            return [command[0] & 0x80, command[1], 0, 0]
+        return None
+
+    def close(self):
+        self.device_socket.close()
+        self.thread.join()
@@ -1,13 +1,10 @@
 #!/usr/bin/env python 
 
 import os
+import threading
+from pyDMD.Transport import open_transport
 
-if os.name == 'nt':
-    OS_TYPE = 'windows'
-    import pywinusb.hid as pyhid 
-else:
-    print("Could not recognize system or system is not supported.")
-    exit
+OS_TYPE = 'windows' if os.name == 'nt' else 'linux'
 
 class USBdevice():
     def readData(self, data):
@@ -30,26 +27,71 @@ class USBdevice():
         if self.debug:
             print("Raw data answer: {0}".format(data))
         self.answer = data
+        with self.reply_condition:
+            self.replies[data[2]] = data # answers are matched to commands by the sequence byte
+            self.reply_condition.notify_all()
 
-    def __init__(self,vid=0x0451,pid=0xc900):
+    def wait_for_reply(self, sequence_byte, timeout=None):
+        """
+        
+        Wait for the answer to the last command with this sequence byte.
+
+        Parameters
+        ----------
+        sequence_byte : TYPE: int
+            DESCRIPTION: sequence byte of the command.
+
+        timeout : TYPE, optional: float
+            DESCRIPTION. The default is None. Seconds to wait, None for 
+            reply_timeout.
+
+        Returns
+        -------
+        answer : TYPE: list
+            DESCRIPTION: the answer, report id first, None after a timeout.
+
+        """
+        
+        timeout = self.reply_timeout if timeout is None else timeout
+        with self.reply_condition:
+            self.reply_condition.wait_for(lambda: sequence_byte in self.replies, timeout)
+            return self.replies.pop(sequence_byte, None)
+
+    def __init__(self,vid=0x0451,pid=0xc900,transport=None,reply_timeout=1.0):
+        """
+
+        Parameters
+        ----------
+        vid, pid : TYPE, optional: int
+            DESCRIPTION. Vendor and product id of the DLPC900.
+
+        transport : TYPE, optional: Transport
+            DESCRIPTION. The default is None. Transport the reports go through,
+            see pyDMD.Transport. If None, pywinusb on windows and hidraw on
+            linux.
+
+        reply_timeout : TYPE, optional: float
+            DESCRIPTION. The default is 1.0. Seconds wait_for_reply waits for
+            an answer.
+
+        Returns
+        -------
+        None.
+
+        """
         self.V_id=vid
         self.P_id=pid
         self.os = OS_TYPE
-        filter = pyhid.HidDeviceFilter(vendor_id = self.V_id, product_id = self.P_id)
-        devices = filter.get_devices()
 
         self.answer = [0x00]*65
         self.debug = False
+        self.reply_timeout = reply_timeout
+        self.replies = {} # sequence byte -> answer not yet picked up by wait_for_reply
+        self.reply_condition = threading.Condition()
 
-        if devices:
-            device = devices[0]
-            print("Found the right USB device.")
-            self.dev = device
-            self.dev.open()
-            self.dev.set_raw_data_handler(self.readData)
-        else:
-            print("Did not finde right USB device.")
-            raise Exception()
+        self.transport = transport if transport is not None else open_transport(vid, pid)
+        print("Found the right USB device.")
+        self.transport.set_reply_handler(self.readData)
 
     def send_command(self,command):
         """
@@ -69,13 +111,13 @@ class USBdevice():
         
         assert 65 == len(command)
         self.answer = [0x00]*65
+        with self.reply_condition:
+            self.replies.pop(command[2], None) # drop an old answer with the same sequence byte
 
         if self.debug:
             print("Final command: " + str(command))
         
-        if self.os == 'windows':
-            reports = self.dev.find_output_reports()
-            reports[0].send(command)
+        self.transport.write(command)
 
     def create_dmd_command(self,mode,reply,sequencebyte,usb_code,data=[]):
         """
@@ -112,11 +154,8 @@ class USBdevice():
 
         """
         
-        if OS_TYPE == 'windows':
-            buffer = [0x00]*65
-            i = 1
-        else:
-            print("Unrecognized OS, no command sent.")
+        buffer = [0x00]*65
+        i = 1
         
         flagstring =''  # creates flag byte in a string 
 
@@ -153,20 +192,27 @@ class USBdevice():
         for item in range(len(data)):
             buffer[i+6+item] = data[item]
         
-        if OS_TYPE == 'windows':
-            self.send_command(buffer)
-        else:
-            print("Unrecognized OS, no command sent.")
+        self.send_command(buffer)
 
     def raw_command(self,buffer):
         assert 64 == len(buffer)
 
-        if OS_TYPE == 'windows':
-            buffer = [0x00] + buffer
-            reports = self.dev.find_output_reports()
-            reports[0].send(buffer)
-        else:
-            print("No command send")
+        self.transport.write([0x00] + buffer)
+
+    def send_report(self, report):
+        """
+        Send one fully framed report, as given by LightCrafter6500.stream_image_reports.
+        :param writable buffer of 65 bytes, report id 0x00 first
+        """
+        assert 65 == len(report)
+        self.transport.write(report)
+
+    def send_reports(self, reports):
+        """
+        Send many fully framed reports, as given by LightCrafter6500.image_reports.
+        :param (n_reports, 65) array of uint8's
+        """
+        self.transport.write_reports(reports)
 
     def releaseUSB(self):
         """
@@ -179,7 +225,7 @@ class USBdevice():
 
 
         """
-        self.dev.close()
+        self.transport.close()
 
     def convert_bytes(self, integer):
         return divmod(integer, 0x100)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+import pyDMD.DMDPattern as dp
+from pyDMD.PatternCache import PatternCache
+
+
+def grating_pattern(period, cache):
+    dmd_pattern = dp.DMDPattern(compression='erle', bit_depth=1, cache=cache)
+    dmd_pattern.pattern = np.broadcast_to((np.arange(1920) // period) % 2 == 0, (1080, 1920)).copy()
+    return dmd_pattern
+
+
+def test_hit_and_miss():
+    cache = PatternCache(version_tags=dp.ENCODER_TAGS)
+    first = grating_pattern(8, cache).compress_pattern()
+    second = grating_pattern(8, cache).compress_pattern()
+    grating_pattern(9, cache).compress_pattern()
+    np.testing.assert_array_equal(first, second)
+    statistics = cache.statistics()
+    assert (statistics['hits'], statistics['misses'], statistics['entries']) == (1, 2, 2)
+
+
+def test_disk_store_and_stale_tags(tmp_path):
+    cache = PatternCache(directory=str(tmp_path), version_tags=dp.ENCODER_TAGS)
+    image_bits = grating_pattern(8, cache).compress_pattern()
+    stale_file = os.path.join(str(tmp_path), 'erle-v0-%s.bin' %('0'*64))
+    image_bits.tofile(stale_file)
+
+    # a new session finds the pattern on disk and deletes what an older encoder wrote
+    new_cache = PatternCache(directory=str(tmp_path), version_tags=dp.ENCODER_TAGS)
+    assert not os.path.exists(stale_file)
+    assert new_cache.statistics()['invalidations'] == 1
+    np.testing.assert_array_equal(grating_pattern(8, new_cache).compress_pattern(), image_bits)
+    assert new_cache.statistics()['disk_hits'] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = PatternCache(max_bytes=2500)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, np.zeros(1000, dtype=np.uint8))
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+    assert cache.statistics()['evictions'] == 1
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from pyDMD.CameraTransform import CameraTransform
+
+
+def camera_images(count, shape=(1080, 1920)):
+    return np.random.default_rng(5).integers(0, 256, (count,) + shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize('interpolation', [cv2.INTER_NEAREST, cv2.INTER_LINEAR])
+def test_identity_keeps_the_image(interpolation):
+    images = camera_images(2)
+    transform = CameraTransform(np.eye(3), images.shape[1:], interpolation)
+    np.testing.assert_array_equal(transform.apply(images), images)
+
+
+def test_shift_moves_the_image():
+    images = camera_images(1, (600, 800))
+    transform = CameraTransform([[1, 0, 100], [0, 1, 50]], images.shape[1:], cv2.INTER_NEAREST)
+    expected = np.zeros((1, 1080, 1920), dtype=np.uint8)
+    expected[0, 50:650, 100:900] = images[0]
+    np.testing.assert_array_equal(transform.apply(images[0]), expected)
+
+
+def test_maps_are_shared_by_equal_calibrations():
+    transform = CameraTransform(np.eye(3), (1080, 1920))
+    assert CameraTransform(np.eye(3)[:2], (1080, 1920)).maps() is transform.maps()
+    with pytest.raises(Exception):
+        transform.apply(camera_images(1, (100, 100)))
+    with pytest.raises(Exception):
+        CameraTransform(np.eye(2), (1080, 1920))
+
+
+def test_threshold_bits_and_patterns():
+    images = camera_images(2)
+    transform = CameraTransform(np.eye(3), images.shape[1:])
+    packed = transform.to_bits(images, threshold=100)
+    np.testing.assert_array_equal(packed, np.packbits(images >= 100, axis=2))
+    for dmd_pattern, image in zip(transform.dmd_patterns(images, threshold=100, cache=None), images):
+        assert dmd_pattern.storage == 'bits'
+        np.testing.assert_array_equal(dmd_pattern.pattern, image >= 100)
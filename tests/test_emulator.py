@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.DMDEmulator import DMDEmulator
+from pyDMD.LightCrafter6500 import LightCrafter6500, DmdError
+from pyDMD.Pattern_on_the_fly import Pattern_on_the_fly
+
+
+def stripes(count, compression='erle'):
+    """
+    :return count binary DMDPatterns with a horizontal stripe each, exposure times 1000, 1001, ...
+    """
+    dmd_patterns = []
+    for indx in range(count):
+        dmd_pattern = dp.DMDPattern(compression=compression, bit_depth=1, cache=None,
+                                    exposure_time=1000 + indx, dark_time=200)
+        pattern = np.zeros((1080, 1920), dtype=bool)
+        pattern[50*indx:50*indx + 20, 100:1800] = True
+        dmd_pattern.pattern = pattern
+        dmd_patterns.append(dmd_pattern)
+    return dmd_patterns
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_upload_lut_and_start(compression):
+    device = DMDEmulator()
+    pof = Pattern_on_the_fly(device=device)
+    dmd_patterns = stripes(4, compression)
+    pof.upload_image_sequence({'patterns': dmd_patterns, 'number_of_repeats': 8})
+
+    controller = device.controller
+    assert controller.mode == 3
+    assert controller.sequence_state == 'start'
+    assert controller.lut_configuration == (4, 8)
+    for indx, dmd_pattern in enumerate(dmd_patterns):
+        entry = controller.lut[indx]
+        assert (entry['image_index'], entry['bit_position']) == (indx, 0)
+        assert (entry['exposure_time'], entry['dark_time']) == (1000 + indx, 200)
+        np.testing.assert_array_equal(controller.images[indx][:, :, 0] > 0, dmd_pattern.pattern)
+    assert controller.last_error == 0
+
+
+def test_error_code_follows_last_command():
+    device = DMDEmulator()
+    dmd = LightCrafter6500(device=device)
+    dmd.queue_command(0x1a35, [50, 0, 0]) # trigger delays below 105 are rejected
+    with pytest.raises(DmdError) as error:
+        dmd.barrier()
+    assert error.value.value == 13
+    dmd.trigger_in_1(200)
+    dmd.barrier()
+    assert device.controller.last_error == 0
+
+
+def test_error_code_of_commands_in_flight():
+    device = DMDEmulator(realtime=True, latency=0.05)
+    dmd = LightCrafter6500(device=device)
+    failed = dmd.queue_command(0x1a35, [50, 0, 0])
+    dmd.queue_command(0x1a35, [200, 0, 0]) # sent before the first answer, overwrites the error code
+    with pytest.raises(DmdError) as error:
+        dmd.barrier()
+    assert error.value.command is failed
+    assert error.value.value is None
+    assert 'unknown error' in str(error.value)
+
+
+def test_incremental_upload_after_a_length_change():
+    device = DMDEmulator()
+    pof = Pattern_on_the_fly(device=device)
+    dmd_patterns = stripes(4)
+    pof.upload_image_sequence({'patterns': list(dmd_patterns), 'number_of_repeats': 8})
+    dmd_patterns[3] = stripes(6)[5] # same length as before: only this image is sent
+    pof.upload_image_sequence({'patterns': list(dmd_patterns), 'number_of_repeats': 8})
+    assert pof.upload_timing['images_sent'] == 1
+
+    changed = dp.DMDPattern(compression='erle', bit_depth=1, cache=None, exposure_time=1002, dark_time=200)
+    changed.pattern = np.random.default_rng(0).random((1080, 1920)) > 0.5 # much longer encoding
+    dmd_patterns[2] = changed
+    pof.upload_image_sequence({'patterns': list(dmd_patterns), 'number_of_repeats': 8})
+    assert pof.upload_timing['images_sent'] == 3 # the images below it move
+    controller = device.controller
+    assert controller.sequence_state == 'start'
+    for indx, dmd_pattern in enumerate(dmd_patterns):
+        np.testing.assert_array_equal(controller.images[indx][:, :, 0] > 0, dmd_pattern.pattern)
+
+
+def test_lut_definitions_are_not_error_checked():
+    device = DMDEmulator()
+    dmd = LightCrafter6500(device=device)
+    entries = [{'wait_for_trigger': False, 'exposure_time': exposure_time, 'dark_time': 0}
+               for exposure_time in (1000, 50, 1000)] # 50 us is rejected by the controller
+    dmd.program_LUT(entries) # does not raise
+    assert sorted(device.controller.lut) == [0, 2]
+    assert dmd.shadow['lut'] == {}
+    entries[1]['exposure_time'] = 500
+    assert dmd.program_LUT(entries) == [0, 1, 2] # everything is sent again
+    assert device.controller.lut[1]['exposure_time'] == 500
+    assert len(dmd.shadow['lut']) == 3
+    with pytest.raises(DmdError):
+        dmd.queue_command(0x1a35, [50, 0, 0]) # other queued commands are still checked
+        dmd.barrier()
+
+
+def test_unchanged_settings_are_not_written_again():
+    device = DMDEmulator()
+    dmd = LightCrafter6500(device=device)
+    counts = device.controller.command_counts
+    for repeat in range(2):
+        dmd.set_pattern_on_the_fly_mode()
+        dmd.long_axis_image_flip(True)
+        dmd.short_axis_image_flip(False)
+        dmd.trigger_in_1(200)
+        dmd.pattern_display_start_stop('stop')
+        dmd.barrier()
+    assert [counts[usb_code] for usb_code in (0x1a1b, 0x1008, 0x1009, 0x1a35, 0x1a24)] == [2, 1, 1, 1, 0] # 0x1a1b: read and write once
+    dmd.trigger_in_1(200, False)
+    dmd.barrier()
+    assert counts[0x1a35] == 2
+
+    dmd.input_source_configuration('primary_interface', '24_bits')
+    assert (dmd.mode, counts[0x1a00]) == ('video', 1)
+    dmd.set_pattern_on_the_fly_mode()
+    dmd.input_source_configuration('primary_interface', '24_bits') # skipped, the mode stays
+    assert (dmd.mode, counts[0x1a00]) == ('pattern_on_the_fly', 1)
+
+    dmd.resync() # reads the settings back, the next writes are compared with the device
+    assert counts[0x1008] == 2 and dmd.shadow['long_axis_flip']
+    dmd.long_axis_image_flip(True)
+    dmd.barrier()
+    assert counts[0x1008] == 2
+
+
+def test_program_lut_sends_only_changed_entries():
+    device = DMDEmulator()
+    dmd = LightCrafter6500(device=device)
+    counts = device.controller.command_counts
+    entries = [{'wait_for_trigger': False, 'exposure_time': 1000 + indx, 'dark_time': 100} for indx in range(6)]
+    assert dmd.program_LUT(entries, 3) == list(range(6))
+    assert dmd.program_LUT(entries, 3) == []
+    entries[2]['exposure_time'] = 5000
+    entries[4]['image_index'], entries[4]['bit_position'] = 1, 7
+    assert dmd.program_LUT(entries + [dict(entries[0], image_index=0)], 5) == [2, 4, 6]
+    assert counts[0x1a34] == 9
+    assert counts[0x1a31] == 3 # configured every time
+    controller = device.controller
+    assert controller.lut_configuration == (7, 5)
+    assert controller.lut[2]['exposure_time'] == 5000
+    assert (controller.lut[4]['image_index'], controller.lut[4]['bit_position']) == (1, 7)
+    assert controller.lut[6] == controller.lut[0]
+
+
+def test_stream_plays_every_chunk():
+    device = DMDEmulator()
+    pof = Pattern_on_the_fly(device=device)
+    dmd_patterns = stripes(7)
+    played = []
+
+    def wait(chunk):
+        controller = device.controller
+        assert controller.sequence_state == 'start'
+        assert controller.lut_configuration == (len(chunk), len(chunk))
+        for indx, dmd_pattern in enumerate(chunk):
+            assert controller.lut[indx]['exposure_time'] == dmd_pattern.exposure_time
+            np.testing.assert_array_equal(controller.images[indx][:, :, 0] > 0, dmd_pattern.pattern)
+        played.extend(chunk)
+
+    report = pof.stream_sequence((dmd_pattern for dmd_pattern in dmd_patterns), chunk_size=3, wait=wait)
+    assert played == dmd_patterns
+    assert (report['chunks'], report['patterns']) == (3, 7)
+    assert len(report['gaps']) == 2
+
+
+def test_stream_checks_a_list_for_triggers_first():
+    device = DMDEmulator()
+    pof = Pattern_on_the_fly(device=device)
+    dmd_patterns = stripes(5)
+    dmd_patterns[4].wait_for_trigger = True
+    with pytest.raises(Exception, match='trigger'):
+        pof.stream_sequence(dmd_patterns, chunk_size=2)
+    assert device.controller.command_counts[0x1a2a] == 0
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+
+TEST_PATTERNS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'test_patterns', '*')))
+
+
+def loaded_pattern(file, **settings):
+    settings.setdefault('cache', None)
+    dmd_pattern = dp.DMDPattern(**settings)
+    dmd_pattern.load_png(file)
+    return dmd_pattern
+
+
+@pytest.mark.parametrize('file', TEST_PATTERNS)
+def test_fast_rle_equals_reference(file):
+    dmd_pattern = loaded_pattern(file, compression='rle')
+    pattern_3d = dmd_pattern.color_pattern(dmd_pattern.pattern)
+    reference, reference_length = dmd_pattern.rle_compressed_image(pattern_3d)
+    fast, fast_length = dmd_pattern.fast_rle_compressed_image(pattern_3d)
+    assert fast_length == reference_length
+    np.testing.assert_array_equal(fast, np.array(reference, dtype=np.uint8))
+    # strided and wider inputs take the per channel comparison
+    strided, _ = dmd_pattern.fast_rle_compressed_image(np.asfortranarray(pattern_3d).astype(np.int64))
+    np.testing.assert_array_equal(strided, fast)
+
+
+def synthetic_frames():
+    """
+    :return (M, N, 3) uint8 frames with single pixels, runs of all lengths and repeated rows
+    """
+    rng = np.random.default_rng(2)
+    noise = rng.integers(0, 4, (40, 300, 3), dtype=np.uint8)*60
+    runs = np.repeat(rng.integers(0, 256, (40, 30, 3), dtype=np.uint8), rng.integers(1, 200, 30), axis=1)[:, :1920]
+    repeated = np.repeat(noise[:5], 8, axis=0)
+    return [noise, runs, repeated]
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_run_length_round_trip(compression):
+    dmd_pattern = dp.DMDPattern(compression=compression, cache=None)
+    encode = {'rle': dmd_pattern.fast_rle_compressed_image, 'erle': dmd_pattern.erle_compressed_image}[compression]
+    decode = {'rle': dmd_pattern.rle_decompressed_image, 'erle': dmd_pattern.erle_decompressed_image}[compression]
+    frames = synthetic_frames() + [loaded_pattern(file).color_pattern(loaded_pattern(file).pattern) 
+                                   for file in TEST_PATTERNS]
+    for frame in frames:
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        compressed, length = encode(frame)
+        assert length == len(compressed)
+        np.testing.assert_array_equal(decode(compressed, (frame.shape[1], frame.shape[0])), frame)
+
+
+@pytest.mark.parametrize('compression', ['none', 'rle', 'erle'])
+def test_decompress_pattern_reads_the_header(compression):
+    dmd_pattern = loaded_pattern(TEST_PATTERNS[0], compression=compression, bit_depth=1)
+    image_bits = dmd_pattern.compress_pattern()
+    assert bytes(image_bits[:4]) == b'Spld'
+    decoded = dmd_pattern.decompress_pattern(image_bits)
+    expected = dmd_pattern.color_pattern(dmd_pattern.pattern)
+    if compression == 'none': # one bit per value
+        expected = expected != 0
+    np.testing.assert_array_equal(decoded, expected)
+
+
+def test_erle_is_shorter_than_rle():
+    for file in TEST_PATTERNS:
+        frame = loaded_pattern(file).color_pattern(loaded_pattern(file).pattern)
+        dmd_pattern = dp.DMDPattern(cache=None)
+        assert dmd_pattern.erle_compressed_image(frame)[1] < dmd_pattern.fast_rle_compressed_image(frame)[1]
+
+
+def random_binary_patterns(count, seed=3, **settings):
+    """
+    :return count DMDPatterns with bit_depth 1 and random blocks of on pixels
+    """
+    rng = np.random.default_rng(seed)
+    dmd_patterns = []
+    for indx in range(count):
+        dmd_pattern = dp.DMDPattern(bit_depth=1, cache=None, **settings)
+        dmd_pattern.pattern = np.kron(rng.random((108, 192)) > 0.5, np.ones((10, 10), dtype=bool))
+        dmd_patterns.append(dmd_pattern)
+    return dmd_patterns
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_bit_plane_packing_round_trip(compact):
+    dmd_patterns = random_binary_patterns(24)
+    packed_pattern = dp.DMDPattern(compression='erle', cache=None, compact=compact)
+    packed_pattern.pack_bit_planes(dmd_patterns)
+    image = packed_pattern.decompress_pattern(packed_pattern.compress_pattern())
+    for bit_position, dmd_pattern in enumerate(dmd_patterns):
+        plane = (image[:, :, 2 - bit_position//8] >> (bit_position % 8)) & 1
+        np.testing.assert_array_equal(plane.astype(bool), dmd_pattern.pattern)
+    with pytest.raises(Exception):
+        packed_pattern.pack_bit_planes(random_binary_patterns(25))
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_set_rows_after_a_cache_hit(compression):
+    from pyDMD.PatternCache import PatternCache
+    cache = PatternCache()
+    pattern_a, pattern_b = [dmd_pattern.pattern for dmd_pattern in random_binary_patterns(2)]
+    cached = dp.DMDPattern(compression=compression, bit_depth=1, cache=cache)
+    cached.pattern = pattern_b.copy()
+    cached.compress_pattern() # pattern_b is in the cache now
+
+    dmd_pattern = dp.DMDPattern(compression=compression, bit_depth=1, cache=cache)
+    dmd_pattern.pattern = pattern_a.copy()
+    dmd_pattern.compress_pattern()
+    dmd_pattern.pattern[...] = pattern_b # in place, the stored array stays the same
+    dmd_pattern.compress_pattern() # cache hit
+    dmd_pattern.set_rows(0, np.ones((3, 1920), dtype=bool))
+
+    full = dp.DMDPattern(compression=compression, bit_depth=1, cache=None)
+    full.pattern = dmd_pattern.pattern.copy()
+    np.testing.assert_array_equal(dmd_pattern.compress_pattern(), full.compress_pattern())
+
+
+def test_set_rows_after_a_worker_encode():
+    from pyDMD.ParallelEncoder import ParallelEncoder
+    dmd_pattern = random_binary_patterns(1, compression='erle')[0]
+    dmd_pattern.compress_pattern()
+    dmd_pattern.pattern[...] = random_binary_patterns(1, seed=4)[0].pattern
+    encoder = ParallelEncoder(2, cache=None)
+    try:
+        encoder.encode([dmd_pattern])
+    finally:
+        encoder.close()
+    dmd_pattern.set_rows(5, np.zeros((2, 1920), dtype=bool))
+    full = dp.DMDPattern(compression='erle', bit_depth=1, cache=None)
+    full.pattern = dmd_pattern.pattern.copy()
+    np.testing.assert_array_equal(dmd_pattern.compress_pattern(), full.compress_pattern())
+
+
+@pytest.mark.parametrize('bit_depth', [1, 8])
+@pytest.mark.parametrize('compression', ['none', 'rle', 'erle'])
+@pytest.mark.parametrize('file', TEST_PATTERNS)
+def test_compact_storage_encodes_like_dense(file, compression, bit_depth):
+    dense = loaded_pattern(file, compression=compression, bit_depth=bit_depth)
+    compact = loaded_pattern(file, compression=compression, bit_depth=bit_depth, compact=True)
+    if bit_depth == 1: # bit-packed, on where any color is non zero
+        assert compact.storage == 'bits'
+        assert compact.stored_pattern.nbytes*8 == np.size(dense.binary_plane())
+        dense.pattern = dense.binary_plane()
+    else:
+        assert compact.storage == 'planes'
+    np.testing.assert_array_equal(compact.pattern, dense.pattern if bit_depth == 1 else dense.color_pattern(dense.pattern))
+    np.testing.assert_array_equal(compact.compress_pattern(), dense.compress_pattern())
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_compact_set_rows_encodes_like_dense(compression):
+    dense, compact = [random_binary_patterns(1, compression=compression, compact=compact)[0] for compact in (False, True)]
+    assert compact.storage == 'bits'
+    np.testing.assert_array_equal(compact.pattern, dense.pattern)
+    compact.compress_pattern()
+    rows = np.zeros((4, 1920), dtype=bool)
+    rows[:, 100:900] = True
+    for dmd_pattern in (dense, compact):
+        dmd_pattern.set_rows(20, rows)
+    np.testing.assert_array_equal(compact.compress_pattern(), dense.compress_pattern())
+
+
+def dense_shift(pattern, dx, dy):
+    shifted = np.zeros_like(pattern)
+    height, width = pattern.shape
+    if abs(dx) < width and abs(dy) < height:
+        shifted[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+            pattern[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+    return shifted
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('width', [1920, 1917])
+def test_operators_and_shifts_equal_dense(compact, width):
+    rng = np.random.default_rng(9)
+    pattern_a, pattern_b = rng.random((2, 64, width)) > 0.5
+    dmd_a, dmd_b = [dp.DMDPattern(bit_depth=1, cache=None, compact=compact) for indx in range(2)]
+    dmd_a.pattern, dmd_b.pattern = pattern_a, pattern_b
+    results = {'|': (dmd_a | dmd_b, pattern_a | pattern_b), '&': (dmd_a & pattern_b, pattern_a & pattern_b),
+               '^': (dmd_a ^ dmd_b, pattern_a ^ pattern_b), '-': (dmd_a - dmd_b, pattern_a & ~pattern_b),
+               '~': (~dmd_a, ~pattern_a), 'mask': (dmd_a.mask(dmd_b), pattern_a & pattern_b)}
+    for dx, dy in [(0, 0), (1, 0), (-3, 2), (13, -5), (-800, 7), (width, 0), (0, -64)]:
+        results['shift %s %s' %(dx, dy)] = (dmd_a.shift(dx, dy), dense_shift(pattern_a, dx, dy))
+    for name, (result, expected) in results.items():
+        assert np.shape(result.pattern) == expected.shape, name
+        np.testing.assert_array_equal(result.pattern, expected, err_msg=name)
+    with pytest.raises(Exception):
+        dmd_a | np.zeros((64, 8), dtype=bool)
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_in_place_operators_re_encode_changed_rows(compression):
+    compact = random_binary_patterns(1, compression=compression, compact=True)[0]
+    other = random_binary_patterns(1, seed=5)[0].pattern
+    other[100:] = False
+    expected = compact.pattern | other
+    compact.compress_pattern()
+    compact |= other
+    assert compact.dirty_rows is not None and not np.any(compact.dirty_rows[100:])
+    dense = dp.DMDPattern(compression=compression, bit_depth=1, cache=None)
+    dense.pattern = expected
+    np.testing.assert_array_equal(compact.pattern, expected)
+    np.testing.assert_array_equal(compact.compress_pattern(), dense.compress_pattern())
+    compact ^= other
+    compact &= ~dense
+    assert not np.any(compact.pattern)
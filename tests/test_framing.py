@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import math
+import numpy as np
+import pytest
+from pyDMD.DMDEmulator import DMDEmulator
+from pyDMD.LightCrafter6500 import LightCrafter6500
+
+
+class ReportRecorder():
+    """
+    Stands in for the USBdevice of a LightCrafter6500 and keeps the reports it is given.
+    """
+    def __init__(self, framed=True):
+        self.reports = []
+        if framed:
+            self.send_report = lambda report: self.reports.append(bytes(report))
+
+    def raw_command(self, buffer):
+        assert len(buffer) == 64
+        self.reports.append(bytes([0x00] + [int(value) for value in buffer]))
+
+
+def baseline_reports(dmd, image_bits):
+    """
+    :return the reports of the upload as the original send_image framed them, one command group at a time
+    """
+    recorder = ReportRecorder(framed=False)
+    dmd.USB_dev = recorder
+    n_groups = math.ceil(np.size(image_bits)/504)
+    if n_groups > 1:
+        for group in range(n_groups):
+            dmd.send_image_command(image_bits[504*group:504*(group + 1)], group)
+    dmd.send_image_command(image_bits[504*n_groups:], 0xab)
+    return recorder.reports
+
+
+@pytest.fixture
+def dmd():
+    return LightCrafter6500(device=DMDEmulator())
+
+
+@pytest.mark.parametrize('size', [505, 560, 561, 1008, 1009, 5000])
+def test_reports_equal_the_baseline(dmd, size):
+    image_bits = np.random.default_rng(size).integers(0, 256, size, dtype=np.uint8)
+    reports = [bytes(report) for report in dmd.image_reports(image_bits)]
+    assert reports == baseline_reports(dmd, image_bits)
+
+
+@pytest.mark.parametrize('framed', [False, True])
+def test_send_image_sends_the_framed_reports(dmd, framed):
+    image_bits = np.random.default_rng(1).integers(0, 256, 3000, dtype=np.uint8)
+    expected = [bytes(report) for report in dmd.image_reports(image_bits)]
+    dmd.USB_dev = ReportRecorder(framed)
+    dmd.send_image(image_bits)
+    assert dmd.USB_dev.reports == expected
+
+
+def test_small_image_is_sent_as_one_group(dmd):
+    image_bits = np.arange(1, 101, dtype=np.uint8)
+    reports = dmd.image_reports(image_bits)
+    assert len(reports) == 2 + 1
+    assert list(reports[0, 1:9]) == [0, 0, 104, 0, 0x2b, 0x1a, 100, 0]
+    payload = np.concatenate((reports[0, 9:], reports[1, 1:]))
+    np.testing.assert_array_equal(payload[:100], image_bits)
+    assert not np.any(payload[100:])
+    assert list(reports[-1, 1:9]) == [0, 0xab, 4, 0, 0x2b, 0x1a, 0, 0]
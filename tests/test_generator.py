@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.PatternGenerator import PatternGenerator
+
+ZERO_POINT = (957, 541)
+
+
+def pixel_grid():
+    """
+    :return x and y of every pixel relative to ZERO_POINT, as (1, 1920) and (1080, 1) arrays
+    """
+    return np.arange(1920)[None, :] - ZERO_POINT[0], np.arange(1080)[:, None] - ZERO_POINT[1]
+
+
+def drawn(shape, **parameters):
+    """
+    :return the shape drawn pixel by pixel on a full boolean frame
+    """
+    x, y = pixel_grid()
+    if shape == 'grating':
+        angle = parameters.get('angle', 0)
+        u = {0: x, 90: y, 180: -x, 270: -y}.get(angle % 360)
+        if u is None:
+            u = np.cos(np.deg2rad(angle))*x + np.sin(np.deg2rad(angle))*y
+        is_on = np.mod(u - parameters.get('phase', 0), parameters['period']) < parameters.get('duty_cycle', 0.5)*parameters['period']
+        return np.broadcast_to(is_on, (1080, 1920))
+    offset_x, offset_y = parameters.get('offset', (0, 0))
+    x, y = x - offset_x, y - offset_y
+    if shape == 'spots':
+        pitch = parameters['pitch']
+        dx, dy = np.mod(x + pitch/2, pitch) - pitch/2, np.mod(y + pitch/2, pitch) - pitch/2
+        return dx**2 + dy**2 <= parameters['radius']**2
+    if shape == 'circle':
+        return (x**2 + y**2 <= parameters['radius']**2) != parameters.get('inverted', False)
+    if shape == 'box':
+        width, height = parameters['size']
+        inside = (x >= -(width//2)) & (x < width - width//2) & (y >= -(height//2)) & (y < height - height//2)
+        return inside != parameters.get('inverted', False)
+    if shape == 'checkerboard':
+        size = parameters['square_size']
+        return (np.floor_divide(x, size) + np.floor_divide(y, size)) % 2 == 0
+
+
+SHAPES = [('grating', {'period': 10}),
+          ('grating', {'period': 7.5, 'phase': 2, 'duty_cycle': 0.3}),
+          ('grating', {'period': 12, 'angle': 90}),
+          ('grating', {'period': 12, 'angle': 180}),
+          ('grating', {'period': 9, 'angle': 30}),
+          ('spots', {'pitch': 40, 'radius': 8}),
+          ('spots', {'pitch': 33, 'radius': 5.5, 'offset': (3, -7)}),
+          ('circle', {'radius': 300}),
+          ('circle', {'radius': 700, 'offset': (-500, 100), 'inverted': True}),
+          ('box', {'size': (101, 40)}),
+          ('box', {'size': (400, 900), 'offset': (-900, 300), 'inverted': True}),
+          ('checkerboard', {'square_size': 16}),
+          ('checkerboard', {'square_size': 25, 'offset': (5, 3)})]
+
+
+@pytest.mark.parametrize('shape, parameters', SHAPES)
+def test_shapes_equal_pixel_drawings(shape, parameters):
+    generator = PatternGenerator(zero_point=ZERO_POINT)
+    packed = generator.generate(shape, **parameters)
+    np.testing.assert_array_equal(np.unpackbits(packed, axis=1).view(bool), drawn(shape, **parameters))
+
+
+def test_generated_patterns_are_cached():
+    generator = PatternGenerator(zero_point=ZERO_POINT)
+    assert generator.generate('spots', pitch=40, radius=8) is generator.generate('spots', radius=8, pitch=40)
+    with pytest.raises(Exception):
+        generator.generate('triangle', size=3)
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_generated_pattern_encodes_like_dense(compression):
+    generator = PatternGenerator(zero_point=ZERO_POINT)
+    dmd_pattern = generator.dmd_pattern('circle', radius=200, compression=compression, exposure_time=500, cache=None)
+    assert (dmd_pattern.storage, dmd_pattern.exposure_time) == ('bits', 500)
+    dense = dp.DMDPattern(compression=compression, bit_depth=1, cache=None)
+    dense.pattern = drawn('circle', radius=200)
+    np.testing.assert_array_equal(dmd_pattern.compress_pattern(), dense.compress_pattern())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.Halftone import Halftone, bayer_matrix, blue_noise_matrix
+
+
+def floyd_steinberg(image, threshold=128):
+    """
+    :return the error diffusion of one image, pixel by pixel in row order
+    """
+    levels = np.asarray(image, dtype=np.float32).copy()
+    height, width = levels.shape
+    binary = np.zeros(levels.shape, dtype=bool)
+    for y in range(height):
+        for x in range(width):
+            binary[y, x] = levels[y, x] >= threshold
+            error = levels[y, x] - 255*binary[y, x]
+            if x + 1 < width:
+                levels[y, x + 1] += 7/16*error
+            if y + 1 < height:
+                if x > 0:
+                    levels[y + 1, x - 1] += 3/16*error
+                levels[y + 1, x] += 5/16*error
+                if x + 1 < width:
+                    levels[y + 1, x + 1] += 1/16*error
+    return binary
+
+
+def gray_images(count=2, shape=(24, 32)):
+    return np.random.default_rng(7).integers(0, 256, (count,) + shape).astype(np.uint8)
+
+
+def test_error_diffusion_equals_pixel_order():
+    images = gray_images()
+    packed = Halftone('error_diffusion').to_bits(images)
+    for frame, image in zip(packed, images):
+        np.testing.assert_array_equal(frame, np.packbits(floyd_steinberg(image), axis=-1))
+
+
+@pytest.mark.parametrize('ranks', [bayer_matrix(8), blue_noise_matrix(16)])
+def test_threshold_matrices_rank_every_pixel(ranks):
+    np.testing.assert_array_equal(np.sort(ranks.ravel()), np.arange(ranks.size))
+
+
+@pytest.mark.parametrize('method', ['bayer', 'blue_noise', 'error_diffusion'])
+@pytest.mark.parametrize('level', [0, 40, 128, 200, 255])
+def test_fraction_on_follows_the_gray_level(method, level):
+    halftone = Halftone(method, blue_noise_size=16)
+    binary = np.unpackbits(halftone.to_bits(np.full((64, 64), level, dtype=np.uint8)), axis=-1)
+    assert abs(binary.mean() - level/255) <= 1/64
+
+
+@pytest.mark.parametrize('method', ['threshold', 'bayer', 'blue_noise'])
+def test_stacks_colors_and_single_frames_agree(method):
+    images = gray_images()
+    halftone = Halftone(method, blue_noise_size=16)
+    stack = halftone.to_bits(images)
+    colors = halftone.to_bits(np.repeat(images[..., None], 3, axis=-1))
+    for frame, image in zip(stack, images):
+        np.testing.assert_array_equal(frame, halftone.to_bits(image))
+    np.testing.assert_array_equal(colors, stack)
+    with pytest.raises(Exception):
+        Halftone('dots')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_halftone_pattern(compact):
+    gray = np.tile(np.linspace(0, 255, 1920).astype(np.uint8), (1080, 1))
+    dmd_pattern = dp.DMDPattern(compression='erle', cache=None, compact=compact)
+    dmd_pattern.load_pattern(gray, halftone='bayer')
+    assert dmd_pattern.storage == ('bits' if compact else 'dense')
+    np.testing.assert_array_equal(np.packbits(dmd_pattern.pattern, axis=1), Halftone('bayer').to_bits(gray))
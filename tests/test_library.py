@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.PatternLibrary import PatternLibrary, main
+
+
+def squares(count):
+    """
+    :return count binary DMDPatterns with a square each
+    """
+    dmd_patterns = []
+    for indx in range(count):
+        dmd_pattern = dp.DMDPattern(compression='erle', bit_depth=1, cache=None, exposure_time=1000 + indx)
+        pattern = np.zeros((1080, 1920), dtype=bool)
+        pattern[100*indx:100*indx + 50, 100:150] = True
+        dmd_pattern.pattern = pattern
+        dmd_patterns.append(dmd_pattern)
+    return dmd_patterns
+
+
+def test_build_append_and_read_back(tmp_path):
+    file = str(tmp_path / 'patterns.dmdlib')
+    dmd_patterns = squares(3)
+    library = PatternLibrary.build(file, dmd_patterns[:2], ['a', 'b'])
+    library.append(dmd_patterns[2:] + dmd_patterns[:1], ['c', 'a_again'])
+    assert len(library) == 4
+    for name, dmd_pattern in zip(['a', 'b', 'c', 'a_again'], dmd_patterns + dmd_patterns[:1]):
+        np.testing.assert_array_equal(library.image_bits(name), dmd_pattern.compress_pattern())
+        assert library.settings(name)['exposure_time'] == dmd_pattern.exposure_time
+    assert library.entry('a')['offset'] == library.entry('a_again')['offset'] # stored once
+    assert library.verify(decode=True) == []
+    library.close()
+    assert len(library) == 0 and 'a' not in library
+
+
+def test_failed_build_keeps_the_old_library(tmp_path):
+    file = str(tmp_path / 'patterns.dmdlib')
+    PatternLibrary.build(file, squares(2), ['a', 'b']).close()
+    with pytest.raises(Exception):
+        PatternLibrary.build(file, squares(2), ['c', 'c'])
+    library = PatternLibrary(file)
+    assert sorted(library.names) == ['a', 'b']
+    library.close()
+
+    replaced = PatternLibrary.build(file, squares(1), ['c'])
+    assert sorted(replaced.names) == ['c']
+    replaced.close()
+
+
+def test_command_line_builds_over_an_open_library(tmp_path):
+    file = str(tmp_path / 'patterns.dmdlib')
+    pattern_files = []
+    for indx, dmd_pattern in enumerate(squares(2)):
+        pattern_files.append(str(tmp_path / ('square%s.npy' %indx)))
+        np.save(pattern_files[-1], dmd_pattern.pattern)
+    assert main(['build', file] + pattern_files) == 0
+    assert main(['build', file] + pattern_files[:1]) == 0
+    assert main(['append', file] + pattern_files[1:]) == 0
+    assert main(['verify', file, '--decode']) == 0
+    library = PatternLibrary(file)
+    assert sorted(library.names) == ['square0', 'square1']
+    library.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.ParallelEncoder import ParallelEncoder, BackgroundEncoder
+
+
+def noise_patterns(count, compression='erle'):
+    dmd_patterns = []
+    for seed in range(count):
+        dmd_pattern = dp.DMDPattern(compression=compression, bit_depth=1, cache=None)
+        dmd_pattern.pattern = np.random.default_rng(seed).random((1080, 1920)) > 0.5
+        dmd_patterns.append(dmd_pattern)
+    return dmd_patterns
+
+
+def shared_memory_blocks():
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')} if os.path.isdir('/dev/shm') else set()
+
+
+def test_pool_output_equals_serial_output():
+    dmd_patterns = noise_patterns(4)
+    dmd_patterns.append(dmd_patterns[1]) # duplicates are encoded once
+    encoder = ParallelEncoder(2, cache=None)
+    try:
+        encoded_patterns = encoder.encode(dmd_patterns)
+    finally:
+        encoder.close()
+    for image_bits, dmd_pattern in zip(encoded_patterns, dmd_patterns):
+        np.testing.assert_array_equal(image_bits, dmd_pattern.compress_pattern())
+
+
+def test_failing_worker_frees_shared_memory():
+    broken = dp.DMDPattern(compression='erle', cache=None)
+    broken.set_stored_pattern(np.zeros(100, dtype=np.uint8), 'dense') # a 1D frame fails in the worker
+    dmd_patterns = noise_patterns(6)
+    dmd_patterns.insert(1, broken)
+    before = shared_memory_blocks()
+    encoder = ParallelEncoder(2, cache=None)
+    try:
+        with pytest.raises(Exception):
+            encoder.encode(dmd_patterns)
+    finally:
+        encoder.close()
+    assert shared_memory_blocks() - before == set()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_background_encoder_keeps_the_order(workers):
+    dmd_patterns = noise_patterns(5)
+    order = list(reversed(range(len(dmd_patterns))))
+    encoder = ParallelEncoder(workers, cache=None)
+    try:
+        encoded = list(BackgroundEncoder(encoder, dmd_patterns, order, queue_size=2))
+    finally:
+        encoder.close()
+    assert [index for index, image_bits in encoded] == order
+    for index, image_bits in encoded:
+        np.testing.assert_array_equal(image_bits, dmd_patterns[index].compress_pattern())
+
+
+def test_background_encoder_raises_encoding_errors():
+    broken = dp.DMDPattern(compression='erle', cache=None)
+    broken.set_stored_pattern(np.zeros(100, dtype=np.uint8), 'dense')
+    dmd_patterns = noise_patterns(2) + [broken]
+    received = []
+    with pytest.raises(Exception):
+        for index, image_bits in BackgroundEncoder(ParallelEncoder(1, cache=None), dmd_patterns, range(3)):
+            received.append(index)
+    assert received == [0, 1]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.DMDEmulator import DMDEmulator
+from pyDMD.LightCrafter6500 import LightCrafter6500, DmdError
+from pyDMD.MemoryPlanner import MemoryPlanner, DLPC900_MEMORY_BYTES
+from pyDMD.Pattern_on_the_fly import Pattern_on_the_fly
+
+
+def bars(count):
+    """
+    :return count binary DMDPatterns with a vertical bar each
+    """
+    dmd_patterns = []
+    for indx in range(count):
+        dmd_pattern = dp.DMDPattern(compression='erle', bit_depth=1, cache=None, exposure_time=1000)
+        pattern = np.zeros((1080, 1920), dtype=bool)
+        pattern[:, 60*indx:60*indx + 30] = True
+        dmd_pattern.pattern = pattern
+        dmd_patterns.append(dmd_pattern)
+    return dmd_patterns
+
+
+def test_default_limits():
+    planner = MemoryPlanner()
+    assert planner.memory_bytes == DLPC900_MEMORY_BYTES == 103680000
+    assert planner.max_images is None
+    report = planner.plan([5000]*40, [(indx, 0) for indx in range(40)])
+    assert report['fits'] and report['batches'][0]['patterns'] == list(range(40))
+    assert 'memory 103680000 bytes: fits' in planner.summary(report)
+    assert planner.always_fits(12) and not planner.always_fits(13) # 8.3 MB for a 1080p image in the worst case
+    assert MemoryPlanner(memory_bytes=None).always_fits(1000)
+
+
+def test_limits_the_caller_sets():
+    planner = MemoryPlanner(memory_bytes=10000, max_images=18, max_patterns=30, alignment=512)
+    lut_positions = [(indx, 0) for indx in range(40)]
+    report = planner.plan([1000]*40, lut_positions)
+    assert [len(batch['patterns']) for batch in report['batches']] == [9]*4 + [4] # 1024 bytes per image
+    report = MemoryPlanner(max_images=18).plan([1000]*40, lut_positions)
+    assert [len(batch['patterns']) for batch in report['batches']] == [18, 18, 4]
+    assert not report['fits']
+    report = planner.plan([20000, 10], [(0, 0), (1, 0)])
+    assert report['problems'] == [(0, "needs 20480 bytes, the memory has 10000")]
+
+
+def test_long_unpacked_sequence_uploads_with_the_defaults():
+    device = DMDEmulator()
+    pof = Pattern_on_the_fly(device=device)
+    dmd_patterns = bars(25)
+    pof.upload_image_sequence({'patterns': list(dmd_patterns), 'number_of_repeats': 1})
+    controller = device.controller
+    assert controller.sequence_state == 'start'
+    for indx, dmd_pattern in enumerate(dmd_patterns):
+        np.testing.assert_array_equal(controller.images[indx][:, :, 0] > 0, dmd_pattern.pattern)
+
+
+def test_sequence_larger_than_the_memory():
+    dmd_patterns = bars(6)
+    memory_bytes = sum(np.size(dmd_pattern.compress_pattern()) for dmd_pattern in dmd_patterns[:4])
+    device = DMDEmulator(memory_bytes=memory_bytes)
+    pof = Pattern_on_the_fly(device=device, planner=MemoryPlanner(memory_bytes=memory_bytes))
+    with pytest.raises(Exception):
+        pof.upload_image_sequence({'patterns': list(dmd_patterns), 'number_of_repeats': 1})
+    assert device.controller.command_counts[0x1a2a] == 0 # nothing was sent
+
+    batches = pof.upload_batches({'patterns': dmd_patterns, 'number_of_repeats': 1})
+    for batch, played in zip(batches, [[0, 1, 2, 3], [4, 5]]):
+        assert batch['patterns'] == played
+        for indx, pattern_index in enumerate(played):
+            image = device.controller.images[indx]
+            np.testing.assert_array_equal(image[:, :, 0] > 0, dmd_patterns[pattern_index].pattern)
+
+
+def test_emulator_reads_the_images_from_its_memory():
+    device = DMDEmulator()
+    dmd = LightCrafter6500(device=device)
+    short, long = bars(1)[0].compress_pattern(), bars(30)[29].compress_pattern()
+    entries = [{'wait_for_trigger': False, 'exposure_time': 1000, 'image_index': indx} for indx in range(2)]
+    dmd.program_LUT(entries)
+    dmd.load_image(1, short)
+    dmd.load_image(0, short)
+    assert device.controller.image_table == {1: (0, len(short)), 0: (len(short), len(short))}
+    assert device.controller.image_bits[0] == short.tobytes()
+    dmd.pattern_display_start_stop('start')
+
+    # a longer image 1 overwrites the start of image 0, which was not sent again
+    dmd.pattern_display_start_stop('stop')
+    device.controller.upload = None
+    dmd.initialize_pattern_BMP_load(len(long) + len(short), index=1)
+    dmd.send_image(np.concatenate((long, short)))
+    with pytest.raises(DmdError):
+        dmd.pattern_display_start_stop('start')
+    assert device.controller.image_bits[0] != short.tobytes()
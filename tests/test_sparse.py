@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+import pyDMD.DMDPattern as dp
+from pyDMD.SparsePattern import SparsePattern
+
+
+def sparse_scene(compression):
+    """
+    :return SparsePattern with overlapping boxes and disks, lines across the frame and repeated rows
+    """
+    sparse = SparsePattern(compression=compression, cache=None)
+    sparse.add_box(100, 100, 400, 300)
+    sparse.add_box(350, 250, 1920, 260) # overlaps the first box, runs longer than 255
+    sparse.add_disk((960, 540), 120.5)
+    sparse.add_disk((5, 1075), 30) # cut by the frame
+    sparse.add_spans([700, 700, 700, 1079], [0, 10, 11, 0], [10, 11, 1920, 10]) # touching spans
+    return sparse
+
+
+def dense_like(sparse):
+    dense = dp.DMDPattern(compression=sparse.compression, bit_depth=1, cache=None)
+    dense.pattern = sparse.pattern
+    return dense
+
+
+@pytest.mark.parametrize('compression', ['none', 'rle', 'erle'])
+def test_sparse_encodes_like_dense(compression):
+    sparse = sparse_scene(compression)
+    np.testing.assert_array_equal(sparse.compress_pattern(), dense_like(sparse).compress_pattern())
+    empty = SparsePattern(compression=compression, cache=None)
+    np.testing.assert_array_equal(empty.compress_pattern(), dense_like(empty).compress_pattern())
+
+
+def test_spans_are_merged_and_drawn():
+    sparse = sparse_scene('rle')
+    spans = sparse.stored_pattern
+    assert np.all(spans[1:, 0]*2000 + spans[1:, 1] > spans[:-1, 0]*2000 + spans[:-1, 2]) # sorted, apart
+    assert list(spans[spans[:, 0] == 700, 1:].ravel()) == [0, 1920]
+    x, y = np.arange(1920)[None, :], np.arange(1080)[:, None]
+    expected = (x >= 100) & (x < 400) & (y >= 100) & (y < 300)
+    expected |= (x >= 350) & (y >= 250) & (y < 260)
+    expected |= (x - 960)**2 + (y - 540)**2 <= 120.5**2
+    expected |= (x - 5)**2 + (y - 1075)**2 <= 30**2
+    expected[700] = True
+    expected[1079, :10] = True
+    np.testing.assert_array_equal(sparse.pattern, expected)
+
+    converted = SparsePattern(cache=None)
+    converted.pattern = expected
+    np.testing.assert_array_equal(converted.stored_pattern, spans)
+    assert converted.nbytes() < expected.nbytes/100
+
+
+@pytest.mark.parametrize('compression', ['rle', 'erle'])
+def test_sparse_set_rows_encodes_like_dense(compression):
+    sparse = sparse_scene(compression)
+    sparse.compress_pattern()
+    rows = np.zeros((3, 1920), dtype=bool)
+    rows[:, 500:900] = True
+    sparse.set_rows(98, rows)
+    np.testing.assert_array_equal(sparse.compress_pattern(), dense_like(sparse).compress_pattern())
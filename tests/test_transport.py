@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import os
+import time
+import threading
+import numpy as np
+import pytest
+from pyDMD.Transport import Transport, HidrawTransport, PseudoDevice, find_hidraw, continuation_count
+from pyDMD.USBdevice import USBdevice
+from pyDMD.LightCrafter6500 import LightCrafter6500
+
+
+def test_transports_have_to_write():
+    with pytest.raises(TypeError):
+        Transport()
+
+    class Silent(Transport):
+        pass
+    with pytest.raises(TypeError):
+        Silent()
+
+
+@pytest.mark.parametrize('length, count', [(2, 0), (60, 0), (61, 1), (124, 1), (125, 2), (508, 7)])
+def test_continuation_count(length, count):
+    assert continuation_count([0x00, 0x01, length & 0xff, length >> 8, 0x2b, 0x1a]) == count
+
+
+def test_find_hidraw(tmp_path):
+    devices = {'hidraw0': "HID_ID=0003:0000046D:0000C52B\n", 'hidraw1': None,
+               'hidraw3': "DRIVER=hid-generic\nHID_ID=0003:00000451:0000C900\nHID_NAME=DLPC900\n"}
+    for name, uevent in devices.items():
+        os.makedirs(tmp_path / name / 'device')
+        if uevent is not None:
+            (tmp_path / name / 'device' / 'uevent').write_text(uevent)
+    assert find_hidraw(0x0451, 0xc900, str(tmp_path)) == '/dev/hidraw3'
+    assert find_hidraw(0x0451, 0xc901, str(tmp_path)) is None
+
+
+def test_hidraw_writes_whole_reports(tmp_path):
+    path = str(tmp_path / 'hidraw0')
+    open(path, 'wb').close()
+    transport = HidrawTransport(path=path)
+    transport.reader.join(1) # a file has no replies, the reader stops at its end
+    reports = np.arange(3*65, dtype=np.uint8).reshape(3, 65)
+    transport.write([0x00] + [0x40]*64)
+    transport.write(memoryview(reports[0]))
+    transport.write_reports(reports[1:])
+    with pytest.raises(Exception):
+        transport.write([0x00]*10) # a short write is an error
+    transport.close()
+    with open(path, 'rb') as file:
+        assert file.read() == bytes([0x00] + [0x40]*64) + reports.tobytes() + bytes(10)
+
+
+def test_upload_through_a_pseudo_device():
+    device = PseudoDevice()
+    usb_device = USBdevice(transport=device.transport())
+    try:
+        dmd = LightCrafter6500(usb_device) # reads the display mode, the answer comes from the device thread
+        n_setup = len(device.commands)
+        image_bits = np.random.default_rng(1).integers(0, 256, 1100, dtype=np.uint8)
+        dmd.send_image(image_bits)
+        dmd.barrier()
+        dmd.queue_command(0x0100, mode='r')
+        dmd.barrier()
+    finally:
+        usb_device.releaseUSB()
+        device.close()
+    groups = [command for command in device.commands[n_setup:] if command[4:6] == b'\x2b\x1a']
+    assert [command[1] for command in groups] == [0, 1, 2, 0xab]
+    payload = b''.join(command[8:8 + command[6] + (command[7] << 8)] for command in groups)
+    assert payload == image_bits.tobytes()
+    assert all(len(report) == 65 and report[0] == 0 for report in device.reports)
+
+
+class Loopback(Transport):
+    """
+    Answers every report with its first 5 bytes from a thread, after delay seconds.
+    """
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.reply_handler = None
+
+    def write(self, report):
+        answer = list(report[:5]) + [0]*60
+        threading.Timer(self.delay, self.reply_handler, (answer,)).start()
+
+
+def test_wait_for_reply_wakes_on_the_answer():
+    usb_device = USBdevice(transport=Loopback(), reply_timeout=0.2)
+    start = time.perf_counter()
+    usb_device.send_command([0x00, 0xc0, 0x21, 2, 0] + [0]*60)
+    answer = usb_device.wait_for_reply(0x21, timeout=5)
+    assert time.perf_counter() - start < 1
+    assert answer[:3] == [0x00, 0xc0, 0x21]
+    assert usb_device.wait_for_reply(0x21) is None # picked up already, times out after reply_timeout
+
+
+def test_answers_are_matched_by_sequence_byte():
+    transport = Loopback(delay=0)
+    usb_device = USBdevice(transport=transport)
+    for sequence_byte in (0x80, 0x81):
+        usb_device.send_command([0x00, 0xc0, sequence_byte, 2, 0] + [0]*60)
+    time.sleep(0.1)
+    assert usb_device.wait_for_reply(0x81, timeout=0)[2] == 0x81
+    assert usb_device.wait_for_reply(0x80, timeout=0)[2] == 0x80
+    transport.delay = 0.5
+    usb_device.send_command([0x00, 0xc0, 0x80, 2, 0] + [0]*60)
+    start = time.perf_counter()
+    assert usb_device.wait_for_reply(0x80, timeout=0.05) is None
+    assert time.perf_counter() - start < 0.4